@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# This script measures password hashing throughput, the latency of each db_access function,
+# the cost of writing an audit entry and end-to-end /user/authenticate latency. Results are saved
+# as JSON and can be compared with an earlier run to spot regressions.
+# Example use (from the application directory):
+# PYTHONPATH=. python3 benchmarks/run_benchmarks.py --output bench.json
+# PYTHONPATH=. python3 benchmarks/run_benchmarks.py --compare bench.json
+#
+# By default the DB access benchmarks run against a throwaway SQLite file. Set
+# SQLALCHEMY_DATABASE_URI to benchmark against PostgreSQL instead - only users whose IDs start
+# with 'benchmark-' get created and deleted.
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+_work_dir = tempfile.mkdtemp(prefix='login-api-benchmarks-')
+os.environ.setdefault('SETTINGS', 'test')
+os.environ.setdefault('LOGGING_CONFIG_FILE_PATH', 'logging_config.json')
+os.environ.setdefault('FAULT_LOG_FILE_PATH', '/dev/null')
+os.environ.setdefault(
+    'SQLALCHEMY_DATABASE_URI', 'sqlite:///{}'.format(os.path.join(_work_dir, 'benchmark.db'))
+)
+os.environ.setdefault('PASSWORD_SALT', 'benchmarksalt')
+os.environ.setdefault('PORT', '8005')
+
+from config import CONFIG_DICT  # noqa: E402
+from service import (  # noqa: E402
+    auditing, db, db_access, hashing, logging_config, security, server
+)
+
+USER_ID_PREFIX = 'benchmark-'
+PASSWORD = 'benchmarkpassword'
+JSON_CONTENT_TYPE_HEADER = {'Content-Type': 'application/json'}
+AUTHENTICATE_ROUTE = '/user/authenticate'
+DEFAULT_REGRESSION_THRESHOLD = 0.1
+
+
+def main():
+    args = _parse_args()
+
+    results = {}
+    results.update(_benchmark_hashing(args.hashes))
+    results.update(_benchmark_audit(args.iterations))
+
+    db.create_all()
+    try:
+        results.update(_benchmark_db_access(args.iterations))
+        results.update(_benchmark_authenticate(args.auth_iterations))
+    finally:
+        _delete_benchmark_users()
+
+    report = {'metadata': _get_metadata(), 'results': results}
+    _print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+        print('Results saved to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if _compare_results(baseline['results'], results, args.threshold):
+            sys.exit(1)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Runs the login API benchmarks')
+    parser.add_argument('--output', help='file to save the results to, as JSON')
+    parser.add_argument('--compare', help='results of an earlier run to compare against')
+    parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+        help='relative slowdown reported as a regression (default: 0.1)'
+    )
+    parser.add_argument(
+        '--iterations', type=int, default=200,
+        help='calls per DB access and audit benchmark (default: 200)'
+    )
+    parser.add_argument(
+        '--auth-iterations', type=int, default=20,
+        help='requests per authentication scenario (default: 20)'
+    )
+    parser.add_argument(
+        '--hashes', type=int, default=20,
+        help='hashes computed by each process in the hashing benchmark (default: 20)'
+    )
+    return parser.parse_args()
+
+
+def _benchmark_hashing(hashes_per_process):
+    results = {}
+    process_counts = sorted({1, os.cpu_count() or 1})
+    for process_count in process_counts:
+        with ProcessPoolExecutor(max_workers=process_count) as pool:
+            # Makes sure all the processes are up before the clock starts
+            list(pool.map(_hash_password, range(process_count)))
+
+            start = time.perf_counter()
+            list(pool.map(_hash_password, range(process_count * hashes_per_process)))
+            seconds = time.perf_counter() - start
+
+        hash_count = process_count * hashes_per_process
+        results['hashing.get_user_password_hash[processes={}]'.format(process_count)] = {
+            'processes': process_count,
+            'hashes': hash_count,
+            'seconds': seconds,
+            'hashes_per_second': hash_count / seconds,
+            'hashes_per_second_per_core': hash_count / seconds / process_count,
+        }
+
+    algorithm, params = hashing.get_hash_settings()
+    results['security.hash_password[{}]'.format(algorithm)] = _measure(
+        lambda i: security.hash_password(USER_ID_PREFIX, PASSWORD, algorithm, params),
+        hashes_per_process
+    )
+    return results
+
+
+def _hash_password(i):
+    return security.get_user_password_hash(
+        '{}{}'.format(USER_ID_PREFIX, i), PASSWORD, CONFIG_DICT['PASSWORD_SALT']
+    )
+
+
+def _benchmark_audit(iterations):
+    audit_log_path = os.path.join(_work_dir, 'audit.log')
+    # The handler of the audit log in logging_config.json, which checks for rotations on each entry
+    handler = logging_config.CompressingRotatingFileHandler(
+        audit_log_path, maxBytes=100000000, backupCount=1
+    )
+    with open(CONFIG_DICT['LOGGING_CONFIG_FILE_PATH']) as file:
+        handler.setFormatter(
+            logging.Formatter(json.load(file)['formatters']['default']['format'])
+        )
+
+    audit_logger = logging.getLogger(auditing.AUDITING_LOGGER_NAME)
+    original_level = audit_logger.level
+    audit_logger.addHandler(handler)
+    audit_logger.setLevel(logging.INFO)
+    try:
+        return {'auditing.audit': _measure(
+            lambda i: auditing.audit('Invalid credentials used. username: {}{}, attempt: 1.'.format(
+                USER_ID_PREFIX, i
+            )),
+            iterations
+        )}
+    finally:
+        audit_logger.removeHandler(handler)
+        audit_logger.setLevel(original_level)
+        handler.close()
+
+
+def _benchmark_db_access(iterations):
+    password_hash = _get_password_hash()
+    user_ids = ['{}db-{}'.format(USER_ID_PREFIX, i) for i in range(iterations)]
+    existing_user_id = user_ids[0]
+
+    results = {}
+    results['db_access.create_user'] = _measure(
+        lambda i: db_access.create_user(user_ids[i], password_hash), iterations
+    )
+    results['db_access.get_user'] = _measure(
+        lambda i: db_access.get_user(existing_user_id, password_hash), iterations
+    )
+    results['db_access.get_user_credentials'] = _measure(
+        lambda i: db_access.get_user_credentials(existing_user_id), iterations
+    )
+    results['db_access.get_failed_logins'] = _measure(
+        lambda i: db_access.get_failed_logins(existing_user_id), iterations
+    )
+    results['db_access.update_failed_logins'] = _measure(
+        lambda i: db_access.update_failed_logins(existing_user_id, 0), iterations
+    )
+    results['db_access.record_login_attempt'] = _measure(
+        lambda i: db_access.record_login_attempt(
+            existing_user_id, i % 2 == 0, server.MAX_LOGIN_ATTEMPTS
+        ),
+        iterations
+    )
+    results['db_access.apply_failed_logins_changes'] = _measure(
+        lambda i: db_access.apply_failed_logins_changes({
+            user_id: (i % 2 == 0, 1) for user_id in user_ids[:100]
+        }),
+        iterations
+    )
+    results['db_access.update_user'] = _measure(
+        lambda i: db_access.update_user(existing_user_id, password_hash), iterations
+    )
+    results['db_access.get_all_user_ids'] = _measure(
+        lambda i: sum(1 for _ in db_access.get_all_user_ids()), 10
+    )
+    results['db_access.delete_user'] = _measure(
+        lambda i: db_access.delete_user(user_ids[i]), iterations
+    )
+    return results
+
+
+def _benchmark_authenticate(iterations):
+    password_hash = _get_password_hash()
+    users = {
+        'success': 0,
+        'failure': 0,
+        'locked': server.MAX_LOGIN_ATTEMPTS + 1,
+    }
+    for scenario, failed_logins in users.items():
+        db_access.create_user(USER_ID_PREFIX + scenario, password_hash)
+        db_access.update_failed_logins(USER_ID_PREFIX + scenario, failed_logins)
+
+    client = server.app.test_client()
+
+    def authenticate(user_id, password):
+        response = client.post(
+            AUTHENTICATE_ROUTE,
+            data=json.dumps({'credentials': {'user_id': user_id, 'password': password}}),
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+        if response.status_code not in (200, 401):
+            raise Exception('Unexpected response status: {}'.format(response.status_code))
+
+    return {
+        'authenticate[success]': _measure(
+            lambda i: authenticate(USER_ID_PREFIX + 'success', PASSWORD), iterations
+        ),
+        'authenticate[failure]': _measure(
+            lambda i: authenticate(USER_ID_PREFIX + 'failure', 'wrongpassword'), iterations,
+            # Keeps the account from getting locked
+            setup=lambda i: db_access.update_failed_logins(USER_ID_PREFIX + 'failure', 0)
+        ),
+        'authenticate[locked]': _measure(
+            lambda i: authenticate(USER_ID_PREFIX + 'locked', PASSWORD), iterations
+        ),
+        'authenticate[unknown]': _measure(
+            lambda i: authenticate(USER_ID_PREFIX + 'unknown', PASSWORD), iterations
+        ),
+    }
+
+
+def _get_password_hash():
+    algorithm, params = hashing.get_hash_settings()
+    return security.hash_password(USER_ID_PREFIX, PASSWORD, algorithm, params)
+
+
+def _delete_benchmark_users():
+    db.session.rollback()
+    db_access.User.query.filter(db_access.User.user_id.startswith(USER_ID_PREFIX)).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+
+
+def _measure(fn, iterations, setup=None):
+    timings = []
+    for i in range(iterations):
+        if setup:
+            setup(i)
+        start = time.perf_counter()
+        fn(i)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': statistics.mean(timings),
+        'median_ms': statistics.median(timings),
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'min_ms': timings[0],
+        'max_ms': timings[-1],
+    }
+
+
+def _get_metadata():
+    algorithm, params = hashing.get_hash_settings()
+    return {
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'database': db.engine.dialect.name,
+        'hashing_pool_size': CONFIG_DICT['HASHING_POOL_SIZE'],
+        'password_hash_algorithm': algorithm,
+        'password_hash_params': params,
+    }
+
+
+def _print_results(results):
+    for name, result in sorted(results.items()):
+        if 'median_ms' in result:
+            print('{:<55} median {:>10.3f} ms  p95 {:>10.3f} ms'.format(
+                name, result['median_ms'], result['p95_ms']
+            ))
+        else:
+            print('{:<55} {:>10.1f} hashes/s per core'.format(
+                name, result['hashes_per_second_per_core']
+            ))
+
+
+def _compare_results(baseline, results, threshold):
+    # Returns True when any benchmark got slower than the threshold allows
+    regressed = False
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+
+        if 'median_ms' in result:
+            change = result['median_ms'] / baseline[name]['median_ms'] - 1
+        else:
+            change = (
+                baseline[name]['hashes_per_second_per_core'] /
+                result['hashes_per_second_per_core'] - 1
+            )
+
+        if change > threshold:
+            regressed = True
+            print('REGRESSION {:<55} {:+.1%} slower'.format(name, change))
+        else:
+            print('ok         {:<55} {:+.1%}'.format(name, change))
+
+    return regressed
+
+
+if __name__ == '__main__':
+    main()
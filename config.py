@@ -1,11 +1,73 @@
 import os
+import re
 from typing import Dict, Union
 
 logging_config_file_path = os.environ['LOGGING_CONFIG_FILE_PATH']
 fault_log_file_path = os.environ['FAULT_LOG_FILE_PATH']
 sqlalchemy_database_uri = os.environ['SQLALCHEMY_DATABASE_URI']
+# DB driver used by SQLAlchemy (e.g. pg8000 or psycopg2), replacing the one in the URI when set
+db_driver = os.environ.get('DB_DRIVER', '')
+if db_driver:
+    sqlalchemy_database_uri = re.sub(
+        r'^postgresql(\+\w+)?://', 'postgresql+{}://'.format(db_driver), sqlalchemy_database_uri
+    )
 password_salt = os.environ['PASSWORD_SALT']
 port = os.environ['PORT']
+# Algorithm (pbkdf2-sha256 or scrypt) and cost of new password hashes. Existing hashes made
+# with different settings get upgraded when their users log in.
+password_hash_algorithm = os.environ.get('PASSWORD_HASH_ALGORITHM', 'pbkdf2-sha256')
+password_hash_pbkdf2_iterations = int(os.environ.get('PASSWORD_HASH_PBKDF2_ITERATIONS', 100000))
+password_hash_scrypt_n = int(os.environ.get('PASSWORD_HASH_SCRYPT_N', 16384))
+password_hash_scrypt_r = int(os.environ.get('PASSWORD_HASH_SCRYPT_R', 8))
+password_hash_scrypt_p = int(os.environ.get('PASSWORD_HASH_SCRYPT_P', 1))
+# Size of the process pool used for password hashing (0 hashes on the request thread)
+hashing_pool_size = int(os.environ.get('HASHING_POOL_SIZE', os.cpu_count() or 1))
+# How many hashes can wait for a free process before requests are rejected with 503
+hashing_queue_size = int(os.environ.get('HASHING_QUEUE_SIZE', 2 * hashing_pool_size))
+# Seconds between batched writes of failed login counts (0 writes each change straight away)
+failed_logins_flush_interval = float(os.environ.get('FAILED_LOGINS_FLUSH_INTERVAL', 0))
+# File backing the filter of existing user IDs shared by all workers (filter disabled when not set)
+user_id_filter_path = os.environ.get('USER_ID_FILTER_PATH', '')
+user_id_filter_capacity = int(os.environ.get('USER_ID_FILTER_CAPACITY', 1000000))
+user_id_filter_false_positive_rate = float(
+    os.environ.get('USER_ID_FILTER_FALSE_POSITIVE_RATE', 0.01)
+)
+user_id_filter_rebuild_interval = float(os.environ.get('USER_ID_FILTER_REBUILD_INTERVAL', 3600))
+# Seconds for which locked accounts are remembered in memory (0 disables the cache)
+locked_accounts_cache_ttl = float(os.environ.get('LOCKED_ACCOUNTS_CACHE_TTL', 0))
+locked_accounts_cache_size = int(os.environ.get('LOCKED_ACCOUNTS_CACHE_SIZE', 100000))
+locked_accounts_flush_interval = float(os.environ.get('LOCKED_ACCOUNTS_FLUSH_INTERVAL', 10))
+# DB connection pool of each worker: connections kept open, extra connections opened under load,
+# seconds to wait for a free connection and seconds after which connections get replaced (-1: never)
+db_pool_size = int(os.environ.get('DB_POOL_SIZE', 5))
+db_max_overflow = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+db_pool_timeout = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+db_pool_recycle = int(os.environ.get('DB_POOL_RECYCLE', -1))
+# Whether to check connections still work before handing them out
+db_pool_pre_ping = os.environ.get('DB_POOL_PRE_PING', 'false').lower() == 'true'
+# Milliseconds after which PostgreSQL cancels a statement (0 means no limit)
+db_statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+# Seconds between background DB checks answering the health endpoints (0 checks on each request)
+health_probe_interval = float(os.environ.get('HEALTH_PROBE_INTERVAL', 0))
+# Directory for the metrics files of the workers, served by /metrics (metrics disabled when not set)
+metrics_dir = os.environ.get('METRICS_DIR', '')
+# Whether to add a Server-Timing header breaking each response's time down by phase
+server_timing = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+# Sampling profiler: directory for its output, seconds between samples, seconds a profile started
+# by a signal lasts and the token for starting one through the API (endpoint disabled when not set)
+profiler_output_dir = os.environ.get('PROFILER_OUTPUT_DIR', '/tmp')
+profiler_sample_interval = float(os.environ.get('PROFILER_SAMPLE_INTERVAL', 0.01))
+profiler_signal_seconds = float(os.environ.get('PROFILER_SIGNAL_SECONDS', 30))
+profiler_token = os.environ.get('PROFILER_TOKEN', '')
+# Log records that can wait to be written by the logging thread (0 writes them on the calling
+# thread), and whether records are dropped or wait for space when the queue is full
+log_queue_size = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+log_queue_overflow = os.environ.get('LOG_QUEUE_OVERFLOW', 'drop')
+# Format of the audit log: 'text' (the format in logging_config.json) or 'ndjson'
+audit_log_format = os.environ.get('AUDIT_LOG_FORMAT', 'text')
+# Size of the DB connection pool used by the async (ASGI) version of the API
+async_db_pool_min_size = int(os.environ.get('ASYNC_DB_POOL_MIN_SIZE', 5))
+async_db_pool_max_size = int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', 20))
 
 CONFIG_DICT = {
     'DEBUG': False,
@@ -15,7 +77,40 @@ CONFIG_DICT = {
     'SQLALCHEMY_DATABASE_URI': sqlalchemy_database_uri,
     'PASSWORD_SALT': password_salt,
     'PORT': port,
-}  # type: Dict[str, Union[bool, str]]
+    'PASSWORD_HASH_ALGORITHM': password_hash_algorithm,
+    'PASSWORD_HASH_PBKDF2_ITERATIONS': password_hash_pbkdf2_iterations,
+    'PASSWORD_HASH_SCRYPT_N': password_hash_scrypt_n,
+    'PASSWORD_HASH_SCRYPT_R': password_hash_scrypt_r,
+    'PASSWORD_HASH_SCRYPT_P': password_hash_scrypt_p,
+    'HASHING_POOL_SIZE': hashing_pool_size,
+    'HASHING_QUEUE_SIZE': hashing_queue_size,
+    'FAILED_LOGINS_FLUSH_INTERVAL': failed_logins_flush_interval,
+    'USER_ID_FILTER_PATH': user_id_filter_path,
+    'USER_ID_FILTER_CAPACITY': user_id_filter_capacity,
+    'USER_ID_FILTER_FALSE_POSITIVE_RATE': user_id_filter_false_positive_rate,
+    'USER_ID_FILTER_REBUILD_INTERVAL': user_id_filter_rebuild_interval,
+    'LOCKED_ACCOUNTS_CACHE_TTL': locked_accounts_cache_ttl,
+    'LOCKED_ACCOUNTS_CACHE_SIZE': locked_accounts_cache_size,
+    'LOCKED_ACCOUNTS_FLUSH_INTERVAL': locked_accounts_flush_interval,
+    'DB_POOL_SIZE': db_pool_size,
+    'DB_MAX_OVERFLOW': db_max_overflow,
+    'DB_POOL_TIMEOUT': db_pool_timeout,
+    'DB_POOL_RECYCLE': db_pool_recycle,
+    'DB_POOL_PRE_PING': db_pool_pre_ping,
+    'DB_STATEMENT_TIMEOUT': db_statement_timeout,
+    'HEALTH_PROBE_INTERVAL': health_probe_interval,
+    'METRICS_DIR': metrics_dir,
+    'SERVER_TIMING': server_timing,
+    'PROFILER_OUTPUT_DIR': profiler_output_dir,
+    'PROFILER_SAMPLE_INTERVAL': profiler_sample_interval,
+    'PROFILER_SIGNAL_SECONDS': profiler_signal_seconds,
+    'PROFILER_TOKEN': profiler_token,
+    'LOG_QUEUE_SIZE': log_queue_size,
+    'LOG_QUEUE_OVERFLOW': log_queue_overflow,
+    'AUDIT_LOG_FORMAT': audit_log_format,
+    'ASYNC_DB_POOL_MIN_SIZE': async_db_pool_min_size,
+    'ASYNC_DB_POOL_MAX_SIZE': async_db_pool_max_size,
+}  # type: Dict[str, Union[bool, int, float, str]]
 
 settings = os.environ.get('SETTINGS')
 
@@ -26,3 +121,9 @@ elif settings == 'test':
     CONFIG_DICT['DEBUG'] = True
     CONFIG_DICT['TESTING'] = True
     CONFIG_DICT['FAULT_LOG_FILE_PATH'] = '/dev/null'
+    CONFIG_DICT['HASHING_POOL_SIZE'] = 0
+    CONFIG_DICT['USER_ID_FILTER_PATH'] = ''
+    CONFIG_DICT['LOCKED_ACCOUNTS_CACHE_TTL'] = 0
+    CONFIG_DICT['HEALTH_PROBE_INTERVAL'] = 0
+    CONFIG_DICT['METRICS_DIR'] = ''
+    CONFIG_DICT['PROFILER_TOKEN'] = ''
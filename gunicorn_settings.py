@@ -1,5 +1,9 @@
 import logging
-from service import logging_config
+# Imported in the master so that the workers share its counters (see service.account_unlocks)
+from service import (
+    account_unlocks, failed_logins_buffer, hashing, health, locked_accounts, logging_config,
+    metrics, profiler, user_id_filter
+)
 
 logging_config.setup_logging()
 LOGGER = logging.getLogger(__name__)
@@ -16,8 +20,33 @@ def on_reload(server):
 
 
 def when_ready(server):
+    # The workers build a new user ID filter from the DB once they start
+    user_id_filter.reset()
+    # Counts start from zero on each start of the server, as with a single process
+    metrics.reset()
     LOGGER.info("Server is ready")
 
 
+def post_worker_init(worker):
+    # Lets a profile be recorded by sending the worker SIGUSR2 (see service.profiler)
+    profiler.install_signal_handler()
+
+
+def worker_exit(server, worker):
+    hashing.shutdown()
+    # Buffered failed login counts live in the worker, so they need writing before it exits
+    failed_logins_buffer.shutdown()
+    user_id_filter.shutdown()
+    locked_accounts.shutdown()
+    health.shutdown()
+    profiler.shutdown()
+    # Records queued in the worker would be lost when it exits, and rotated logs it's still
+    # compressing left uncompressed
+    logging_config.stop_logging()
+    logging_config.wait_for_compression()
+
+
 def on_exit(server):
     LOGGER.info("Stopping the server")
+    logging_config.stop_logging()
+    logging_config.wait_for_compression()
@@ -1,5 +1,7 @@
+from mock import patch
 import re
 import pg8000
+from sqlalchemy import text  # type: ignore
 from config import CONFIG_DICT
 from service import db_access
 
@@ -108,6 +110,33 @@ class TestDbAccess:
         assert db_access.get_user(user_id, password_hash_1) is not None
         assert db_access.get_user(user_id, password_hash_2) is None
 
+    def test_user_exists_returns_whether_user_exists(self):
+        db_access.create_user('userid1', 'hash1')
+
+        assert db_access.user_exists('userid1') is True
+        assert db_access.user_exists('userid2') is False
+
+    def test_get_password_hashes_returns_page_of_hashes_ordered_by_id(self):
+        self._create_user('userid3', 'hash3', 0)
+        self._create_user('userid1', 'hash1', 0)
+        self._create_user('userid2', 'hash2', 0)
+
+        assert db_access.get_password_hashes('', 2) == [('userid1', 'hash1'), ('userid2', 'hash2')]
+        assert db_access.get_password_hashes('userid2', 2) == [('userid3', 'hash3')]
+
+    def test_update_password_hashes_skips_hashes_changed_since_read(self):
+        self._create_user('userid1', 'hash1', 0)
+        self._create_user('userid2', 'hash2', 0)
+
+        updated = db_access.update_password_hashes([
+            ('userid1', 'hash1', 'newhash1'), ('userid2', 'oldhash2', 'newhash2')
+        ])
+
+        assert updated == {'userid1'}
+        assert db_access.get_password_hashes('', 2) == [
+            ('userid1', 'newhash1'), ('userid2', 'hash2')
+        ]
+
     def test_update_user_updates_user_when_one_exists(self):
         user_id = 'userid1'
         password_hash_1 = 'hash1'
@@ -182,6 +211,131 @@ class TestDbAccess:
         result = db_access.update_failed_logins('non-existing-user-id', 1234)
         assert result == 0
 
+    def test_create_users_returns_ids_of_created_users(self):
+        self._create_user('userid1', 'hash1', 3)
+
+        result = db_access.create_users([('userid1', 'hash2'), ('userid2', 'hash3')])
+
+        assert result == {'userid2'}
+        assert db_access.get_user_credentials('userid1') == ('hash1', 3)
+        assert db_access.get_user_credentials('userid2') == ('hash3', 0)
+
+    def test_create_users_returns_empty_set_when_no_users_given(self):
+        assert db_access.create_users([]) == set()
+
+    def test_unlock_accounts_resets_failed_logins_of_listed_users(self):
+        self._create_user('userid1', 'hash1', 10)
+        self._create_user('userid2', 'hash2', 10)
+
+        assert db_access.unlock_accounts(user_ids=['userid1', 'userid3']) == ['userid1']
+        assert db_access.get_failed_logins('userid1') == 0
+        assert db_access.get_failed_logins('userid2') == 10
+
+    def test_unlock_accounts_resets_failed_logins_of_users_matching_filter(self):
+        self._create_user('userid1', 'hash1', 10)
+        self._create_user('userid2', 'hash2', 3)
+
+        assert db_access.unlock_accounts(min_failed_logins=5) == ['userid1']
+        assert db_access.get_failed_logins('userid1') == 0
+        assert db_access.get_failed_logins('userid2') == 3
+
+    def test_delete_users_deletes_users_with_id_prefix(self):
+        self._create_user('test_1', 'hash1', 0)
+        self._create_user('test1', 'hash2', 0)
+        self._create_user('userid1', 'hash3', 0)
+
+        assert db_access.delete_users(user_id_prefix='test_') == ['test_1']
+        assert db_access.get_failed_logins('test1') == 0
+        assert db_access.get_failed_logins('test_1') is None
+
+    def test_unlock_accounts_resets_users_matching_filter_in_batches(self):
+        for i in range(3):
+            self._create_user('test_{}'.format(i), 'hash{}'.format(i), 10)
+
+        assert db_access.unlock_accounts(user_id_prefix='test_', limit=2) == ['test_0', 'test_1']
+        assert db_access.unlock_accounts(
+            user_id_prefix='test_', after_user_id='test_1', limit=2
+        ) == ['test_2']
+        assert db_access.get_failed_logins('test_2') == 0
+
+    def test_export_users_returns_all_users_in_batches(self):
+        for i in range(5):
+            self._create_user('userid{}'.format(i), 'hash{}'.format(i), i)
+
+        with patch('service.db_access.FETCH_EXPORT_CURSOR_QUERY', text(
+                'FETCH FORWARD 2 FROM users_export')):
+            assert list(db_access.export_users()) == [
+                ('userid{}'.format(i), i) for i in range(5)
+            ]
+
+    def test_export_users_includes_password_hashes_when_asked(self):
+        self._create_user('userid1', 'hash1', 3)
+
+        assert list(db_access.export_users(include_password_hash=True)) == [
+            ('userid1', 3, 'hash1')
+        ]
+
+    def test_get_locked_users_returns_page_of_locked_users_ordered_by_id(self):
+        self._create_user('userid4', 'hash4', 10)
+        self._create_user('userid1', 'hash1', 12)
+        self._create_user('userid2', 'hash2', 3)
+        self._create_user('userid3', 'hash3', 11)
+
+        assert db_access.get_locked_users(10, '', 2) == [('userid1', 12), ('userid3', 11)]
+        assert db_access.get_locked_users(10, 'userid3', 2) == [('userid4', 10)]
+
+    def test_get_user_credentials_returns_none_when_user_does_not_exist(self):
+        assert db_access.get_user_credentials('non-existing-user-id') is None
+
+    def test_get_user_credentials_returns_password_hash_and_failed_logins(self):
+        user_id = 'userid1'
+        self._create_user(user_id, 'hash1', 3)
+
+        assert db_access.get_user_credentials(user_id) == ('hash1', 3)
+
+    def test_record_login_attempt_returns_none_when_user_does_not_exist(self):
+        assert db_access.record_login_attempt('non-existing-user-id', True, 10) is None
+
+    def test_record_login_attempt_resets_failed_logins_when_password_matches(self):
+        user_id = 'userid1'
+        self._create_user(user_id, 'hash1', 3)
+
+        assert db_access.record_login_attempt(user_id, True, 10) == 0
+        assert db_access.get_failed_logins(user_id) == 0
+
+    def test_record_login_attempt_increments_failed_logins_when_password_does_not_match(self):
+        user_id = 'userid1'
+        self._create_user(user_id, 'hash1', 3)
+
+        assert db_access.record_login_attempt(user_id, False, 10) == 4
+        assert db_access.get_failed_logins(user_id) == 4
+
+    def test_record_login_attempt_increments_failed_logins_when_account_locked(self):
+        user_id = 'userid1'
+        self._create_user(user_id, 'hash1', 10)
+
+        assert db_access.record_login_attempt(user_id, True, 10) == 11
+        assert db_access.get_failed_logins(user_id) == 11
+
+    def test_create_user_stores_self_describing_hash(self):
+        user_id = 'userid1'
+        password_hash = '$scrypt$n=16384,p=1,r=8$' + 'a' * 22 + '$' + 'b' * 43
+        db_access.create_user(user_id, password_hash)
+
+        assert db_access.get_user_credentials(user_id) == (password_hash, 0)
+
+    def test_apply_failed_logins_changes_resets_and_increments_counts(self):
+        self._create_user('userid1', 'hash1', 3)
+        self._create_user('userid2', 'hash2', 3)
+
+        db_access.apply_failed_logins_changes({
+            'userid1': (False, 2),
+            'userid2': (True, 1),
+        })
+
+        assert db_access.get_failed_logins('userid1') == 5
+        assert db_access.get_failed_logins('userid2') == 1
+
     def _create_user(self, user_id, password_hash, failed_login_attempts):
         self.connection.cursor().execute(
             INSERT_USER_QUERY_FORMAT,
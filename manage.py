@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
+import sys
+
 from flask_script import Manager                   # type: ignore
 from flask_migrate import Migrate, MigrateCommand  # type: ignore
 
-from service import app, db
+from service import app, db, db_access, rehash, user_export
 
 # db.create_all() needs all models to be imported explicitly (not *)
 from service.db_access import User
@@ -15,5 +17,45 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.option('-f', '--format', dest='output_format', default=user_export.NDJSON,
+                choices=sorted(user_export.FORMATS), help='Output format')
+@manager.option('-o', '--output', dest='output_path', default=None,
+                help='File to write to (standard output by default)')
+@manager.option('--include-password-hash', dest='include_password_hash', action='store_true',
+                default=False, help='Include password hashes')
+def export_users(output_format, output_path, include_password_hash):
+    """Streams all users as NDJSON or CSV"""
+    output = open(output_path, 'w') if output_path else sys.stdout
+    try:
+        for line in user_export.format_users(
+                db_access.export_users(include_password_hash), output_format,
+                include_password_hash):
+            output.write(line)
+    finally:
+        if output_path:
+            output.close()
+
+
+@manager.option('-c', '--checkpoint', dest='checkpoint_path', default=None,
+                help='File recording progress, so that an interrupted run can be resumed')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=rehash.BATCH_SIZE,
+                help='Users read and written back in one transaction')
+@manager.option('-p', '--processes', dest='processes', type=int, default=None,
+                help='Hashing processes (one per CPU by default)')
+@manager.option('-r', '--max-rate', dest='max_rate', type=float, default=0,
+                help='Maximum users examined per second (no limit by default)')
+def rehash_users(checkpoint_path, batch_size, processes, max_rate):
+    """Wraps password hashes made with old settings in a hash made with the current ones"""
+    for progress in rehash.rehash_users(checkpoint_path, batch_size, processes, max_rate):
+        print(
+            'Examined {} users, rewrapped {}, skipped {} too long to wrap (up to user ID {}) '
+            'at {:.0f} users/s'.format(
+                progress.examined, progress.rewrapped, progress.too_long, progress.last_user_id,
+                progress.users_per_second
+            ),
+            file=sys.stderr
+        )
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,28 @@
+"""Widen password_hash field for self-describing hashes
+
+Revision ID: 4a1c2e7b9d3f
+Revises: 347b054cfdb
+Create Date: 2026-10-17 16:30:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a1c2e7b9d3f'
+down_revision = '347b054cfdb'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.alter_column('users', 'password_hash',
+                    existing_type=sa.String(length=64),
+                    type_=sa.String(length=255),
+                    existing_nullable=True)
+
+
+def downgrade():
+    op.alter_column('users', 'password_hash',
+                    existing_type=sa.String(length=255),
+                    type_=sa.String(length=64),
+                    existing_nullable=True)
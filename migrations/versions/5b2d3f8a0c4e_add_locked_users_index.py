@@ -0,0 +1,38 @@
+"""Add partial index on locked users
+
+Revision ID: 5b2d3f8a0c4e
+Revises: 4a1c2e7b9d3f
+Create Date: 2026-10-17 17:30:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b2d3f8a0c4e'
+down_revision = '4a1c2e7b9d3f'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Only locked users get indexed, so the index stays small. This is the value
+# service.db_access.MAX_LOGIN_ATTEMPTS had when this migration was written, and it's frozen here
+# like the rest of the migration: changing MAX_LOGIN_ATTEMPTS needs a new migration recreating
+# the index, or locked account lookups stop using it.
+MIN_FAILED_LOGINS = 10
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY doesn't block writes to the table while the index is built, but
+    # can't run in a transaction. The transaction Alembic runs the migrations in is committed
+    # first, so that its locks don't hold up the build, which runs on a connection of its own in
+    # autocommit mode. The statement is written out, as postgresql_concurrently needs
+    # SQLAlchemy 0.9.9.
+    op.execute('COMMIT')
+    with op.get_bind().engine.connect() as connection:
+        connection.execution_options(isolation_level='AUTOCOMMIT').execute(sa.text(
+            'CREATE INDEX CONCURRENTLY ix_users_locked ON users (user_id) '
+            'WHERE failed_logins >= {:d}'.format(MIN_FAILED_LOGINS)
+        ))
+
+
+def downgrade():
+    op.drop_index('ix_users_locked', 'users')
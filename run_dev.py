@@ -1,5 +1,6 @@
 import atexit
 import logging
+from service import failed_logins_buffer, locked_accounts, user_id_filter
 from service.server import app
 
 LOGGER = logging.getLogger(__name__)
@@ -7,8 +8,11 @@ LOGGER = logging.getLogger(__name__)
 
 @atexit.register
 def handle_shutdown(*args, **kwargs):
+    failed_logins_buffer.shutdown()
+    locked_accounts.shutdown()
     LOGGER.info('Stopped the server')
 
 LOGGER.info('Starting the server')
+user_id_filter.reset()
 port = int(app.config.get('PORT', 8005))
 app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,107 @@
+# Reading audit entries from log files, shared by extract-audit-logs.py and index-audit-logs.py
+
+import argparse
+import glob
+import gzip
+import re
+
+# Every audit entry of the text format has its message after this, so lines without it get
+# skipped by a plain substring search before any pattern is tried
+MESSAGE_PREFIX = b'message=['
+# The alternatives are tried at once, and the name of the one that matched is the entry's event
+TEXT_EVENT_PATTERN = re.compile(b'|'.join([
+    b"(?P<user_logged_in>User .+ logged in.)",
+    b"(?P<user_logged_out>User .+ logged out.)",
+    b"(?P<register_viewed>VIEW REGISTER: Title number .+ was viewed by .)",
+    b"(?P<register_searched>SEARCH REGISTER: '.*' was searched by '.)",
+    b"(?P<locked_user_login>Too many bad logins.)",
+    b"(?P<unknown_user_login>Invalid credentials used\\. username: .*\\. User does not exist)",
+    b"(?P<invalid_password_login>Invalid credentials used.)",
+    b"(?P<user_created>Created user .)",
+    b"(?P<user_updated>Updated user .)",
+    b"(?P<users_deleted>Deleted users? .)",
+    b"(?P<failed_logins_reset>Reset failed login attempts for users? .)",
+    b"(?P<users_exported>Exported users)",
+]))
+EVENTS = list(TEXT_EVENT_PATTERN.groupindex)
+# Entries of the NDJSON audit format (see AUDIT_LOG_FORMAT) are JSON objects, one per line
+NDJSON_START = b'{'
+# Log files are told apart by their first line, which stays the same when they're rotated and
+# compressed
+MAX_FIRST_LINE_LENGTH = 4096
+TIME_FORMAT = re.compile(r'^\d{4}-\d{2}-\d{2}(T\d{2}(:\d{2}(:\d{2})?)?)?$')
+
+
+def find_text_entries(data, start, end):
+    # Yields the (line start, line end, event) of the audit entries among the whole lines of the
+    # text format in data[start:end]
+    position = start
+    while True:
+        index = data.find(MESSAGE_PREFIX, position, end)
+        if index == -1:
+            return
+
+        line_end = data.find(b'\n', index, end)
+        line_end = end if line_end == -1 else line_end + 1
+        match = TEXT_EVENT_PATTERN.match(data, index + len(MESSAGE_PREFIX), line_end)
+        if match is None:
+            # The prefix can show up again further along the line
+            position = index + len(MESSAGE_PREFIX)
+            continue
+
+        line_start = data.rfind(b'\n', start, index) + 1 or start
+        yield line_start, line_end, match.lastgroup
+        position = line_end
+
+
+def get_text_timestamp(line):
+    # Lines start with the asctime of the entry, e.g. '2024-01-01 12:00:00,000', which is
+    # returned as '2024-01-01T12:00:00' to compare with the NDJSON timestamps
+    return (line[:10] + b'T' + line[11:19]).decode(errors='replace')
+
+
+def get_log_paths(path):
+    # Returns the paths of the log and its rotated files (path.1, path.2, ... or path.1.gz,
+    # path.2.gz, ... once compressed), oldest first. A rotated file being compressed has both
+    # names for a moment, and is returned under its uncompressed one.
+    rotated_paths = {}
+    for rotated_path in glob.glob(glob.escape(path) + '.*'):
+        suffix = rotated_path[len(path) + 1:]
+        number = suffix[:-len('.gz')] if suffix.endswith('.gz') else suffix
+        if number.isdigit() and (
+                int(number) not in rotated_paths or not rotated_path.endswith('.gz')):
+            rotated_paths[int(number)] = rotated_path
+    return [rotated_paths[number] for number in sorted(rotated_paths, reverse=True)] + [path]
+
+
+def open_log_file(path):
+    # Opens a log file, or a gzipped rotated one, to read bytes from. Returns None when the file
+    # was rotated or removed in the meantime.
+    try:
+        return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    except FileNotFoundError:
+        return None
+
+
+def read_first_line(file):
+    # Returns None until the first line was written in full
+    file.seek(0)
+    data = file.read(MAX_FIRST_LINE_LENGTH)
+    line_end = data.find(b'\n')
+    if line_end == -1:
+        return data if len(data) == MAX_FIRST_LINE_LENGTH else None
+    return data[:line_end + 1]
+
+
+def is_ndjson_file(file):
+    file.seek(0)
+    return file.read(1) == NDJSON_START
+
+
+def parse_time(value):
+    # Argument type of the --since and --until options
+    if not TIME_FORMAT.match(value):
+        raise argparse.ArgumentTypeError(
+            'should be formatted as YYYY-MM-DD, optionally followed by THH, THH:MM or THH:MM:SS'
+        )
+    return value
@@ -2,37 +2,398 @@
 # This script extracts auditing information from log files.
 # Example use:
 # python3 extract-audit-logs.py /var/log/applications/login-api.log
+# python3 extract-audit-logs.py '/var/log/applications/login-api-audit.log*' \
+#     --event invalid_password_login --since 2024-01-01 --until 2024-02-01
+# python3 extract-audit-logs.py /var/log/applications/login-api-audit.log \
+#     --checkpoint /var/lib/login-api/audit-checkpoint.json --follow
+#
+# Files can be given as paths or glob patterns, and gzipped (.gz) files are read too. Files are
+# split into ranges of whole lines that are searched in parallel, and the matching lines are
+# written in the order of the files given (each glob's files oldest first).
+#
+# With a checkpoint, only the lines added to the log since the last run are read, and with
+# --follow the script keeps reading new lines as they're written (see follow).
 
-
-import re
+import argparse
+import concurrent.futures
+import functools
+import glob
+import gzip
+import json
+import mmap
+import os
 import sys
+import time
+
+from audit_logs import (
+    EVENTS, NDJSON_START, find_text_entries, get_log_paths, get_text_timestamp, is_ndjson_file,
+    open_log_file, parse_time, read_first_line
+)
+
+# Each file is split into ranges of about this many bytes, searched by different processes
+RANGE_SIZE = 64 * 1024 * 1024
+READ_SIZE = 16 * 1024 * 1024
+# Seconds to wait for new lines when following a log
+FOLLOW_INTERVAL = 1.0
+
+
+class Filters(object):
+    # Entries are kept when their event is one of the events (if any are given) and their time
+    # is within [since, until). Times are compared as 'YYYY-MM-DDTHH:MM:SS' strings, so either
+    # bound can be cut short, e.g. to a date.
+
+    def __init__(self, events=None, since=None, until=None):
+        self.events = set(events) if events else None
+        self.since = since
+        self.until = until
+
+    def any(self):
+        return self.events is not None or self.since is not None or self.until is not None
+
+    def keep(self, event, timestamp):
+        return (
+            (self.events is None or event in self.events) and
+            (self.since is None or timestamp >= self.since) and
+            (self.until is None or timestamp < self.until)
+        )
+
+
+def extract(paths, filters, processes=None, output=None):
+    # Writes the audit entries found in the files to the output (a binary file)
+    output = output or sys.stdout.buffer
+    tasks = [task for path in paths for task in _split_file(path)]
+    extract_task = functools.partial(_extract_task, filters=filters)
+
+    if processes == 1:
+        for result in map(extract_task, tasks):
+            output.write(result)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            for result in executor.map(extract_task, tasks):
+                output.write(result)
+    output.flush()
+
+
+def follow(path, filters, checkpoint_path=None, keep_following=False, output=None,
+           interval=FOLLOW_INTERVAL):
+    # Writes the audit entries in the lines added to the log since the checkpoint, and records
+    # the log file and byte offset read up to in it after each batch of lines. Only whole lines
+    # are read, as the last one may still be being written. When the log was rotated since the
+    # checkpoint (i.e. renamed to path.1, path.2, ... by RotatingFileHandler, and possibly
+    # gzipped), the rest of the rotated file and any rotated after it are read before the new
+    # log. With keep_following, waits for more lines rather than returning.
+    follower = _LogFollower(path, filters, checkpoint_path, output or sys.stdout.buffer)
+    try:
+        while True:
+            if follower.extract_new_lines():
+                continue
+
+            if follower.was_rotated():
+                # Lines may have been added between the last read and the rotation, including
+                # the end of a partly written line
+                follower.extract_new_lines(include_partial_line=True)
+                follower.open_next_log()
+            elif keep_following:
+                time.sleep(interval)
+            else:
+                return
+    finally:
+        follower.close()
+
+
+def expand_paths(patterns):
+    paths = []
+    for pattern in patterns:
+        # Leaving out the files of rotated logs being compressed and the rotation lock file
+        matches = [
+            path for path in glob.glob(pattern) if not path.endswith(('.tmp', '.lock'))
+        ]
+        if not matches:
+            exit('No log files found matching {}'.format(pattern))
+        # Rotated files come out oldest first
+        paths.extend(sorted(matches, key=lambda path: (os.path.getmtime(path), path)))
+    return paths
+
+
+class _LogFollower(object):
+    # The log file being read, and the offset read up to in it. Files are recognised by their
+    # first line, which stays the same when they're rotated and compressed, or by their inode
+    # while their first line isn't complete.
+
+    def __init__(self, path, filters, checkpoint_path, output):
+        self._path = path
+        self._filters = filters
+        self._checkpoint_path = checkpoint_path
+        self._output = output
+        self._file = None
+        self._open_checkpoint_log()
+
+    def extract_new_lines(self, include_partial_line=False):
+        # Returns whether any lines were read
+        is_ndjson = is_ndjson_file(self._file)
+        self._file.seek(self._offset)
+        start_offset = self._offset
+        leftover = b''
+        while True:
+            chunk = self._file.read(READ_SIZE)
+            if not chunk:
+                break
+            data = leftover + chunk
+            end = data.rfind(b'\n') + 1
+            leftover = data[end:]
+            self._write_lines(data[:end], is_ndjson)
+
+        if include_partial_line:
+            self._write_lines(leftover, is_ndjson)
+        return self._offset != start_offset
+
+    def was_rotated(self):
+        try:
+            return os.stat(self._path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            # Between the log being renamed and the new one being created
+            return False
+
+    def open_next_log(self):
+        # Opens the file the log was rotated to after the current one. It may have been rotated
+        # more than once since it was last read.
+        log_paths = get_log_paths(self._path)
+        index = self._find_log_file(log_paths, self._inode, self._first_line)
+        if index is None:
+            sys.stderr.write(
+                'The log was rotated away before being read, some entries may have been missed\n'
+            )
+            self._open(log_paths[0], 0)
+        else:
+            self._open(log_paths[min(index + 1, len(log_paths) - 1)], 0)
+        self._write_checkpoint()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def _open_checkpoint_log(self):
+        checkpoint = _read_checkpoint(self._checkpoint_path)
+        if checkpoint is None:
+            self._open(self._path, 0)
+            return
+
+        log_paths = get_log_paths(self._path)
+        first_line = checkpoint.get('first_line')
+        index = self._find_log_file(
+            log_paths, checkpoint['inode'],
+            first_line.encode('latin-1') if first_line is not None else None
+        )
+        if index is None:
+            sys.stderr.write(
+                'The log read up to in the checkpoint was removed, some entries may have been '
+                'missed\n'
+            )
+            self._open(log_paths[0], 0)
+        else:
+            self._open(log_paths[index], checkpoint['offset'])
+            if not log_paths[index].endswith('.gz') and \
+                    os.fstat(self._file.fileno()).st_size < self._offset:
+                # Truncated since the checkpoint
+                self._offset = 0
+
+    def _open(self, path, offset):
+        self.close()
+        self._file = open_log_file(path)
+        if self._file is None:
+            # Rotated in the meantime
+            self._file = open_log_file(self._path)
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self._first_line = read_first_line(self._file)
+        self._offset = offset
+
+    def _find_log_file(self, log_paths, inode, first_line):
+        # Returns the index of the file among the log paths, or None
+        for index, log_path in enumerate(log_paths):
+            file = open_log_file(log_path)
+            if file is None:
+                continue
+            with file:
+                if first_line is None:
+                    if os.fstat(file.fileno()).st_ino == inode:
+                        return index
+                elif read_first_line(file) == first_line:
+                    return index
+        return None
+
+    def _write_lines(self, data, is_ndjson):
+        if not data:
+            return
+
+        for line in _scan(data, 0, len(data), self._filters, is_ndjson):
+            self._output.write(line)
+        self._output.flush()
+        if self._first_line is None and self._offset == 0:
+            self._first_line = data[:data.find(b'\n') + 1] or None
+        self._offset += len(data)
+        # Only recorded once the entries were written, so none can get lost
+        self._write_checkpoint()
+
+    def _write_checkpoint(self):
+        # Replaces the file in one go, so that an interrupted run can't leave half a checkpoint
+        if self._checkpoint_path:
+            temp_path = self._checkpoint_path + '.tmp'
+            with open(temp_path, 'w') as checkpoint_file:
+                json.dump({
+                    'inode': self._inode,
+                    # Lines are bytes, which latin-1 maps to a string one to one
+                    'first_line': (
+                        self._first_line.decode('latin-1') if self._first_line is not None
+                        else None
+                    ),
+                    'offset': self._offset,
+                }, checkpoint_file)
+            os.replace(temp_path, self._checkpoint_path)
+
+
+def _read_checkpoint(checkpoint_path):
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as checkpoint_file:
+            return json.load(checkpoint_file)
+
+    return None
+
+
+def _split_file(path):
+    # Returns the (path, start, end, is_ndjson) byte ranges to search the file in. Compressed
+    # files can't be read from the middle, so they're searched in one go.
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as file:
+            return [(path, 0, None, file.read(1) == NDJSON_START)]
+
+    with open(path, 'rb') as file:
+        is_ndjson = file.read(1) == NDJSON_START
+    size = os.path.getsize(path)
+    return [
+        (path, start, min(start + RANGE_SIZE, size), is_ndjson)
+        for start in range(0, size, RANGE_SIZE)
+    ]
+
+
+def _extract_task(task, filters):
+    path, start, end, is_ndjson = task
+    if end is None:
+        return _extract_gzip_file(path, filters, is_ndjson)
+
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        # A range holds the lines that start within it
+        start = _next_line_start(data, start)
+        end = _next_line_start(data, end)
+        return b''.join(_scan(data, start, end, filters, is_ndjson))
+
+
+def _extract_gzip_file(path, filters, is_ndjson):
+    lines = []
+    with gzip.open(path, 'rb') as file:
+        leftover = b''
+        while True:
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                break
+            data = leftover + chunk
+            end = data.rfind(b'\n') + 1
+            lines.extend(_scan(data, 0, end, filters, is_ndjson))
+            leftover = data[end:]
+        lines.extend(_scan(leftover, 0, len(leftover), filters, is_ndjson))
+    return b''.join(lines)
+
+
+def _next_line_start(data, offset):
+    if offset == 0 or offset >= len(data):
+        return min(offset, len(data))
+    line_end = data.find(b'\n', offset - 1)
+    return len(data) if line_end == -1 else line_end + 1
+
+
+def _scan(data, start, end, filters, is_ndjson):
+    # Yields the audit entries among the whole lines in data[start:end]
+    if is_ndjson:
+        return _scan_ndjson(data, start, end, filters)
+    else:
+        return _scan_text(data, start, end, filters)
+
+
+def _scan_text(data, start, end, filters):
+    for line_start, line_end, event in find_text_entries(data, start, end):
+        line = data[line_start:line_end]
+        if not filters.any() or filters.keep(event, get_text_timestamp(line)):
+            yield _terminated(line)
+
+
+def _scan_ndjson(data, start, end, filters):
+    position = start
+    while position < end:
+        line_end = data.find(b'\n', position, end)
+        line_end = end if line_end == -1 else line_end + 1
+        line = data[position:line_end]
+        position = line_end
+
+        if not line.startswith(NDJSON_START):
+            continue
+        if not filters.any():
+            yield _terminated(line)
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if filters.keep(entry.get('event'), entry.get('timestamp', '')[:19]):
+            yield _terminated(line)
+
+
+def _terminated(line):
+    # The last line of a file may have no line break, which would join it to the next entry
+    return line if line.endswith(b'\n') else line + b'\n'
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Extracts audit entries from log files')
+    parser.add_argument(
+        'paths', nargs='+', metavar='path',
+        help='Log file, or glob pattern matching log files. Gzipped (.gz) files are read too.'
+    )
+    parser.add_argument(
+        '-e', '--event', action='append', choices=EVENTS, dest='events',
+        help='Only extract entries of this event type (can be given more than once)'
+    )
+    parser.add_argument(
+        '-s', '--since', type=parse_time,
+        help='Only extract entries logged at or after this time, in the time zone of the log '
+             '(local time for the text format, UTC for NDJSON)'
+    )
+    parser.add_argument(
+        '-u', '--until', type=parse_time, help='Only extract entries logged before this time'
+    )
+    parser.add_argument(
+        '-p', '--processes', type=int,
+        help='Number of processes searching the files (defaults to the number of CPU cores)'
+    )
+    parser.add_argument(
+        '-c', '--checkpoint',
+        help='Only read the lines added to the log since the last run with this checkpoint file'
+    )
+    parser.add_argument(
+        '-f', '--follow', action='store_true',
+        help='Keep reading lines as they are added to the log, following its rotations'
+    )
+    args = parser.parse_args()
+    if (args.checkpoint or args.follow) and len(args.paths) != 1:
+        parser.error('--checkpoint and --follow take a single log file')
+    return args
+
 
-audit_entry_pattens = list(map(lambda s: re.compile(s), [
-    '.*message=\\[User .+ logged in.+',
-    '.*message=\\[User .+ logged out.+',
-    ".*message=\\[VIEW REGISTER: Title number .+ was viewed by .+",
-    ".*message=\\[SEARCH REGISTER: '.*' was searched by '.+'",
-    '.*message=\\[Too many bad logins.+',
-    '.*message=\\[Invalid credentials used.+',
-    '.*message=\\[Created user .+',
-    '.*message=\\[Updated user .+',
-    '.*message=\\[Deleted user .+',
-    '.*message=\\[Reset failed login attempts for user .+',
-]))
-
-
-def _is_audit_line(line):
-    for pattern in audit_entry_pattens:
-        if pattern.match(line):
-            return True
-
-    return False
-
-
-if len(sys.argv) != 2:
-    exit('Should specify the full path to the log file as the only argument')
-else:
-    with open(sys.argv[1]) as file:
-        for line in file:
-            if _is_audit_line(line):
-                print(line, end='')
+if __name__ == '__main__':
+    args = _parse_args()
+    filters = Filters(args.events, args.since, args.until)
+    if args.checkpoint or args.follow:
+        try:
+            follow(args.paths[0], filters, args.checkpoint, args.follow)
+        except KeyboardInterrupt:
+            pass
+    else:
+        extract(expand_paths(args.paths), filters, args.processes)
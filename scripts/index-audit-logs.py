@@ -0,0 +1,447 @@
+# !/usr/bin/env python
+# This script keeps a SQLite index of the entries of an audit log and its rotated files, and
+# looks entries up in it by user ID, event type and time.
+# Example use:
+# python3 index-audit-logs.py update /var/log/applications/login-api-audit.log -i audit-index.db
+# python3 index-audit-logs.py query -i audit-index.db --user-id userid1 --since 2024-01-01
+#
+# Each update only reads what was added to the log files since the last one, so it can be run
+# often, e.g. from cron. The index holds the event type, user IDs, time and position of each
+# entry, so queries read the matching lines straight from the log files.
+#
+# Gzipped rotated files can only be decompressed from the start of a gzip member. The logs
+# rotated by the API are compressed in members of 1MB of log each (see
+# logging_config.COMPRESSION_MEMBER_SIZE), whose positions are recorded in the index, so a query
+# decompresses at most a member per entry it reads. Files compressed in a single member (e.g. by
+# logrotate) are decompressed from their start up to the last entry read by each query.
+
+import argparse
+import bisect
+import gzip
+import json
+import os
+import re
+import sqlite3
+import sys
+import zlib
+
+from audit_logs import (
+    EVENTS, find_text_entries, get_log_paths, get_text_timestamp, is_ndjson_file, open_log_file,
+    parse_time, read_first_line
+)
+
+READ_SIZE = 16 * 1024 * 1024
+# Compressed bytes read at a time from gzipped files, a fraction of a typical member
+GZIP_READ_SIZE = 64 * 1024
+# Decompresses a gzip member, with its header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS log_files (
+        id INTEGER PRIMARY KEY,
+        first_line BLOB NOT NULL UNIQUE,
+        indexed_up_to INTEGER NOT NULL,
+        -- Set once a rotated file was indexed to its end, as it won't change any more
+        complete INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS entries (
+        log_file_id INTEGER NOT NULL REFERENCES log_files (id) ON DELETE CASCADE,
+        line_offset INTEGER NOT NULL,
+        line_length INTEGER NOT NULL,
+        event TEXT,
+        user_id TEXT,
+        timestamp TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS entries_user_id_timestamp ON entries (user_id, timestamp);
+    CREATE INDEX IF NOT EXISTS entries_timestamp ON entries (timestamp);
+    CREATE INDEX IF NOT EXISTS entries_log_file_id ON entries (log_file_id);
+    -- Where each member of a gzipped log file starts, in the file and in the log it holds
+    CREATE TABLE IF NOT EXISTS gzip_members (
+        log_file_id INTEGER NOT NULL REFERENCES log_files (id) ON DELETE CASCADE,
+        uncompressed_offset INTEGER NOT NULL,
+        compressed_offset INTEGER NOT NULL,
+        PRIMARY KEY (log_file_id, uncompressed_offset)
+    );
+'''
+
+# The user IDs in the messages of the text format, for the events about users. Entries about
+# several users list them separated by ', '.
+TEXT_USER_IDS_PATTERNS = {
+    'user_logged_in': re.compile(b'User (.+) logged in'),
+    'user_logged_out': re.compile(b'User (.+) logged out'),
+    'locked_user_login': re.compile(b'Too many bad logins\\. username: (.+), attempt: \\d+\\.'),
+    'unknown_user_login': re.compile(
+        b'Invalid credentials used\\. username: (.+)\\. User does not exist\\.'
+    ),
+    'invalid_password_login': re.compile(
+        b'Invalid credentials used\\. username: (.+), attempt: \\d+\\.'
+    ),
+    'user_created': re.compile(b'Created user (.+)'),
+    'user_updated': re.compile(b'Updated user (.+)'),
+    'users_deleted': re.compile(b'Deleted users? (.+)'),
+    'failed_logins_reset': re.compile(b'Reset failed login attempts for users? (.+)'),
+}
+TEXT_MESSAGE_PATTERN = re.compile(b'message=\\[(.*)\\] exception=\\[|message=\\[(.*)\\]')
+
+
+def connect(index_path):
+    connection = sqlite3.connect(index_path)
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def update(connection, log_path):
+    # Indexes the entries added to the log and its rotated files since the last update, and
+    # forgets the files that were removed. The live log is only indexed up to its last whole
+    # line, as the line after it may still be being written. Log files are told apart by their
+    # first line, which stays the same when they're rotated and compressed.
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)',
+            ('log_path', os.path.abspath(log_path))
+        )
+
+    indexed_file_ids = set()
+    for path in get_log_paths(log_path):
+        file = open_log_file(path)
+        if file is None:
+            continue
+        with file:
+            first_line = read_first_line(file)
+            if first_line is None:
+                continue
+            log_file_id, indexed_up_to, complete = _get_log_file(connection, first_line)
+            indexed_file_ids.add(log_file_id)
+            if not complete:
+                _index_file(connection, file, log_file_id, indexed_up_to, path != log_path)
+            if path.endswith('.gz') and not _get_gzip_members(connection, log_file_id):
+                _record_gzip_members(connection, file, log_file_id)
+
+    with connection:
+        for log_file_id, in connection.execute('SELECT id FROM log_files').fetchall():
+            if log_file_id not in indexed_file_ids:
+                connection.execute('DELETE FROM log_files WHERE id = ?', (log_file_id,))
+
+
+def query(connection, user_id=None, events=None, since=None, until=None, output=None):
+    # Writes the entries matching all the given conditions, in the order they were logged. Times
+    # are compared as 'YYYY-MM-DDTHH:MM:SS' strings, as by extract-audit-logs.py.
+    output = output or sys.stdout.buffer
+    conditions = []
+    params = []
+    if user_id is not None:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    if events:
+        conditions.append('event IN ({})'.format(', '.join('?' * len(events))))
+        params.extend(events)
+    if since is not None:
+        conditions.append('timestamp >= ?')
+        params.append(since)
+    if until is not None:
+        conditions.append('timestamp < ?')
+        params.append(until)
+
+    rows = connection.execute(
+        'SELECT DISTINCT timestamp, log_file_id, line_offset, line_length FROM entries {} '
+        'ORDER BY timestamp, log_file_id, line_offset'.format(
+            'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        ),
+        params
+    ).fetchall()
+    files = _open_log_files(connection)
+    try:
+        gzip_lines = _read_gzip_lines(connection, files, rows)
+        for _, log_file_id, line_offset, line_length in rows:
+            file = files.get(log_file_id)
+            if isinstance(file, gzip.GzipFile):
+                output.write(gzip_lines[log_file_id, line_offset])
+            elif file is not None:
+                file.seek(line_offset)
+                output.write(file.read(line_length))
+    finally:
+        for file in files.values():
+            file.close()
+    output.flush()
+
+
+def _read_gzip_lines(connection, files, rows):
+    # Returns the lines of the rows in gzipped files by their log file ID and offset. They're
+    # read in the order of the lines in each file, rather than in the order of the rows, so that
+    # no member gets decompressed twice.
+    lines = {}
+    readers = {}
+    try:
+        for _, log_file_id, line_offset, line_length in sorted(rows, key=lambda row: row[1:3]):
+            file = files.get(log_file_id)
+            if not isinstance(file, gzip.GzipFile) or (log_file_id, line_offset) in lines:
+                continue
+            if log_file_id not in readers:
+                # Files rotated since the last update have no members recorded yet
+                readers[log_file_id] = _GzipMemberReader(
+                    os.fdopen(os.dup(file.fileno()), 'rb'),
+                    _get_gzip_members(connection, log_file_id) or [(0, 0)]
+                )
+            lines[log_file_id, line_offset] = readers[log_file_id].read(line_offset, line_length)
+    finally:
+        for reader in readers.values():
+            reader.close()
+    return lines
+
+
+class _GzipMemberReader(object):
+    # Reads ranges of the log in a gzipped file, decompressing from the start of the member that
+    # holds each range, or carrying on from the last range read when it's in the same member
+
+    def __init__(self, file, members):
+        self._file = file
+        # (uncompressed offset, compressed offset) of each member, in order
+        self._uncompressed_offsets = [member[0] for member in members]
+        self._compressed_offsets = [member[1] for member in members]
+        self._decompressor = None
+        # Decompressed log not read yet, and its offset in the log
+        self._data = b''
+        self._offset = None
+
+    def read(self, offset, length):
+        index = bisect.bisect_right(self._uncompressed_offsets, offset) - 1
+        if self._offset is None or offset < self._offset or \
+                self._uncompressed_offsets[index] > self._offset:
+            self._file.seek(self._compressed_offsets[index])
+            self._decompressor = zlib.decompressobj(GZIP_WBITS)
+            self._data = b''
+            self._offset = self._uncompressed_offsets[index]
+
+        while len(self._data) < offset - self._offset + length and self._decompress_more():
+            pass
+        self._data = self._data[offset - self._offset:]
+        self._offset = offset
+        return self._data[:length]
+
+    def close(self):
+        self._file.close()
+
+    def _decompress_more(self):
+        # Returns False at the end of the file
+        if self._decompressor.eof:
+            # The next member starts right after this one
+            compressed = self._decompressor.unused_data
+            self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        else:
+            compressed = b''
+        compressed = compressed or self._file.read(GZIP_READ_SIZE)
+        if not compressed:
+            return False
+        self._data += self._decompressor.decompress(compressed)
+        return True
+
+
+def _get_gzip_members(connection, log_file_id):
+    return connection.execute(
+        'SELECT uncompressed_offset, compressed_offset FROM gzip_members WHERE log_file_id = ? '
+        'ORDER BY uncompressed_offset',
+        (log_file_id,)
+    ).fetchall()
+
+
+def _record_gzip_members(connection, file, log_file_id):
+    # Finds where each member of the gzipped file starts by decompressing it once
+    members = []
+    uncompressed_offset = 0
+    with os.fdopen(os.dup(file.fileno()), 'rb') as raw_file:
+        raw_file.seek(0)
+        compressed_offset = 0
+        compressed = b''
+        decompressor = None
+        while True:
+            compressed = compressed or raw_file.read(GZIP_READ_SIZE)
+            if not compressed:
+                break
+            if decompressor is None:
+                members.append((log_file_id, uncompressed_offset, compressed_offset))
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+            try:
+                uncompressed_offset += len(decompressor.decompress(compressed))
+            except zlib.error:
+                # e.g. padding after the last member
+                members.pop()
+                break
+            if decompressor.eof:
+                compressed_offset += len(compressed) - len(decompressor.unused_data)
+                compressed = decompressor.unused_data
+                decompressor = None
+            else:
+                compressed_offset += len(compressed)
+                compressed = b''
+
+    with connection:
+        connection.executemany(
+            'INSERT OR IGNORE INTO gzip_members '
+            '(log_file_id, uncompressed_offset, compressed_offset) VALUES (?, ?, ?)',
+            members
+        )
+
+
+def _get_log_file(connection, first_line):
+    # Returns the ID of the log file, the offset it was indexed up to and whether it's complete
+    row = connection.execute(
+        'SELECT id, indexed_up_to, complete FROM log_files WHERE first_line = ?', (first_line,)
+    ).fetchone()
+    if row is not None:
+        return row
+
+    with connection:
+        cursor = connection.execute(
+            'INSERT INTO log_files (first_line, indexed_up_to) VALUES (?, 0)', (first_line,)
+        )
+    return cursor.lastrowid, 0, False
+
+
+def _index_file(connection, file, log_file_id, indexed_up_to, is_rotated):
+    is_ndjson = is_ndjson_file(file)
+    file.seek(indexed_up_to)
+    offset = indexed_up_to
+    leftover = b''
+    while True:
+        chunk = file.read(READ_SIZE)
+        if not chunk:
+            if is_rotated:
+                with connection:
+                    connection.execute(
+                        'UPDATE log_files SET complete = 1 WHERE id = ?', (log_file_id,)
+                    )
+            return
+        data = leftover + chunk
+        end = data.rfind(b'\n') + 1
+        leftover = data[end:]
+        if end == 0:
+            continue
+
+        # The entries of each chunk are recorded together with how far the file was indexed,
+        # so that an interrupted update carries on from the right place
+        with connection:
+            connection.executemany(
+                'INSERT INTO entries '
+                '(log_file_id, line_offset, line_length, event, user_id, timestamp) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    (log_file_id, offset + line_start, line_end - line_start, event, user_id,
+                     timestamp)
+                    for line_start, line_end, event, user_ids, timestamp
+                    in _parse_entries(data, end, is_ndjson)
+                    for user_id in user_ids
+                )
+            )
+            connection.execute(
+                'UPDATE log_files SET indexed_up_to = ? WHERE id = ?', (offset + end, log_file_id)
+            )
+        offset += end
+
+
+def _parse_entries(data, end, is_ndjson):
+    # Yields the (line start, line end, event, user IDs, timestamp) of the entries in
+    # data[:end]. Entries not about users get [None] as their user IDs, so they're still indexed.
+    if is_ndjson:
+        line_start = 0
+        while line_start < end:
+            line_end = data.find(b'\n', line_start, end) + 1 or end
+            try:
+                entry = json.loads(data[line_start:line_end])
+            except ValueError:
+                entry = None
+            if isinstance(entry, dict):
+                user_ids = entry.get('user_ids') or [entry.get('user_id')]
+                yield (
+                    line_start, line_end, entry.get('event'), user_ids,
+                    entry.get('timestamp', '')[:19]
+                )
+            line_start = line_end
+    else:
+        for line_start, line_end, event in find_text_entries(data, 0, end):
+            line = data[line_start:line_end]
+            user_ids = _get_text_user_ids(event, line)
+            yield line_start, line_end, event, user_ids, get_text_timestamp(line)
+
+
+def _get_text_user_ids(event, line):
+    pattern = TEXT_USER_IDS_PATTERNS.get(event)
+    message_match = TEXT_MESSAGE_PATTERN.search(line)
+    if pattern is None or message_match is None:
+        return [None]
+
+    user_ids_match = pattern.fullmatch(message_match.group(1) or message_match.group(2))
+    if user_ids_match is None:
+        return [None]
+    return user_ids_match.group(1).decode(errors='replace').split(', ')
+
+
+def _open_log_files(connection):
+    # Returns the open log files by their ID. Files that were removed since the last update are
+    # left out, as are their entries.
+    first_line_ids = dict(
+        (bytes(first_line), log_file_id)
+        for log_file_id, first_line in connection.execute('SELECT id, first_line FROM log_files')
+    )
+    log_path_row = connection.execute(
+        "SELECT value FROM settings WHERE name = 'log_path'"
+    ).fetchone()
+    if log_path_row is None:
+        return {}
+
+    files = {}
+    for path in get_log_paths(log_path_row[0]):
+        file = open_log_file(path)
+        if file is None:
+            continue
+        log_file_id = first_line_ids.get(read_first_line(file))
+        if log_file_id is None or log_file_id in files:
+            file.close()
+        else:
+            files[log_file_id] = file
+    return files
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Indexes and searches audit log entries')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    update_parser = subparsers.add_parser(
+        'update', help='Index the entries added to the log since the last update'
+    )
+    update_parser.add_argument('log_path', help='Audit log file, e.g. login-api-audit.log')
+    update_parser.add_argument('-i', '--index', required=True, help='SQLite index file')
+
+    query_parser = subparsers.add_parser(
+        'query', help='Write the entries matching the options',
+        description='Writes the entries matching the options. Gzipped log files are decompressed '
+                    'from the start of the gzip member holding each entry, or from their start '
+                    'when they were compressed in a single member (e.g. by logrotate).'
+    )
+    query_parser.add_argument('-i', '--index', required=True, help='SQLite index file')
+    query_parser.add_argument('--user-id', help='Only write entries about this user')
+    query_parser.add_argument(
+        '-e', '--event', action='append', choices=EVENTS, dest='events',
+        help='Only write entries of this event type (can be given more than once)'
+    )
+    query_parser.add_argument(
+        '-s', '--since', type=parse_time,
+        help='Only write entries logged at or after this time, in the time zone of the log'
+    )
+    query_parser.add_argument(
+        '-u', '--until', type=parse_time, help='Only write entries logged before this time'
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = _parse_args()
+    connection = connect(args.index)
+    try:
+        if args.command == 'update':
+            update(connection, args.log_path)
+        else:
+            query(connection, args.user_id, args.events, args.since, args.until)
+    finally:
+        connection.close()
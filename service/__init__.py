@@ -1,8 +1,8 @@
 import faulthandler                      # type: ignore
 from flask import Flask                  # type: ignore
-from flask_sqlalchemy import SQLAlchemy  # type: ignore
 
 from config import CONFIG_DICT
+from service import db_pool
 from service import logging_config
 from service import security
 
@@ -12,5 +12,5 @@ faulthandler.enable(file=fault_log_file)
 
 app = Flask(__name__)
 app.config.update(CONFIG_DICT)
-db = SQLAlchemy(app)
+db = db_pool.PooledSQLAlchemy(app)
 logging_config.setup_logging()
@@ -0,0 +1,33 @@
+import hashlib
+import mmap
+import struct
+
+# Accounts sharing a counter only cost each other a DB lookup when one of them is unlocked
+COUNTER_COUNT = 65536
+COUNTER = struct.Struct('<I')
+
+# Counts unlocks (and deletions) of accounts in memory shared by all gunicorn workers, so that a
+# worker can tell that the failed login counts it keeps for an account (see locked_accounts and
+# failed_logins_buffer) were reset through another worker. Anonymous shared memory is inherited
+# by forked processes, and this module is first imported by gunicorn_settings in the master, so
+# that every worker maps the same counters.
+_counters = mmap.mmap(-1, COUNTER_COUNT * COUNTER.size)
+
+
+def get_generation(user_id):
+    # Changes every time the account is unlocked, through any worker
+    return COUNTER.unpack_from(_counters, _get_offset(user_id))[0]
+
+
+def record_unlock(user_id):
+    # Called once the account was unlocked or deleted in the DB. Workers increasing the same
+    # counter at the same time can lose one of the increments, but the counter still changes,
+    # which is all that's checked.
+    offset = _get_offset(user_id)
+    generation = COUNTER.unpack_from(_counters, offset)[0]
+    COUNTER.pack_into(_counters, offset, (generation + 1) % 2 ** (COUNTER.size * 8))
+
+
+def _get_offset(user_id):
+    digest = hashlib.blake2b(user_id.encode(), digest_size=8).digest()
+    return struct.unpack('<Q', digest)[0] % COUNTER_COUNT * COUNTER.size
@@ -0,0 +1,357 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+from quart import Quart, request, Response  # type: ignore
+
+from config import CONFIG_DICT
+from service import (
+    account_unlocks, async_db_access, auditing, failed_logins_buffer, hashing, health,
+    locked_accounts, request_validation, security, user_id_filter
+)
+from service.server import (
+    AUTH_FAILURE_RESPONSE_BODY, INTERNAL_SERVER_ERROR_RESPONSE_BODY, INVALID_REQUEST_RESPONSE_BODY,
+    JSON_CONTENT_TYPE, MAX_LOGIN_ATTEMPTS, REQUEST_ID_HEADER, SERVICE_BUSY_RESPONSE_BODY
+)
+
+# Async version of the API in service.server, with the same endpoints and responses.
+# Run it with an ASGI server, e.g.: uvicorn service.asgi_server:app
+
+USER_NOT_FOUND_RESPONSE_BODY = json.dumps({'error': 'User not found'})
+USER_ALREADY_EXISTS_RESPONSE_BODY = json.dumps({'error': 'User already exists'})
+
+LOGGER = logging.getLogger(__name__)
+
+app = Quart(__name__)
+app.config.update(CONFIG_DICT)
+
+
+@app.before_serving
+async def create_db_pool():
+    if failed_logins_buffer.is_enabled():
+        LOGGER.warning(
+            'FAILED_LOGINS_FLUSH_INTERVAL is ignored in async mode, failed login counts are '
+            'written to the DB on every login attempt'
+        )
+    await async_db_access.create_pool(
+        app.config['SQLALCHEMY_DATABASE_URI'],
+        app.config['ASYNC_DB_POOL_MIN_SIZE'],
+        app.config['ASYNC_DB_POOL_MAX_SIZE'],
+        app.config['DB_STATEMENT_TIMEOUT'],
+    )
+    if health.is_enabled():
+        app.health_probe_task = asyncio.ensure_future(_probe_db_periodically())
+
+
+@app.after_serving
+async def close_db_pool():
+    if getattr(app, 'health_probe_task', None) is not None:
+        app.health_probe_task.cancel()
+    await async_db_access.close_pool()
+    hashing.shutdown()
+    locked_accounts.shutdown()
+
+
+@app.before_request
+async def set_audit_request_id():
+    auditing.set_request_id(request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex)
+
+
+@app.errorhandler(hashing.HashingQueueFullError)
+async def handleHashingQueueFull(error):
+    LOGGER.warning('Rejected a request because the password hashing queue is full')
+    return Response(
+        SERVICE_BUSY_RESPONSE_BODY,
+        status=503,
+        mimetype=JSON_CONTENT_TYPE,
+        headers={'Retry-After': '1'}
+    )
+
+
+@app.errorhandler(Exception)
+async def handleServerError(error):
+    LOGGER.error(
+        'An error occurred when processing a request',
+        exc_info=error
+    )
+    return Response(
+        INTERNAL_SERVER_ERROR_RESPONSE_BODY,
+        status=500,
+        mimetype=JSON_CONTENT_TYPE
+    )
+
+
+@app.route('/', methods=['GET'])
+@app.route('/health', methods=['GET'])
+async def healthcheck():
+    return _get_healthcheck_response(await _check_db(), 500)
+
+
+@app.route('/health/live', methods=['GET'])
+async def liveness_check():
+    return Response(json.dumps({'status': 'ok'}), mimetype=JSON_CONTENT_TYPE)
+
+
+@app.route('/health/ready', methods=['GET'])
+async def readiness_check():
+    return _get_healthcheck_response(await _check_db(), 503)
+
+
+@app.route('/user/authenticate', methods=['POST'])
+async def authenticate_user():
+    request_json = await _try_get_request_json()
+
+    if request_json and request_validation.is_auth_request_data_valid(request_json):
+        credentials = request_json['credentials']
+        user_id = credentials['user_id']
+        password = credentials['password']
+
+        if not user_id_filter.might_exist(user_id):
+            return _handle_non_existing_user_auth_request(user_id)
+
+        failed_login_attempts = locked_accounts.record_attempt(user_id)
+        if failed_login_attempts is not None:
+            return _handle_locked_user_auth_request(user_id, failed_login_attempts)
+
+        user_credentials = await async_db_access.get_user_credentials(user_id)
+        if user_credentials is None:
+            return _handle_non_existing_user_auth_request(user_id)
+
+        password_hash, stored_failed_logins = user_credentials
+        password_matches = stored_failed_logins < MAX_LOGIN_ATTEMPTS and await _run_hashing(
+            security.verify_password, user_id, password, password_hash,
+            app.config['PASSWORD_SALT']
+        )
+        if password_matches and stored_failed_logins == 0:
+            failed_login_attempts = 0
+        else:
+            failed_login_attempts = await async_db_access.record_login_attempt(
+                user_id, password_matches, MAX_LOGIN_ATTEMPTS
+            )
+
+        if failed_login_attempts == 0 and hashing.needs_rehash(password_hash):
+            await _rehash_user_password(user_id, password, password_hash)
+
+        if failed_login_attempts is not None and failed_login_attempts >= MAX_LOGIN_ATTEMPTS:
+            locked_accounts.add(user_id, failed_login_attempts)
+
+        if failed_login_attempts is None:
+            return _handle_non_existing_user_auth_request(user_id)
+        elif failed_login_attempts > MAX_LOGIN_ATTEMPTS:
+            return _handle_locked_user_auth_request(user_id, failed_login_attempts)
+        elif failed_login_attempts > 0:
+            return _handle_invalid_password_auth_request(user_id, failed_login_attempts)
+        else:
+            response_body = json.dumps({"user": {"user_id": user_id}})
+            return Response(response_body, mimetype=JSON_CONTENT_TYPE)
+    else:
+        return _invalid_request_response()
+
+
+@app.route('/admin/user', methods=['POST'])
+async def create_user():
+    request_json = await _try_get_request_json()
+    if request_json and request_validation.is_create_request_data_valid(request_json):
+        user = request_json['user']
+        user_id = user['user_id']
+        password = user['password']
+        # Hashing is the expensive part, so it's skipped when the user is known to exist. Users
+        # created in the meantime are still caught by the insert.
+        if user_id_filter.might_exist(user_id) and await async_db_access.user_exists(user_id):
+            return _user_already_exists_response()
+
+        password_hash = await _hash_password(user_id, password)
+        if await async_db_access.create_user(user_id, password_hash):
+            user_id_filter.add(user_id)
+            auditing.audit(
+                'Created user {}'.format(user_id), auditing.USER_CREATED, user_id=user_id
+            )
+            return Response(json.dumps({'created': True}), mimetype=JSON_CONTENT_TYPE)
+        else:
+            return _user_already_exists_response()
+    else:
+        return _invalid_request_response()
+
+
+@app.route('/admin/user/<user_id>/update', methods=['POST'])
+async def update_user(user_id):
+    request_json = await _try_get_request_json()
+    if request_json and request_validation.is_update_request_data_valid(request_json):
+        new_password = request_json['user']['password']
+        # Same as server.update_user
+        if not await async_db_access.user_exists(user_id):
+            return _user_not_found_response()
+
+        new_password_hash = await _hash_password(user_id, new_password)
+        if await async_db_access.update_user(user_id, new_password_hash):
+            user_id_filter.add(user_id)
+            auditing.audit(
+                'Updated user {}'.format(user_id), auditing.USER_UPDATED, user_id=user_id
+            )
+            return Response(json.dumps({'updated': True}), mimetype=JSON_CONTENT_TYPE)
+        else:
+            return _user_not_found_response()
+    else:
+        return _invalid_request_response()
+
+
+@app.route('/admin/user/<user_id>', methods=['DELETE'])
+async def delete_user(user_id):
+    deleted = await async_db_access.delete_user(user_id)
+    account_unlocks.record_unlock(user_id)
+    if deleted:
+        auditing.audit(
+            'Deleted user {}'.format(user_id), auditing.USERS_DELETED, user_ids=[user_id]
+        )
+        return Response(json.dumps({'deleted': True}), mimetype=JSON_CONTENT_TYPE)
+    else:
+        return _user_not_found_response()
+
+
+@app.route('/admin/user/<user_id>/unlock-account')
+async def unlock_account(user_id):
+    reset = await async_db_access.update_failed_logins(user_id, 0)
+    account_unlocks.record_unlock(user_id)
+    if reset:
+        auditing.audit(
+            'Reset failed login attempts for user {}'.format(user_id),
+            auditing.FAILED_LOGINS_RESET, user_ids=[user_id]
+        )
+        return Response(json.dumps({'reset': True}), mimetype=JSON_CONTENT_TYPE)
+    else:
+        return _user_not_found_response()
+
+
+@app.route('/admin/user/<user_id>/get-failed-logins')
+async def get_failed_logins(user_id):
+    failed_logins = await async_db_access.get_failed_logins(user_id)
+    if failed_logins is not None:
+        failed_logins = locked_accounts.get_failed_logins(user_id, failed_logins)
+        LOGGER.info('Get failed login attempts for user {}'.format(user_id))
+        resp_json = json.dumps({'failed_login_attempts': failed_logins})
+        return Response(resp_json, mimetype=JSON_CONTENT_TYPE)
+    else:
+        return _user_not_found_response()
+
+
+async def _rehash_user_password(user_id, password, password_hash):
+    # Same as server._rehash_user_password
+    try:
+        new_password_hash = await _hash_password(user_id, password)
+        upgraded = await async_db_access.update_password_hash(
+            user_id, password_hash, new_password_hash
+        )
+    except hashing.HashingQueueFullError:
+        LOGGER.info(
+            'Skipped upgrading password hash for user {} as hashing is busy'.format(user_id)
+        )
+        return
+    except Exception as e:
+        LOGGER.warning('Failed to upgrade password hash for user {}'.format(user_id), exc_info=e)
+        return
+
+    if upgraded:
+        LOGGER.info('Upgraded password hash for user {}'.format(user_id))
+
+
+async def _hash_password(user_id, password):
+    algorithm, params = hashing.get_hash_settings()
+    return await _run_hashing(security.hash_password, user_id, password, algorithm, params)
+
+
+async def _run_hashing(fn, *args):
+    if CONFIG_DICT['HASHING_POOL_SIZE'] > 0:
+        return await asyncio.wrap_future(hashing.get_executor().submit(fn, *args))
+    else:
+        # hashlib releases the GIL while hashing, so a thread is enough to keep the loop free
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+def _handle_non_existing_user_auth_request(user_id):
+    auditing.audit(
+        'Invalid credentials used. username: {}. User does not exist.'.format(user_id),
+        auditing.UNKNOWN_USER_LOGIN, user_id=user_id
+    )
+    return Response(AUTH_FAILURE_RESPONSE_BODY, status=401, mimetype=JSON_CONTENT_TYPE)
+
+
+def _handle_locked_user_auth_request(user_id, failed_login_attempts):
+    auditing.audit(
+        'Too many bad logins. username: {}, attempt: {}.'.format(user_id, failed_login_attempts),
+        auditing.LOCKED_USER_LOGIN, user_id=user_id, attempt=failed_login_attempts
+    )
+    return Response(AUTH_FAILURE_RESPONSE_BODY, status=401, mimetype=JSON_CONTENT_TYPE)
+
+
+def _handle_invalid_password_auth_request(user_id, failed_login_attempts):
+    auditing.audit(
+        'Invalid credentials used. username: {}, attempt: {}.'.format(
+            user_id, failed_login_attempts
+        ),
+        auditing.INVALID_PASSWORD_LOGIN, user_id=user_id, attempt=failed_login_attempts
+    )
+    return Response(AUTH_FAILURE_RESPONSE_BODY, status=401, mimetype=JSON_CONTENT_TYPE)
+
+
+async def _try_get_request_json():
+    try:
+        return await request.get_json()
+    except Exception as e:
+        LOGGER.error('Failed to parse JSON body from request', exc_info=e)
+        return None
+
+
+def _invalid_request_response():
+    return Response(INVALID_REQUEST_RESPONSE_BODY, status=400, mimetype=JSON_CONTENT_TYPE)
+
+
+def _user_not_found_response():
+    return Response(USER_NOT_FOUND_RESPONSE_BODY, status=404, mimetype=JSON_CONTENT_TYPE)
+
+
+def _user_already_exists_response():
+    return Response(USER_ALREADY_EXISTS_RESPONSE_BODY, status=409, mimetype=JSON_CONTENT_TYPE)
+
+
+async def _check_db():
+    # Same as health.check_db, with the probe run on the event loop instead of a thread
+    if health.is_enabled():
+        result = health.get_prober().get_result()
+        if result is not None:
+            return result
+
+    return await _probe_db()
+
+
+async def _probe_db():
+    start = time.monotonic()
+    try:
+        await async_db_access.check_connection()
+        error_message = None
+    except Exception as e:
+        LOGGER.warning('DB health probe failed: {}'.format(e))
+        error_message = health.DB_ERROR_MESSAGE_FORMAT.format(str(e))
+
+    return health.ProbeResult(error_message, time.monotonic() - start, time.time())
+
+
+async def _probe_db_periodically():
+    while True:
+        health.get_prober().record_result(await _probe_db())
+        await asyncio.sleep(app.config['HEALTH_PROBE_INTERVAL'])
+
+
+def _get_healthcheck_response(probe_result, error_status_code):
+    response_body = probe_result.to_dict(time.time())
+
+    pool_stats = async_db_access.get_pool_stats()
+    if pool_stats:
+        response_body['db_pool'] = pool_stats
+
+    return Response(
+        json.dumps(response_body),
+        status=error_status_code if probe_result.error_message else 200,
+        mimetype=JSON_CONTENT_TYPE,
+    )
@@ -0,0 +1,118 @@
+import re
+
+import asyncpg  # type: ignore
+
+RECORD_LOGIN_ATTEMPT_QUERY = (
+    'UPDATE users SET failed_logins = CASE '
+    'WHEN COALESCE(failed_logins, 0) < $3 AND $2 THEN 0 '
+    'ELSE COALESCE(failed_logins, 0) + 1 END '
+    'WHERE user_id = $1 '
+    'RETURNING failed_logins'
+)
+GET_USER_CREDENTIALS_QUERY = (
+    'SELECT password_hash, COALESCE(failed_logins, 0) FROM users WHERE user_id = $1'
+)
+USER_EXISTS_QUERY = 'SELECT 1 FROM users WHERE user_id = $1'
+CREATE_USER_QUERY = (
+    'INSERT INTO users (user_id, password_hash, failed_logins) VALUES ($1, $2, 0) '
+    'ON CONFLICT (user_id) DO NOTHING RETURNING user_id'
+)
+UPDATE_USER_QUERY = 'UPDATE users SET password_hash = $2 WHERE user_id = $1'
+UPDATE_PASSWORD_HASH_QUERY = (
+    'UPDATE users SET password_hash = $3 WHERE user_id = $1 AND password_hash = $2'
+)
+DELETE_USER_QUERY = 'DELETE FROM users WHERE user_id = $1'
+GET_FAILED_LOGINS_QUERY = 'SELECT failed_logins FROM users WHERE user_id = $1'
+UPDATE_FAILED_LOGINS_QUERY = 'UPDATE users SET failed_logins = $2 WHERE user_id = $1'
+CHECK_CONNECTION_QUERY = 'SELECT 1'
+
+_pool = None
+
+
+async def create_pool(database_uri, min_size, max_size, statement_timeout=0):
+    global _pool
+
+    # asyncpg takes a plain postgresql:// DSN, without SQLAlchemy's driver name
+    dsn = re.sub(r'^postgresql\+\w+://', 'postgresql://', database_uri)
+    server_settings = {'statement_timeout': str(statement_timeout)} if statement_timeout else None
+    _pool = await asyncpg.create_pool(
+        dsn, min_size=min_size, max_size=max_size, server_settings=server_settings
+    )
+
+
+async def close_pool():
+    global _pool
+
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool_stats():
+    # Returns None when the pool hasn't been created
+    if _pool is None:
+        return None
+
+    size = _pool.get_size()
+    return {
+        'size': size,
+        'min_size': _pool.get_min_size(),
+        'max_size': _pool.get_max_size(),
+        'checked_out': size - _pool.get_idle_size(),
+    }
+
+
+async def get_user_credentials(user_id):
+    # Same contract as db_access.get_user_credentials
+    row = await _pool.fetchrow(GET_USER_CREDENTIALS_QUERY, user_id)
+    return (row[0], row[1]) if row else None
+
+
+async def record_login_attempt(user_id, password_matches, max_failed_logins):
+    # Same contract as db_access.record_login_attempt
+    return await _pool.fetchval(
+        RECORD_LOGIN_ATTEMPT_QUERY, user_id, password_matches, max_failed_logins
+    )
+
+
+async def user_exists(user_id):
+    return await _pool.fetchval(USER_EXISTS_QUERY, user_id) is not None
+
+
+async def create_user(user_id, password_hash):
+    return await _pool.fetchval(CREATE_USER_QUERY, user_id, password_hash) is not None
+
+
+async def update_user(user_id, password_hash):
+    return _get_row_count(await _pool.execute(UPDATE_USER_QUERY, user_id, password_hash))
+
+
+async def update_password_hash(user_id, old_password_hash, new_password_hash):
+    # Single user version of db_access.update_password_hashes. Returns whether it was replaced.
+    return _get_row_count(await _pool.execute(
+        UPDATE_PASSWORD_HASH_QUERY, user_id, old_password_hash, new_password_hash
+    )) > 0
+
+
+async def delete_user(user_id):
+    return _get_row_count(await _pool.execute(DELETE_USER_QUERY, user_id))
+
+
+async def get_failed_logins(user_id):
+    row = await _pool.fetchrow(GET_FAILED_LOGINS_QUERY, user_id)
+    return row[0] if row else None
+
+
+async def update_failed_logins(user_id, failed_logins):
+    return _get_row_count(
+        await _pool.execute(UPDATE_FAILED_LOGINS_QUERY, user_id, failed_logins)
+    )
+
+
+async def check_connection():
+    await _pool.fetchval(CHECK_CONNECTION_QUERY)
+
+
+def _get_row_count(status):
+    # asyncpg returns the command status, e.g. 'UPDATE 1'
+    return int(status.split()[-1])
@@ -1,13 +1,56 @@
+import contextvars
+import datetime
+import json
 import logging
 
 LOGGER = logging.getLogger(__name__)
 AUDITING_LOGGER_NAME = __name__
 
+# Audit event types, recorded by the structured (NDJSON) audit log format
+USER_CREATED = 'user_created'
+USER_UPDATED = 'user_updated'
+USERS_DELETED = 'users_deleted'
+FAILED_LOGINS_RESET = 'failed_logins_reset'
+USERS_EXPORTED = 'users_exported'
+UNKNOWN_USER_LOGIN = 'unknown_user_login'
+LOCKED_USER_LOGIN = 'locked_user_login'
+INVALID_PASSWORD_LOGIN = 'invalid_password_login'
 
-def audit(message):
-    LOGGER.info(message)
+# Set for each request, so that its audit entries can be told apart from other requests'
+_request_id = contextvars.ContextVar('audit_request_id', default=None)
+
+
+def audit(message, event=None, **fields):
+    # The fields (e.g. user_id, user_ids or attempt) are only written by the NDJSON format
+    LOGGER.info(message, extra={
+        'audit_event': event,
+        'audit_fields': fields,
+        'audit_request_id': _request_id.get(),
+    })
+
+
+def set_request_id(request_id):
+    _request_id.set(request_id)
 
 
 class ExcludeAuditingFilter(logging.Filter):
     def filter(self, record):
         return not record.name.startswith(AUDITING_LOGGER_NAME)
+
+
+class NdjsonAuditFormatter(logging.Formatter):
+    # Formats each audit entry as one JSON object, e.g.
+    # {"timestamp": "2024-01-01T12:00:00.000+00:00", "event": "invalid_password_login",
+    #  "user_id": "userid123", "attempt": 2, "request_id": "...", "message": "Invalid ..."}
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec='milliseconds'),
+            'event': getattr(record, 'audit_event', None),
+        }
+        entry.update(getattr(record, 'audit_fields', {}))
+        entry['request_id'] = getattr(record, 'audit_request_id', None)
+        entry['message'] = record.getMessage()
+        return json.dumps(entry)
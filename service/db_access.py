@@ -1,18 +1,107 @@
-from sqlalchemy.exc import ProgrammingError, SQLAlchemyError  # type: ignore
+import re
 
-from service import db
+from sqlalchemy import text  # type: ignore
+from sqlalchemy.exc import SQLAlchemyError  # type: ignore
 
-SQL_STATE_DUPLICATE_KEY = '23505'
+from service import db, metrics
+
+USER_ID_BATCH_SIZE = 10000
+EXPORT_BATCH_SIZE = 10000
+
+# Resets the counter when the password matched and the account isn't locked, increments it
+# otherwise. Returns nothing when the user doesn't exist.
+RECORD_LOGIN_ATTEMPT_QUERY = text(
+    'UPDATE users SET failed_logins = CASE '
+    'WHEN COALESCE(failed_logins, 0) < :max_failed_logins AND :password_matches THEN 0 '
+    'ELSE COALESCE(failed_logins, 0) + 1 END '
+    'WHERE user_id = :user_id '
+    'RETURNING failed_logins'
+)
+
+USER_EXISTS_QUERY = text('SELECT 1 FROM users WHERE user_id = :user_id')
+
+GET_USER_CREDENTIALS_QUERY = text(
+    'SELECT password_hash, COALESCE(failed_logins, 0) FROM users WHERE user_id = :user_id'
+)
+
+APPLY_FAILED_LOGINS_CHANGE_QUERY = text(
+    'UPDATE users SET failed_logins = CASE WHEN :reset THEN :increment '
+    'ELSE COALESCE(failed_logins, 0) + :increment END '
+    'WHERE user_id = :user_id'
+)
+
+
+# Inserts many users in one statement, skipping the ones that already exist
+CREATE_USERS_QUERY_FORMAT = (
+    'INSERT INTO users (user_id, password_hash, failed_logins) VALUES {} '
+    'ON CONFLICT (user_id) DO NOTHING RETURNING user_id'
+)
+
+UNLOCK_ACCOUNTS_QUERY_FORMAT = (
+    'UPDATE users SET failed_logins = 0 WHERE {} RETURNING user_id'
+)
+DELETE_USERS_QUERY_FORMAT = 'DELETE FROM users WHERE {} RETURNING user_id'
+# Limits a bulk statement to the first users by ID after the previous batch, and returns their IDs
+# in that order, so that the last one is where the next batch starts
+BULK_BATCH_CONDITION_FORMAT = (
+    'user_id IN (SELECT user_id FROM users WHERE {} AND user_id > :after_user_id '
+    'ORDER BY user_id LIMIT :limit)'
+)
+BULK_BATCH_QUERY_FORMAT = 'WITH affected AS ({}) SELECT user_id FROM affected ORDER BY user_id'
+
+DECLARE_EXPORT_CURSOR_QUERY_FORMAT = (
+    'DECLARE users_export NO SCROLL CURSOR FOR '
+    'SELECT user_id, COALESCE(failed_logins, 0){} FROM users ORDER BY user_id'
+)
+FETCH_EXPORT_CURSOR_QUERY = text(
+    'FETCH FORWARD {} FROM users_export'.format(EXPORT_BATCH_SIZE)
+)
+
+# The failed login count is inlined rather than bound, so that the planner can match it against
+# the predicate of the ix_users_locked partial index
+GET_LOCKED_USERS_QUERY_FORMAT = (
+    'SELECT user_id, failed_logins FROM users '
+    'WHERE failed_logins >= {:d} AND user_id > :after_user_id '
+    'ORDER BY user_id LIMIT :limit'
+)
+GET_PASSWORD_HASHES_QUERY = text(
+    'SELECT user_id, password_hash FROM users WHERE user_id > :after_user_id '
+    'ORDER BY user_id LIMIT :limit'
+)
+# Only replaces hashes that haven't changed since they were read
+UPDATE_PASSWORD_HASHES_QUERY_FORMAT = (
+    'WITH changes (user_id, old_password_hash, new_password_hash) AS (VALUES {}) '
+    'UPDATE users SET password_hash = changes.new_password_hash FROM changes '
+    'WHERE users.user_id = changes.user_id '
+    'AND users.password_hash = changes.old_password_hash '
+    'RETURNING users.user_id'
+)
+
+# Failed logins after which an account is locked. Defined here rather than in service.server,
+# as the ix_users_locked index only covers accounts with at least this many.
+MAX_LOGIN_ATTEMPTS = 10
+# Length of the password_hash column. Each layer wrapped around a hash makes it longer.
+MAX_PASSWORD_HASH_LENGTH = 255
 
 
 class User(db.Model):  # type: ignore
     __tablename__ = 'users'
 
     user_id = db.Column(db.String(100), primary_key=True)
-    password_hash = db.Column(db.String(64))
+    password_hash = db.Column(db.String(MAX_PASSWORD_HASH_LENGTH))
     failed_logins = db.Column(db.Integer)
 
+    __table_args__ = (
+        db.Index(
+            'ix_users_locked', 'user_id',
+            postgresql_where=text(
+                'failed_logins >= {:d}'.format(MAX_LOGIN_ATTEMPTS)
+            )
+        ),
+    )
 
+
+@metrics.timed(metrics.DB_DURATION, 'db')
 def get_user(user_id, password_hash):
     return User.query.filter(
         User.user_id == user_id,
@@ -20,21 +109,43 @@ def get_user(user_id, password_hash):
     ).first()
 
 
+@metrics.timed(metrics.DB_DURATION, 'db')
+def user_exists(user_id):
+    return db.session.execute(USER_EXISTS_QUERY, {'user_id': user_id}).first() is not None
+
+
+@metrics.timed(metrics.DB_DURATION, 'db')
 def create_user(user_id, password_hash):
+    # Returns False, without changing anything, when the user already exists
+    return user_id in create_users([(user_id, password_hash)])
+
+
+@metrics.timed(metrics.DB_DURATION, 'db')
+def create_users(users):
+    # Takes a list of (user_id, password_hash) tuples with distinct user IDs and returns the set
+    # of IDs that got created (the rest already existed)
+    if not users:
+        return set()
+
+    values = []
+    params = {}
+    for i, (user_id, password_hash) in enumerate(users):
+        values.append('(:user_id_{0}, :password_hash_{0}, 0)'.format(i))
+        params['user_id_{}'.format(i)] = user_id
+        params['password_hash_{}'.format(i)] = password_hash
+
     try:
-        user = User(user_id=user_id, password_hash=password_hash, failed_logins=0)  # type: ignore
-        db.session.add(user)
+        rows = db.session.execute(
+            text(CREATE_USERS_QUERY_FORMAT.format(', '.join(values))), params
+        ).fetchall()
         db.session.commit()
-        return True
-    except ProgrammingError as e:
+        return {row[0] for row in rows}
+    except SQLAlchemyError as e:
         db.session.rollback()
-        # This is what SQLAlchemy throws when a duplicate key error occurs
-        if e.args and e.args[0].find(SQL_STATE_DUPLICATE_KEY) >= 0:
-            return False
-        else:
-            raise Exception('An error occurred when trying to insert user into DB', e)
+        raise e
 
 
+@metrics.timed(metrics.DB_DURATION, 'db')
 def update_user(user_id, password_hash):
     try:
         result = User.query.filter(User.user_id == user_id).update(
@@ -47,6 +158,7 @@ def update_user(user_id, password_hash):
         raise e
 
 
+@metrics.timed(metrics.DB_DURATION, 'db')
 def delete_user(user_id):
     try:
         result = User.query.filter(User.user_id == user_id).delete()
@@ -57,6 +169,106 @@ def delete_user(user_id):
         raise e
 
 
+@metrics.timed(metrics.DB_DURATION, 'db')
+def unlock_accounts(user_ids=None, min_failed_logins=None, user_id_prefix=None,
+                    after_user_id=None, limit=None):
+    # Resets the failed login count of the given users, or of the users matching the filters,
+    # in a single statement and returns the IDs of the users it got reset for. With a limit, only
+    # that many matching users with IDs after after_user_id are reset, and their IDs are returned
+    # in order.
+    return _run_bulk_query(
+        UNLOCK_ACCOUNTS_QUERY_FORMAT, user_ids, min_failed_logins, user_id_prefix,
+        after_user_id, limit
+    )
+
+
+@metrics.timed(metrics.DB_DURATION, 'db')
+def delete_users(user_ids=None, min_failed_logins=None, user_id_prefix=None,
+                 after_user_id=None, limit=None):
+    # Same as unlock_accounts, but deletes the users
+    return _run_bulk_query(
+        DELETE_USERS_QUERY_FORMAT, user_ids, min_failed_logins, user_id_prefix, after_user_id,
+        limit
+    )
+
+
+@metrics.timed(metrics.DB_DURATION, 'db')
+def get_locked_users(min_failed_logins, after_user_id, limit):
+    # Returns up to limit (user_id, failed_logins) tuples of users with at least the given
+    # failed login count and an ID greater than after_user_id, ordered by ID
+    rows = db.session.execute(text(GET_LOCKED_USERS_QUERY_FORMAT.format(min_failed_logins)), {
+        'after_user_id': after_user_id,
+        'limit': limit,
+    }).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+@metrics.timed(metrics.DB_DURATION, 'db')
+def get_password_hashes(after_user_id, limit):
+    # Returns up to limit (user_id, password_hash) tuples of users with an ID greater than
+    # after_user_id, ordered by ID
+    rows = db.session.execute(GET_PASSWORD_HASHES_QUERY, {
+        'after_user_id': after_user_id,
+        'limit': limit,
+    }).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+@metrics.timed(metrics.DB_DURATION, 'db')
+def update_password_hashes(changes):
+    # Takes a list of (user_id, old_password_hash, new_password_hash) tuples and replaces each
+    # hash in a single statement, unless it has changed in the meantime. Returns the set of IDs
+    # of the users it got replaced for.
+    if not changes:
+        return set()
+
+    values = []
+    params = {}
+    for i, (user_id, old_password_hash, new_password_hash) in enumerate(changes):
+        values.append('(:user_id_{0}, :old_password_hash_{0}, :new_password_hash_{0})'.format(i))
+        params['user_id_{}'.format(i)] = user_id
+        params['old_password_hash_{}'.format(i)] = old_password_hash
+        params['new_password_hash_{}'.format(i)] = new_password_hash
+
+    try:
+        rows = db.session.execute(
+            text(UPDATE_PASSWORD_HASHES_QUERY_FORMAT.format(', '.join(values))), params
+        ).fetchall()
+        db.session.commit()
+        return {row[0] for row in rows}
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise e
+
+
+def get_all_user_ids():
+    for (user_id,) in db.session.query(User.user_id).yield_per(USER_ID_BATCH_SIZE):
+        yield user_id
+
+
+def export_users(include_password_hash=False):
+    # Yields (user_id, failed_logins[, password_hash]) tuples for all users, read through a
+    # server-side cursor, so that only one batch of rows is held in memory whatever the driver.
+    # Bypasses the session, so that the rows don't end up in its identity map.
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    try:
+        connection.execute(text(DECLARE_EXPORT_CURSOR_QUERY_FORMAT.format(
+            ', password_hash' if include_password_hash else ''
+        )))
+        while True:
+            rows = connection.execute(FETCH_EXPORT_CURSOR_QUERY).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
+    finally:
+        # Nothing got changed - ending the transaction closes the cursor
+        transaction.rollback()
+        connection.close()
+
+
+@metrics.timed(metrics.DB_DURATION, 'db')
 def get_failed_logins(user_id):
     result = User.query.filter(User.user_id == user_id).first()
     if result:
@@ -65,6 +277,7 @@ def get_failed_logins(user_id):
         return None
 
 
+@metrics.timed(metrics.DB_DURATION, 'db')
 def update_failed_logins(user_id, failed_logins):
     try:
         result = User.query.filter(User.user_id == user_id).update(
@@ -75,3 +288,79 @@ def update_failed_logins(user_id, failed_logins):
     except SQLAlchemyError as e:
         db.session.rollback()
         raise e
+
+
+@metrics.timed(metrics.DB_DURATION, 'db')
+def get_user_credentials(user_id):
+    # Returns a (password_hash, failed_logins) tuple or None when the user doesn't exist
+    row = db.session.execute(GET_USER_CREDENTIALS_QUERY, {'user_id': user_id}).first()
+    return (row[0], row[1]) if row else None
+
+
+@metrics.timed(metrics.DB_DURATION, 'db')
+def record_login_attempt(user_id, password_matches, max_failed_logins):
+    # Updates the failed login count in a single atomic statement and returns its new value
+    # (0 when the user got authenticated) or None when the user doesn't exist
+    try:
+        row = db.session.execute(RECORD_LOGIN_ATTEMPT_QUERY, {
+            'user_id': user_id,
+            'password_matches': password_matches,
+            'max_failed_logins': max_failed_logins,
+        }).first()
+        db.session.commit()
+        return row[0] if row else None
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise e
+
+
+@metrics.timed(metrics.DB_DURATION, 'db')
+def apply_failed_logins_changes(changes):
+    # Takes a dict of user_id -> (reset, increment) and applies it in a single transaction
+    try:
+        db.session.execute(APPLY_FAILED_LOGINS_CHANGE_QUERY, [
+            {'user_id': user_id, 'reset': reset, 'increment': increment}
+            for user_id, (reset, increment) in changes.items()
+        ])
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise e
+
+
+def _run_bulk_query(query_format, user_ids, min_failed_logins, user_id_prefix, after_user_id,
+                    limit):
+    conditions = []
+    params = {}
+    if user_ids is not None:
+        if not user_ids:
+            return []
+        conditions.append('user_id IN ({})'.format(
+            ', '.join(':user_id_{}'.format(i) for i in range(len(user_ids)))
+        ))
+        params.update({'user_id_{}'.format(i): user_id for i, user_id in enumerate(user_ids)})
+    if min_failed_logins is not None:
+        if min_failed_logins < 1:
+            raise ValueError('A failed login count below 1 would match every user')
+        conditions.append('COALESCE(failed_logins, 0) >= :min_failed_logins')
+        params['min_failed_logins'] = min_failed_logins
+    if user_id_prefix is not None:
+        conditions.append("user_id LIKE :user_id_pattern ESCAPE '\\'")
+        params['user_id_pattern'] = re.sub(r'([\\%_])', r'\\\1', user_id_prefix) + '%'
+    if not conditions:
+        raise ValueError('Bulk operations need user IDs or a filter')
+
+    query = query_format.format(' AND '.join(conditions))
+    if limit is not None:
+        query = BULK_BATCH_QUERY_FORMAT.format(
+            query_format.format(BULK_BATCH_CONDITION_FORMAT.format(' AND '.join(conditions)))
+        )
+        params.update({'after_user_id': after_user_id or '', 'limit': limit})
+
+    try:
+        rows = db.session.execute(text(query), params).fetchall()
+        db.session.commit()
+        return [row[0] for row in rows]
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise e
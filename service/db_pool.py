@@ -0,0 +1,102 @@
+import threading
+import time
+
+from flask_sqlalchemy import SQLAlchemy  # type: ignore
+from sqlalchemy import event, exc  # type: ignore
+from sqlalchemy.pool import QueuePool  # type: ignore
+
+from config import CONFIG_DICT
+
+
+class InstrumentedQueuePool(QueuePool):
+    # Connection pool that keeps track of how long requests wait for a connection and how
+    # often it has to go over its size
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._overflow_events = 0
+        self._timeouts = 0
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'size': self.size(),
+                'checked_out': self.checkedout(),
+                'overflow': max(0, self.overflow()),
+                'checkouts': self._checkouts,
+                'average_wait_ms': (
+                    self._total_wait_time / self._checkouts * 1000 if self._checkouts else 0.0
+                ),
+                'max_wait_ms': self._max_wait_time * 1000,
+                'overflow_events': self._overflow_events,
+                'timeouts': self._timeouts,
+            }
+
+    def _do_get(self):
+        overflow_before = self.overflow()
+        start = time.monotonic()
+        try:
+            connection = super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+
+        wait_time = time.monotonic() - start
+        with self._stats_lock:
+            self._checkouts += 1
+            self._total_wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+            if self.overflow() > max(0, overflow_before):
+                self._overflow_events += 1
+
+        return connection
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    # Applies the DB_* pool settings to PostgreSQL engines
+
+    def apply_driver_hacks(self, app, info, options):
+        result = super(PooledSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername.startswith('postgresql'):
+            options.update({
+                'poolclass': InstrumentedQueuePool,
+                'pool_size': CONFIG_DICT['DB_POOL_SIZE'],
+                'max_overflow': CONFIG_DICT['DB_MAX_OVERFLOW'],
+                'pool_timeout': CONFIG_DICT['DB_POOL_TIMEOUT'],
+                'pool_recycle': CONFIG_DICT['DB_POOL_RECYCLE'],
+            })
+
+        return result
+
+
+def get_stats(pool):
+    # Returns None for pools that aren't instrumented (e.g. SQLite's)
+    return pool.stats() if isinstance(pool, InstrumentedQueuePool) else None
+
+
+@event.listens_for(InstrumentedQueuePool, 'connect')
+def _set_statement_timeout(dbapi_connection, connection_record):
+    if CONFIG_DICT['DB_STATEMENT_TIMEOUT'] > 0:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SET statement_timeout = {:d}'.format(CONFIG_DICT['DB_STATEMENT_TIMEOUT']))
+        cursor.close()
+        # Otherwise the setting would be undone when the pool rolls the connection back
+        dbapi_connection.commit()
+
+
+@event.listens_for(InstrumentedQueuePool, 'checkout')
+def _ping_connection(dbapi_connection, connection_record, connection_proxy):
+    # Makes the pool replace connections that went stale (e.g. after a DB restart) before
+    # they're handed out, rather than failing the request that gets them
+    if CONFIG_DICT['DB_POOL_PRE_PING']:
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except Exception:
+            raise exc.DisconnectionError()
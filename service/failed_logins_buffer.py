@@ -0,0 +1,144 @@
+import logging
+import threading
+
+from config import CONFIG_DICT
+from service import account_unlocks, app, db_access, periodic
+
+LOGGER = logging.getLogger(__name__)
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+class FailedLoginsBuffer(object):
+    # Keeps changes to failed login counts in memory and writes them to the DB in batches.
+    # A change is stored as a (reset, increment) pair rather than an absolute value, so that
+    # batches written by different gunicorn workers add up instead of overwriting each other.
+    # Changes recorded before the account was unlocked through any worker are dropped rather than
+    # written over the reset count (see account_unlocks).
+
+    def __init__(self, flush_interval):
+        self._changes = {}
+        # The unlock generation of each user's account when their change was first recorded
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._flush_thread = periodic.PeriodicThread(
+            'failed-logins-flush', flush_interval, wait_first=True
+        )
+
+    def get_failed_logins(self, user_id, stored_failed_logins):
+        with self._lock:
+            return self._get_failed_logins(user_id, stored_failed_logins)
+
+    def record_login_attempt(self, user_id, stored_failed_logins, password_matches,
+                             max_failed_logins):
+        # Same rules as db_access.record_login_attempt, applied to the count as seen through
+        # the buffer
+        with self._lock:
+            failed_logins = self._get_failed_logins(user_id, stored_failed_logins)
+
+            if failed_logins < max_failed_logins and password_matches:
+                if failed_logins > 0:
+                    self._set_change(user_id, (True, 0))
+                new_failed_logins = 0
+            else:
+                reset, increment = self._get_change(user_id) or (False, 0)
+                self._set_change(user_id, (reset, increment + 1))
+                new_failed_logins = failed_logins + 1
+
+        self._flush_thread.ensure_running(self._flush_logging_errors)
+        return new_failed_logins
+
+    def record_failed_login(self, user_id):
+        with self._lock:
+            reset, increment = self._get_change(user_id) or (False, 0)
+            self._set_change(user_id, (reset, increment + 1))
+
+        self._flush_thread.ensure_running(self._flush_logging_errors)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._changes)
+
+    def flush(self):
+        with self._lock:
+            for user_id in list(self._changes):
+                self._get_change(user_id)
+            changes, generations = self._changes, self._generations
+            self._changes, self._generations = {}, {}
+
+        if changes:
+            try:
+                with app.app_context():
+                    db_access.apply_failed_logins_changes(changes)
+            except Exception:
+                self._restore(changes, generations)
+                raise
+
+    def close(self):
+        self._flush_thread.stop()
+        self.flush()
+
+    def _get_failed_logins(self, user_id, stored_failed_logins):
+        change = self._get_change(user_id)
+        if change is None:
+            return stored_failed_logins
+
+        reset, increment = change
+        return (0 if reset else stored_failed_logins) + increment
+
+    def _get_change(self, user_id):
+        # Drops the change if the account was unlocked since it was first recorded
+        change = self._changes.get(user_id)
+        if change is not None and (
+                self._generations[user_id] != account_unlocks.get_generation(user_id)):
+            del self._changes[user_id]
+            del self._generations[user_id]
+            return None
+        return change
+
+    def _set_change(self, user_id, change):
+        if user_id not in self._changes:
+            self._generations[user_id] = account_unlocks.get_generation(user_id)
+        self._changes[user_id] = change
+
+    def _restore(self, changes, generations):
+        # Puts back changes that couldn't be written, keeping any recorded in the meantime
+        with self._lock:
+            for user_id, (reset, increment) in changes.items():
+                if generations[user_id] != account_unlocks.get_generation(user_id):
+                    continue
+                newer_change = self._get_change(user_id)
+                if newer_change is None:
+                    self._changes[user_id] = (reset, increment)
+                    self._generations[user_id] = generations[user_id]
+                elif not newer_change[0]:
+                    self._changes[user_id] = (reset, increment + newer_change[1])
+
+    def _flush_logging_errors(self):
+        try:
+            self.flush()
+        except Exception as e:
+            LOGGER.error('Failed to write failed login counts to the DB', exc_info=e)
+
+
+def is_enabled():
+    return CONFIG_DICT['FAILED_LOGINS_FLUSH_INTERVAL'] > 0
+
+
+def get_buffer():
+    global _buffer
+
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = FailedLoginsBuffer(CONFIG_DICT['FAILED_LOGINS_FLUSH_INTERVAL'])
+        return _buffer
+
+
+def shutdown():
+    global _buffer
+
+    with _buffer_lock:
+        if _buffer is not None:
+            _buffer.close()
+            _buffer = None
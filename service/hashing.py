@@ -0,0 +1,135 @@
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import threading
+
+from config import CONFIG_DICT
+from service import metrics, security
+
+# Passwords hashed per task by bulk operations, small enough not to hold up logins for long
+BULK_HASHING_CHUNK_SIZE = 10
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class HashingQueueFullError(Exception):
+    pass
+
+
+class HashingExecutor(object):
+
+    def __init__(self, pool_size, queue_size):
+        self._pool = ProcessPoolExecutor(max_workers=pool_size)
+        # Limits the number of hashes either being computed or waiting for a free process
+        self._slots = threading.BoundedSemaphore(pool_size + queue_size)
+
+    def submit(self, fn, *args):
+        return self._submit(fn, args, blocking=False)
+
+    def submit_waiting(self, fn, *args):
+        # Waits for a free slot instead of failing, for work that isn't answering a login
+        return self._submit(fn, args, blocking=True)
+
+    def _submit(self, fn, args, blocking):
+        if not self._slots.acquire(blocking=blocking):
+            raise HashingQueueFullError('Password hashing queue is full')
+
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+
+def get_executor():
+    global _executor
+
+    # The pool is created lazily, so that each gunicorn worker gets its own after forking
+    with _executor_lock:
+        if _executor is None:
+            _executor = HashingExecutor(
+                CONFIG_DICT['HASHING_POOL_SIZE'],
+                CONFIG_DICT['HASHING_QUEUE_SIZE']
+            )
+        return _executor
+
+
+def get_hash_settings():
+    algorithm = CONFIG_DICT['PASSWORD_HASH_ALGORITHM']
+    if algorithm == security.SCRYPT:
+        params = {
+            'n': CONFIG_DICT['PASSWORD_HASH_SCRYPT_N'],
+            'r': CONFIG_DICT['PASSWORD_HASH_SCRYPT_R'],
+            'p': CONFIG_DICT['PASSWORD_HASH_SCRYPT_P'],
+        }
+    else:
+        params = {'i': CONFIG_DICT['PASSWORD_HASH_PBKDF2_ITERATIONS']}
+
+    return algorithm, params
+
+
+@metrics.timed(metrics.HASHING_DURATION, 'hash')
+def hash_password(user_id, password):
+    algorithm, params = get_hash_settings()
+    return run(security.hash_password, user_id, password, algorithm, params)
+
+
+@metrics.timed(metrics.HASHING_DURATION, 'hash')
+def hash_passwords(credentials):
+    # Takes a list of (user_id, password) tuples and returns their hashes in the same order
+    algorithm, params = get_hash_settings()
+    pool_size = CONFIG_DICT['HASHING_POOL_SIZE']
+    if pool_size <= 0:
+        return security.hash_passwords(credentials, algorithm, params)
+
+    # Keeps at most one chunk per process but one in flight, so that a login doesn't have to wait
+    # for a chunk to finish, unless there's only one process
+    max_pending = max(1, pool_size - 1)
+    password_hashes = []
+    pending = collections.deque()
+    for start in range(0, len(credentials), BULK_HASHING_CHUNK_SIZE):
+        if len(pending) >= max_pending:
+            password_hashes.extend(pending.popleft().result())
+        pending.append(get_executor().submit_waiting(
+            security.hash_passwords,
+            credentials[start:start + BULK_HASHING_CHUNK_SIZE],
+            algorithm,
+            params
+        ))
+
+    while pending:
+        password_hashes.extend(pending.popleft().result())
+
+    return password_hashes
+
+
+@metrics.timed(metrics.HASHING_DURATION, 'hash')
+def verify_password(user_id, password, password_hash, legacy_salt):
+    return run(security.verify_password, user_id, password, password_hash, legacy_salt)
+
+
+def needs_rehash(password_hash):
+    algorithm, params = get_hash_settings()
+    return security.needs_rehash(password_hash, algorithm, params)
+
+
+def run(fn, *args):
+    if CONFIG_DICT['HASHING_POOL_SIZE'] > 0:
+        return get_executor().submit(fn, *args).result()
+    else:
+        return fn(*args)
+
+
+def shutdown():
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
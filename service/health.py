@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+
+from config import CONFIG_DICT
+from service import app, db_access, periodic
+
+LOGGER = logging.getLogger(__name__)
+
+DB_ERROR_MESSAGE_FORMAT = 'Problem talking to PostgreSQL: {0}'
+STALE_RESULT_ERROR_MESSAGE = 'The last DB health probe is too old'
+# Results older than this many probe intervals mean the prober got stuck
+MAX_RESULT_AGE_INTERVALS = 3
+
+_prober = None
+_prober_lock = threading.Lock()
+
+
+class ProbeResult(object):
+
+    def __init__(self, error_message, latency, checked_at):
+        self.error_message = error_message
+        self.latency = latency
+        self.checked_at = checked_at
+
+    def to_dict(self, now):
+        result = {
+            'status': 'error' if self.error_message else 'ok',
+            'age_seconds': round(now - self.checked_at, 3),
+            'probe_latency_ms': round(self.latency * 1000, 3),
+        }
+        if self.error_message:
+            result['errors'] = [self.error_message]
+        return result
+
+
+class HealthProber(object):
+    # Checks the DB on an interval and keeps the outcome, so that health checks can be answered
+    # without a DB round trip each
+
+    def __init__(self, interval):
+        self._interval = interval
+        self._result = None
+        self._lock = threading.Lock()
+        self._probe_thread = periodic.PeriodicThread('health-probe', interval)
+
+    def get_result(self):
+        with self._lock:
+            result = self._result
+
+        if result is not None and time.time() - result.checked_at > (
+                self._interval * MAX_RESULT_AGE_INTERVALS):
+            return ProbeResult(STALE_RESULT_ERROR_MESSAGE, result.latency, result.checked_at)
+
+        return result
+
+    def record_result(self, result):
+        with self._lock:
+            self._result = result
+
+    def start_probing_periodically(self, probe):
+        self._probe_thread.ensure_running(lambda: self.record_result(probe()))
+
+    def stop(self):
+        self._probe_thread.stop()
+
+
+def is_enabled():
+    return CONFIG_DICT['HEALTH_PROBE_INTERVAL'] > 0
+
+
+def get_prober():
+    global _prober
+
+    with _prober_lock:
+        if _prober is None:
+            _prober = HealthProber(CONFIG_DICT['HEALTH_PROBE_INTERVAL'])
+        return _prober
+
+
+def check_db():
+    # Returns the latest probe result, or probes the DB straight away when probing in the
+    # background is disabled or hasn't produced a result yet
+    if is_enabled():
+        prober = get_prober()
+        prober.start_probing_periodically(_probe_db_in_app_context)
+        result = prober.get_result()
+        if result is not None:
+            return result
+
+    return probe_db()
+
+
+def probe_db():
+    start = time.monotonic()
+    try:
+        # Hitting the database just to see if it responds properly
+        db_access.get_user('non-existing-user', 'password-hash')
+        error_message = None
+    except Exception as e:
+        LOGGER.warning('DB health probe failed: {}'.format(e))
+        error_message = DB_ERROR_MESSAGE_FORMAT.format(str(e))
+
+    return ProbeResult(error_message, time.monotonic() - start, time.time())
+
+
+def _probe_db_in_app_context():
+    with app.app_context():
+        return probe_db()
+
+
+def shutdown():
+    global _prober
+
+    with _prober_lock:
+        if _prober is not None:
+            _prober.stop()
+            _prober = None
@@ -0,0 +1,109 @@
+import threading
+import time
+
+from config import CONFIG_DICT
+from service import account_unlocks
+from service.failed_logins_buffer import FailedLoginsBuffer
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class LockedAccountsCache(object):
+    # Remembers locked accounts for a while, so that attempts to log into them can be answered
+    # without hashing or writing to the DB. Their failed login counts are written in batches.
+    # Each gunicorn worker has its own cache, and drops an entry once the account was unlocked or
+    # deleted through any worker (see account_unlocks).
+
+    def __init__(self, ttl, max_size, flush_interval):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._failed_logins_buffer = FailedLoginsBuffer(flush_interval)
+
+    def add(self, user_id, failed_logins):
+        failed_logins = self._failed_logins_buffer.get_failed_logins(user_id, failed_logins)
+
+        with self._lock:
+            if len(self._entries) >= self._max_size:
+                self._remove_expired_entries()
+
+            if len(self._entries) < self._max_size:
+                self._entries[user_id] = (
+                    time.time() + self._ttl, failed_logins, account_unlocks.get_generation(user_id)
+                )
+
+    def record_attempt(self, user_id):
+        # Returns the failed login count including this attempt,
+        # or None when the account isn't known to be locked
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+
+            expires_at, failed_logins, generation = entry
+            if expires_at <= time.time() or generation != account_unlocks.get_generation(user_id):
+                del self._entries[user_id]
+                return None
+
+            self._entries[user_id] = (expires_at, failed_logins + 1, generation)
+
+        self._failed_logins_buffer.record_failed_login(user_id)
+        return failed_logins + 1
+
+    def get_failed_logins(self, user_id, stored_failed_logins):
+        return self._failed_logins_buffer.get_failed_logins(user_id, stored_failed_logins)
+
+    def close(self):
+        self._failed_logins_buffer.close()
+
+    def _remove_expired_entries(self):
+        now = time.time()
+        expired_user_ids = [
+            user_id for user_id, (expires_at, _, _) in self._entries.items() if expires_at <= now
+        ]
+        for user_id in expired_user_ids:
+            del self._entries[user_id]
+
+
+def is_enabled():
+    return CONFIG_DICT['LOCKED_ACCOUNTS_CACHE_TTL'] > 0
+
+
+def get_cache():
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = LockedAccountsCache(
+                CONFIG_DICT['LOCKED_ACCOUNTS_CACHE_TTL'],
+                CONFIG_DICT['LOCKED_ACCOUNTS_CACHE_SIZE'],
+                CONFIG_DICT['LOCKED_ACCOUNTS_FLUSH_INTERVAL'],
+            )
+        return _cache
+
+
+def add(user_id, failed_logins):
+    if is_enabled():
+        get_cache().add(user_id, failed_logins)
+
+
+def record_attempt(user_id):
+    return get_cache().record_attempt(user_id) if is_enabled() else None
+
+
+def get_failed_logins(user_id, stored_failed_logins):
+    if is_enabled():
+        return get_cache().get_failed_logins(user_id, stored_failed_logins)
+    else:
+        return stored_failed_logins
+
+
+def shutdown():
+    global _cache
+
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
@@ -1,9 +1,272 @@
 from logging.config import dictConfig  # type: ignore
+import atexit
+import contextlib
+import copy
+import fcntl
+import gzip
 import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+import weakref
 
 from config import CONFIG_DICT
+from service.auditing import AUDITING_LOGGER_NAME, NdjsonAuditFormatter
+
+BLOCK = 'block'
+NDJSON = 'ndjson'
+# Rotated logs are gzipped in members holding this many bytes of log each. A member can be
+# decompressed on its own, so that scripts/index-audit-logs.py can read an entry without
+# decompressing the file from its start.
+COMPRESSION_MEMBER_SIZE = 1024 * 1024
 
 done_setup = False
+_queued_loggers = []
+_rotating_handlers = weakref.WeakSet()
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    # Hands records over to a QueueListener, which writes them on its own thread. When the queue
+    # is full, records either wait for space or get dropped. Dropped records are counted and
+    # reported by a warning once there's room again.
+
+    def __init__(self, queue_size, block):
+        super().__init__(queue.Queue(queue_size))
+        self._block = block
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Unlike QueueHandler.prepare, keeps exc_info for the formatters of the real handlers, as
+        # the records never leave the process. Only the arguments get merged into the message, in
+        # case they change before the record is written.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self._block:
+            self.queue.put(record)
+            return
+
+        with self._dropped_lock:
+            try:
+                if self._dropped:
+                    self.queue.put_nowait(self._make_dropped_warning(record))
+                    self._dropped = 0
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self._dropped += 1
+
+    def reset_queue(self):
+        # The locks may have been held by other threads of the parent process
+        self.queue = queue.Queue(self.queue.maxsize)
+        self._dropped_lock = threading.Lock()
+
+    def _make_dropped_warning(self, record):
+        return logging.LogRecord(
+            record.name, logging.WARNING, __file__, 0,
+            'Dropped {} log records because the log queue was full'.format(self._dropped),
+            None, None
+        )
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    # Rotates the file once it reaches maxBytes or, when maxAge (in seconds) is set, once a
+    # maxAge period since the epoch ends (e.g. every midnight UTC for 86400). Rotated files are
+    # gzipped as path.1.gz, path.2.gz, ... up to path.<backupCount>.gz. The logging call only
+    # renames the file to path.1, which gets compressed on another thread.
+    #
+    # gunicorn workers share the handler set up before they were forked, so they take turns
+    # through an flock on path.lock: records are written holding a shared lock, and the file is
+    # rotated holding an exclusive one. A worker finding that another one rotated the file while
+    # it waited reopens it rather than rotating it again.
+
+    def __init__(self, filename, mode='a', maxBytes=0, backupCount=0, encoding=None,
+                 delay=False, maxAge=0):
+        super().__init__(filename, mode, maxBytes, backupCount, encoding, delay)
+        self._max_age = maxAge
+        self._lock_path = self.baseFilename + '.lock'
+        self._lock_file = None
+        self._lock_file_pid = None
+        self._compression_threads = []
+        self._rollover_at = self._get_rollover_at(
+            os.path.getmtime(filename) if os.path.exists(filename) else time.time()
+        )
+        _rotating_handlers.add(self)
+        # Left by a process that stopped while compressing it
+        if os.path.exists(self._get_rotated_path(1)):
+            self._start_compression(self._get_rotated_path(1))
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                # The previous rotated file is best compressed before it moves along. The
+                # compression needs the exclusive lock to finish, so this can't wait holding it.
+                self.wait_for_compression()
+                with self._interprocess_lock(fcntl.LOCK_EX):
+                    self._reopen_if_rotated_by_other_process()
+                    if self.shouldRollover(record):
+                        self.doRollover()
+            with self._interprocess_lock(fcntl.LOCK_SH):
+                self._reopen_if_rotated_by_other_process()
+                logging.FileHandler.emit(self, record)
+        except Exception:
+            self.handleError(record)
+
+    def shouldRollover(self, record):
+        if self.backupCount > 0 and self._max_age and time.time() >= self._rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        # Called holding the exclusive lock. Rotated files still uncompressed, because a process
+        # is compressing them or stopped before it was done, move along with the others and get
+        # compressed again by this one.
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+        if self.backupCount > 0:
+            uncompressed_paths = []
+            for number in range(self.backupCount - 1, 0, -1):
+                path = self._get_rotated_path(number)
+                if os.path.exists(path + '.gz'):
+                    os.replace(path + '.gz', self._get_rotated_path(number + 1) + '.gz')
+                if os.path.exists(path):
+                    os.replace(path, self._get_rotated_path(number + 1))
+                    uncompressed_paths.append(self._get_rotated_path(number + 1))
+            if os.path.exists(self.baseFilename):
+                os.replace(self.baseFilename, self._get_rotated_path(1))
+                uncompressed_paths.append(self._get_rotated_path(1))
+            for path in uncompressed_paths:
+                self._start_compression(path)
+
+        if not self.delay:
+            self.stream = self._open()
+        self._rollover_at = self._get_rollover_at(time.time())
+
+    def wait_for_compression(self):
+        compression_threads, self._compression_threads = self._compression_threads, []
+        for compression_thread in compression_threads:
+            compression_thread.join()
+
+    def close(self):
+        super().close()
+        self.wait_for_compression()
+        if self._lock_file is not None and self._lock_file_pid == os.getpid():
+            self._lock_file.close()
+        self._lock_file = None
+
+    @contextlib.contextmanager
+    def _interprocess_lock(self, operation):
+        # flock locks belong to the open file, which a forked worker shares with its parent, so
+        # each process opens its own
+        if self._lock_file_pid != os.getpid():
+            self._lock_file = open(self._lock_path, 'a')
+            self._lock_file_pid = os.getpid()
+        fcntl.flock(self._lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _reopen_if_rotated_by_other_process(self):
+        if self.stream is not None and self._was_rotated_by_other_process():
+            self.stream.close()
+            self.stream = self._open()
+            self._rollover_at = self._get_rollover_at(time.time())
+
+    def _start_compression(self, path):
+        compression_thread = threading.Thread(
+            target=_compress, args=(path, path + '.gz', self._lock_path),
+            name='log-compression', daemon=True
+        )
+        compression_thread.start()
+        self._compression_threads.append(compression_thread)
+
+    def _get_rotated_path(self, number):
+        return '{}.{}'.format(self.baseFilename, number)
+
+    def _was_rotated_by_other_process(self):
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _get_rollover_at(self, started_at):
+        if not self._max_age:
+            return None
+        return (started_at // self._max_age + 1) * self._max_age
+
+
+def _compress(source, dest, lock_path):
+    # The rotated file stays readable under its uncompressed name until the compressed one is
+    # complete. It's only replaced holding the exclusive lock, after checking that no other
+    # process moved it along or compressed it in the meantime. Errors only leave the file
+    # uncompressed.
+    temp_path = '{}.{}.tmp'.format(dest, os.getpid())
+    try:
+        with open(source, 'rb') as source_file:
+            with open(temp_path, 'wb') as temp_file:
+                # An empty log still gets a member, as a file without any isn't valid gzip
+                data = source_file.read(COMPRESSION_MEMBER_SIZE)
+                while True:
+                    temp_file.write(gzip.compress(data))
+                    data = source_file.read(COMPRESSION_MEMBER_SIZE)
+                    if not data:
+                        break
+
+            with open(lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if os.stat(source).st_ino != os.fstat(source_file.fileno()).st_ino:
+                    raise FileNotFoundError(source)
+                # Keeps the modification time, so that the rotated files still sort oldest first
+                shutil.copystat(source, temp_path)
+                os.replace(temp_path, dest)
+                os.remove(source)
+    except OSError as e:
+        if not isinstance(e, FileNotFoundError):
+            sys.stderr.write('Failed to compress rotated log {}: {}\n'.format(source, e))
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class _QueueListener(logging.handlers.QueueListener):
+
+    def enqueue_sentinel(self):
+        # Waits for space, as the queue can be full when logging stops
+        self.queue.put(self._sentinel)
+
+
+class _QueuedLogger(object):
+    # A logger whose handlers were replaced with a queue handler, and the listener writing the
+    # queued records with the original handlers
+
+    def __init__(self, logger, queue_size, block):
+        self.logger = logger
+        self.handlers = list(logger.handlers)
+        self.queue_handler = BoundedQueueHandler(queue_size, block)
+        self.listener = None
+        logger.handlers = [self.queue_handler]
+        self.start_listener()
+
+    def start_listener(self):
+        self.listener = _QueueListener(
+            self.queue_handler.queue, *self.handlers, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def stop(self):
+        # Writes the records still queued and goes back to writing on the calling thread
+        self.logger.handlers = self.handlers
+        self.listener.stop()
 
 
 def setup_logging():
@@ -15,6 +278,60 @@ def setup_logging():
             with open(logging_config_file_path, 'rt') as file:
                 config = json.load(file)
             dictConfig(config)
+            if CONFIG_DICT['AUDIT_LOG_FORMAT'] == NDJSON:
+                _use_ndjson_audit_format()
+            if CONFIG_DICT['LOG_QUEUE_SIZE'] > 0:
+                _queue_handlers(config)
             done_setup = True
         except IOError as e:
             raise(Exception('Failed to load logging configuration', e))
+
+
+def stop_logging():
+    # Flushes the queued records, e.g. when gunicorn stops. Logging carries on synchronously.
+    global _queued_loggers
+
+    queued_loggers, _queued_loggers = _queued_loggers, []
+    for queued_logger in queued_loggers:
+        queued_logger.stop()
+
+
+def wait_for_compression():
+    # Rotated logs still being compressed when a gunicorn worker exits would be left uncompressed
+    for handler in list(_rotating_handlers):
+        handler.wait_for_compression()
+
+
+def _use_ndjson_audit_format():
+    # Done before the handlers are moved behind a queue, as they're only known to the logger until
+    # then
+    for handler in logging.getLogger(AUDITING_LOGGER_NAME).handlers:
+        handler.setFormatter(NdjsonAuditFormatter())
+
+
+def _queue_handlers(config):
+    # Moves the handlers of every configured logger behind a queue, so that request threads only
+    # have to enqueue their records
+    logger_names = [None] + list(config.get('loggers', {}))
+    for logger_name in logger_names:
+        logger = logging.getLogger(logger_name)
+        if logger.handlers:
+            # Audit entries wait for space in a full queue rather than get dropped
+            block = (
+                logger_name == AUDITING_LOGGER_NAME or CONFIG_DICT['LOG_QUEUE_OVERFLOW'] == BLOCK
+            )
+            _queued_loggers.append(
+                _QueuedLogger(logger, CONFIG_DICT['LOG_QUEUE_SIZE'], block)
+            )
+
+
+def _restart_listeners_in_child():
+    # gunicorn forks the workers after the master set up logging, and the listener threads
+    # don't survive the fork
+    for queued_logger in _queued_loggers:
+        queued_logger.queue_handler.reset_queue()
+        queued_logger.start_listener()
+
+
+os.register_at_fork(after_in_child=_restart_listeners_in_child)
+atexit.register(stop_logging)
@@ -0,0 +1,275 @@
+import bisect
+import functools
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from config import CONFIG_DICT
+from service import request_timing
+
+FILE_PREFIX = 'metrics_'
+INITIAL_FILE_SIZE = 64 * 1024
+# Number of bytes of the file in use, followed by the entries
+HEADER = struct.Struct('<Q')
+KEY_LENGTH = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registered_metrics = []
+_values = None
+_values_lock = threading.Lock()
+
+
+class ValuesFile(object):
+    # Sample values of one process, kept in a memory-mapped file in the metrics directory, so
+    # that whichever gunicorn worker serves /metrics can add up the values of all of them. Only
+    # the process the file belongs to writes to it. Entries are only ever appended: the length of
+    # the key (a JSON [sample name, labels] list), the key padded to 8 bytes and the value.
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._offsets = {}
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(INITIAL_FILE_SIZE)
+            self._map = mmap.mmap(self._file.fileno(), INITIAL_FILE_SIZE)
+            HEADER.pack_into(self._map, 0, HEADER.size)
+        else:
+            # Left by an earlier process with the same PID, whose values still count
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            for key, _, offset in _read_entries(self._map):
+                self._offsets[key] = offset
+
+    def increment(self, key, amount):
+        with self._lock:
+            offset = self._offsets.get(key)
+            if offset is None:
+                offset = self._add_entry(key)
+            value, = VALUE.unpack_from(self._map, offset)
+            VALUE.pack_into(self._map, offset, value + amount)
+
+    def close(self):
+        with self._lock:
+            self._map.close()
+            self._file.close()
+
+    def _add_entry(self, key):
+        encoded_key = key.encode()
+        used, = HEADER.unpack_from(self._map, 0)
+        value_offset = _align(used + KEY_LENGTH.size + len(encoded_key))
+        if value_offset + VALUE.size > len(self._map):
+            self._grow(value_offset + VALUE.size)
+
+        KEY_LENGTH.pack_into(self._map, used, len(encoded_key))
+        self._map[used + KEY_LENGTH.size:used + KEY_LENGTH.size + len(encoded_key)] = encoded_key
+        VALUE.pack_into(self._map, value_offset, 0.0)
+        # Readers only look at entries within the used bytes, so the entry has to be complete
+        # before they're extended
+        HEADER.pack_into(self._map, 0, value_offset + VALUE.size)
+        self._offsets[key] = value_offset
+        return value_offset
+
+    def _grow(self, min_size):
+        size = len(self._map) * 2
+        while size < min_size:
+            size *= 2
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+
+class Counter(object):
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self._documentation = documentation
+        self._label_names = label_names
+        _registered_metrics.append(self)
+
+    def inc(self, *label_values):
+        _increment(self.name, list(zip(self._label_names, label_values)), 1)
+
+    def render(self, samples):
+        lines = [
+            '# HELP {} {}'.format(self.name, self._documentation),
+            '# TYPE {} counter'.format(self.name),
+        ]
+        for (name, labels), value in sorted(samples.items()):
+            if name == self.name:
+                lines.append(_format_sample(name, labels, value))
+        return lines
+
+
+class Histogram(object):
+
+    def __init__(self, name, documentation, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self._documentation = documentation
+        self._label_names = label_names
+        self._bucket_labels = [repr(float(bound)) for bound in buckets] + ['+Inf']
+        self._buckets = buckets
+        _registered_metrics.append(self)
+
+    def observe(self, value, *label_values):
+        # Buckets are stored as the count of values within each one, and only added up into
+        # Prometheus' cumulative counts when rendered
+        labels = list(zip(self._label_names, label_values))
+        le = self._bucket_labels[bisect.bisect_left(self._buckets, value)]
+        _increment(self.name + '_bucket', labels + [('le', le)], 1)
+        _increment(self.name + '_sum', labels, value)
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def render(self, samples):
+        lines = [
+            '# HELP {} {}'.format(self.name, self._documentation),
+            '# TYPE {} histogram'.format(self.name),
+        ]
+        bucket_counts = {}
+        for (name, labels), value in samples.items():
+            if name == self.name + '_bucket':
+                le = labels[-1][1]
+                bucket_counts.setdefault(labels[:-1], {})[le] = value
+
+        for labels, counts in sorted(bucket_counts.items()):
+            count = 0
+            for le in self._bucket_labels:
+                count += counts.get(le, 0)
+                lines.append(_format_sample(self.name + '_bucket', labels + (('le', le),), count))
+            lines.append(_format_sample(
+                self.name + '_sum', labels, samples.get((self.name + '_sum', labels), 0.0)
+            ))
+            lines.append(_format_sample(self.name + '_count', labels, count))
+        return lines
+
+
+class _Timer(object):
+
+    def __init__(self, histogram, label_values):
+        self._histogram = histogram
+        self._label_values = label_values
+
+    def __enter__(self):
+        self._started_at = time.monotonic()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(time.monotonic() - self._started_at, *self._label_values)
+
+
+REQUEST_DURATION = Histogram(
+    'login_api_request_duration_seconds', 'Time taken to handle requests',
+    ['method', 'route', 'status']
+)
+HASHING_DURATION = Histogram(
+    'login_api_password_hashing_duration_seconds',
+    'Time spent hashing passwords, including waiting for a hashing process', ['function']
+)
+DB_DURATION = Histogram(
+    'login_api_db_duration_seconds', 'Time spent in db_access functions', ['function']
+)
+AUTH_OUTCOMES = Counter(
+    'login_api_authentication_outcomes_total', 'Outcomes of authentication requests',
+    ['outcome']
+)
+
+
+def timed(histogram, phase=None):
+    # Decorates a function to record its duration in the histogram, labelled with its name, and
+    # to count it towards the given phase of the current request (see request_timing)
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram.time(fn.__name__):
+                if phase is None:
+                    return fn(*args, **kwargs)
+                with request_timing.measure(phase):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def is_enabled():
+    return bool(CONFIG_DICT['METRICS_DIR'])
+
+
+def get_values():
+    global _values
+
+    with _values_lock:
+        # Each process gets a file of its own, including workers forked after it was opened
+        path = os.path.join(CONFIG_DICT['METRICS_DIR'], '{}{}'.format(FILE_PREFIX, os.getpid()))
+        if _values is None or _values[0] != path:
+            _values = (path, ValuesFile(path))
+        return _values[1]
+
+
+def render():
+    # Returns all metrics in Prometheus' text format, with the values of all processes added up
+    samples = {}
+    metrics_dir = CONFIG_DICT['METRICS_DIR']
+    for file_name in sorted(os.listdir(metrics_dir)):
+        if file_name.startswith(FILE_PREFIX):
+            with open(os.path.join(metrics_dir, file_name), 'rb') as values_file:
+                data = values_file.read()
+            for key, value, _ in _read_entries(data):
+                name, labels = json.loads(key)
+                sample = (name, tuple(tuple(label) for label in labels))
+                samples[sample] = samples.get(sample, 0) + value
+
+    lines = []
+    for metric in _registered_metrics:
+        lines.extend(metric.render(samples))
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    # Removes the values of earlier runs, so that the counts start from zero
+    if is_enabled():
+        for file_name in os.listdir(CONFIG_DICT['METRICS_DIR']):
+            if file_name.startswith(FILE_PREFIX):
+                os.remove(os.path.join(CONFIG_DICT['METRICS_DIR'], file_name))
+
+
+def _increment(name, labels, amount):
+    if is_enabled():
+        get_values().increment(json.dumps([name, labels]), amount)
+
+
+def _read_entries(data):
+    # Yields the (key, value, value offset) of each entry in the contents of a values file
+    if len(data) < HEADER.size:
+        return
+
+    used, = HEADER.unpack_from(data, 0)
+    offset = HEADER.size
+    while offset < used:
+        key_length, = KEY_LENGTH.unpack_from(data, offset)
+        key_offset = offset + KEY_LENGTH.size
+        value_offset = _align(key_offset + key_length)
+        value, = VALUE.unpack_from(data, value_offset)
+        yield bytes(data[key_offset:key_offset + key_length]).decode(), value, value_offset
+        offset = value_offset + VALUE.size
+
+
+def _align(offset):
+    return int(math.ceil(offset / 8)) * 8
+
+
+def _format_sample(name, labels, value):
+    if labels:
+        formatted_labels = ','.join(
+            '{}="{}"'.format(
+                label_name,
+                str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            )
+            for label_name, label_value in labels
+        )
+        return '{}{{{}}} {}'.format(name, formatted_labels, repr(float(value)))
+    else:
+        return '{} {}'.format(name, repr(float(value)))
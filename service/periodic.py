@@ -0,0 +1,40 @@
+import threading
+
+
+class PeriodicThread(object):
+    # Calls a function on a daemon thread every interval seconds until stopped, straight away at
+    # first or, with wait_first, after the first interval. Used by the features that keep
+    # something up to date in the background of each worker (see health, failed_logins_buffer
+    # and user_id_filter).
+
+    def __init__(self, name, interval, wait_first=False):
+        self._name = name
+        self._interval = interval
+        self._wait_first = wait_first
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_running(self, fn):
+        # Called on each use rather than once at startup: threads don't survive a fork, so a
+        # thread started in the gunicorn master (or a worker's parent) isn't running in the
+        # workers, and each worker starts its own the first time it needs one
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, args=(fn,), name=self._name, daemon=True
+                    )
+                    self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self, fn):
+        if self._wait_first and self._stopped.wait(self._interval):
+            return
+
+        while True:
+            fn()
+            if self._stopped.wait(self._interval):
+                return
@@ -0,0 +1,134 @@
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from config import CONFIG_DICT
+
+LOGGER = logging.getLogger(__name__)
+
+# gunicorn workers leave SIGUSR2 at its default action, which would kill them
+PROFILE_SIGNAL = signal.SIGUSR2
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+class ProfilerRunningError(Exception):
+    pass
+
+
+class SamplingProfiler(object):
+    # Records the stacks of all the other threads of the process every sample interval, for a
+    # given number of seconds, and writes how often each stack was seen in the collapsed format
+    # taken by flamegraph tools: one 'thread;outermost frame;...;innermost frame count' line
+    # per stack. Sampling only takes the GIL briefly, so it's safe to run under real traffic.
+
+    def __init__(self, output_dir, sample_interval):
+        self._output_dir = output_dir
+        self._sample_interval = sample_interval
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, seconds):
+        # Returns the path the profile will be written to once done
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                raise ProfilerRunningError('A profile is already being recorded')
+
+            output_path = os.path.join(self._output_dir, 'profile-{}-{}.folded'.format(
+                os.getpid(), time.strftime('%Y%m%d-%H%M%S')
+            ))
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(
+                target=self._record, args=(seconds, output_path, self._stop_event),
+                name='sampling-profiler', daemon=True
+            )
+            self._thread.start()
+            return output_path
+
+    def stop(self):
+        # Stops recording early, still writing what was sampled so far
+        with self._lock:
+            thread = self._thread
+            self._stop_event.set()
+        if thread is not None:
+            thread.join()
+
+    def _record(self, seconds, output_path, stop_event):
+        stack_counts = collections.Counter()
+        own_thread_id = threading.get_ident()
+        stop_at = time.monotonic() + seconds
+        while not stop_event.is_set() and time.monotonic() < stop_at:
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread_id:
+                    thread_name = thread_names.get(thread_id, thread_id)
+                    stack_counts[_collapse_stack(thread_name, frame)] += 1
+            stop_event.wait(self._sample_interval)
+
+        temp_path = output_path + '.tmp'
+        with open(temp_path, 'w') as output_file:
+            for stack, count in stack_counts.most_common():
+                output_file.write('{} {}\n'.format(stack, count))
+        os.replace(temp_path, output_path)
+        LOGGER.info('Wrote profile of {} stack samples to {}'.format(
+            sum(stack_counts.values()), output_path
+        ))
+
+
+def get_profiler():
+    global _profiler
+
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = SamplingProfiler(
+                CONFIG_DICT['PROFILER_OUTPUT_DIR'],
+                CONFIG_DICT['PROFILER_SAMPLE_INTERVAL']
+            )
+        return _profiler
+
+
+def install_signal_handler():
+    # Makes the process record a profile of PROFILER_SIGNAL_SECONDS when sent PROFILE_SIGNAL.
+    # Only works on the main thread, so it's called from gunicorn's post_worker_init hook.
+    signal.signal(PROFILE_SIGNAL, _handle_profile_signal)
+
+
+def shutdown():
+    global _profiler
+
+    with _profiler_lock:
+        if _profiler is not None:
+            _profiler.stop()
+            _profiler = None
+
+
+def _handle_profile_signal(signum, frame):
+    # The signal can arrive while this thread holds the profiler's lock, so the profiler gets
+    # started from another thread
+    threading.Thread(target=_start_from_signal, name='profile-signal', daemon=True).start()
+
+
+def _start_from_signal():
+    try:
+        output_path = get_profiler().start(CONFIG_DICT['PROFILER_SIGNAL_SECONDS'])
+        LOGGER.info('Recording a profile to {}'.format(output_path))
+    except ProfilerRunningError:
+        LOGGER.warning('Ignored profile signal, as a profile is already being recorded')
+
+
+def _collapse_stack(thread_name, frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append('{} ({}:{})'.format(
+            code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+        ))
+        frame = frame.f_back
+    frames.append(str(thread_name))
+    return ';'.join(reversed(frames))
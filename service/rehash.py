@@ -0,0 +1,103 @@
+import collections
+import concurrent.futures
+import itertools
+import json
+import math
+import os
+import time
+
+from service import db_access, hashing, security
+
+BATCH_SIZE = 1000
+
+Progress = collections.namedtuple(
+    'Progress', ['examined', 'rewrapped', 'too_long', 'last_user_id', 'users_per_second']
+)
+
+
+def rehash_users(checkpoint_path=None, batch_size=BATCH_SIZE, processes=None, max_rate=0):
+    # Wraps every password hash whose outermost layer wasn't made with the current settings (see
+    # security.wrap_password_hash), going through the users in ID order one batch at a time.
+    # Each batch is written back in one transaction and recorded in the checkpoint file, if
+    # there is one, so that a later run resumes after it. Yields the progress after each batch.
+    # max_rate caps the number of users examined per second, to limit the load on the DB. Hashes
+    # that would no longer fit in the column once wrapped are left as they are, and counted as
+    # too long; they're replaced with a plain hash when their user next logs in.
+    algorithm, params = hashing.get_hash_settings()
+    processes = processes or os.cpu_count() or 1
+    checkpoint = _read_checkpoint(checkpoint_path)
+    examined_in_run = 0
+    started_at = time.monotonic()
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        while True:
+            rows = db_access.get_password_hashes(checkpoint['last_user_id'], batch_size)
+            if not rows:
+                break
+
+            outdated = [
+                (user_id, password_hash) for user_id, password_hash in rows
+                if password_hash and security.needs_wrapping(password_hash, algorithm, params)
+            ]
+            new_password_hashes = _wrap_password_hashes(
+                executor, processes, [password_hash for _, password_hash in outdated],
+                algorithm, params
+            )
+            changes = [
+                (user_id, password_hash, new_password_hash)
+                for (user_id, password_hash), new_password_hash
+                in zip(outdated, new_password_hashes)
+                if len(new_password_hash) <= db_access.MAX_PASSWORD_HASH_LENGTH
+            ]
+            rewrapped = db_access.update_password_hashes(changes)
+
+            checkpoint = {
+                'examined': checkpoint['examined'] + len(rows),
+                'rewrapped': checkpoint['rewrapped'] + len(rewrapped),
+                'too_long': checkpoint['too_long'] + len(outdated) - len(changes),
+                'last_user_id': rows[-1][0],
+            }
+            _write_checkpoint(checkpoint_path, checkpoint)
+
+            examined_in_run += len(rows)
+            elapsed = time.monotonic() - started_at
+            yield Progress(
+                checkpoint['examined'], checkpoint['rewrapped'], checkpoint['too_long'],
+                checkpoint['last_user_id'], examined_in_run / elapsed if elapsed > 0 else 0.0
+            )
+
+            if max_rate > 0:
+                time.sleep(max(0, examined_in_run / max_rate - elapsed))
+
+
+def _wrap_password_hashes(executor, processes, password_hashes, algorithm, params):
+    # Splits the hashes evenly between the processes and returns the results in the same order
+    if not password_hashes:
+        return []
+
+    chunk_size = int(math.ceil(len(password_hashes) / processes))
+    chunks = [
+        password_hashes[start:start + chunk_size]
+        for start in range(0, len(password_hashes), chunk_size)
+    ]
+    return list(itertools.chain.from_iterable(executor.map(
+        security.wrap_password_hashes, chunks,
+        itertools.repeat(algorithm), itertools.repeat(params)
+    )))
+
+
+def _read_checkpoint(checkpoint_path):
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as checkpoint_file:
+            return json.load(checkpoint_file)
+
+    return {'examined': 0, 'rewrapped': 0, 'too_long': 0, 'last_user_id': ''}
+
+
+def _write_checkpoint(checkpoint_path, checkpoint):
+    # Replaces the file in one go, so that an interrupted run can't leave half a checkpoint
+    if checkpoint_path:
+        temp_path = checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temp_path, checkpoint_path)
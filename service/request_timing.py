@@ -0,0 +1,56 @@
+import contextlib
+import threading
+import time
+
+from config import CONFIG_DICT
+
+PHASES = ['parse', 'hash', 'db', 'serialise']
+
+_local = threading.local()
+
+
+def is_enabled():
+    return CONFIG_DICT['SERVER_TIMING']
+
+
+def start():
+    # Starts collecting the time the current thread spends in each phase of a request
+    _local.phases = dict.fromkeys(PHASES, 0.0)
+    _local.depths = dict.fromkeys(PHASES, 0)
+    _local.started_at = time.monotonic()
+
+
+@contextlib.contextmanager
+def measure(phase):
+    # Adds the time spent in the block to the phase, unless it's nested in a block measuring the
+    # same phase (e.g. a db_access function calling another one). Does nothing outside requests.
+    phases = getattr(_local, 'phases', None)
+    if phases is None or _local.depths[phase] > 0:
+        yield
+        return
+
+    _local.depths[phase] += 1
+    started_at = time.monotonic()
+    try:
+        yield
+    finally:
+        phases[phase] += time.monotonic() - started_at
+        _local.depths[phase] -= 1
+
+
+def finish():
+    # Returns the Server-Timing header value for the request started on the current thread, with
+    # the time outside the measured phases (Flask and validation) as 'app', or None when no
+    # request was started
+    phases = getattr(_local, 'phases', None)
+    if phases is None:
+        return None
+
+    total = time.monotonic() - _local.started_at
+    _local.phases = None
+    durations = [(phase, phases[phase]) for phase in PHASES]
+    durations.append(('app', max(0.0, total - sum(phases.values()))))
+    durations.append(('total', total))
+    return ', '.join(
+        '{};dur={:.2f}'.format(phase, duration * 1000) for phase, duration in durations
+    )
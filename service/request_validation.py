@@ -0,0 +1,49 @@
+def is_auth_request_data_valid(request_data):
+    credentials = request_data.get('credentials')
+    if credentials:
+        user_id = credentials.get('user_id', None)
+        user_password = credentials.get('password', None)
+        return user_id and user_password
+    return False
+
+
+def is_create_request_data_valid(request_data):
+    # Also checks the types, as each line of a bulk create request is checked on its own and a
+    # bad one mustn't fail the others
+    user = request_data.get('user')
+    return (
+        isinstance(user, dict) and
+        isinstance(user.get('user_id'), str) and bool(user['user_id']) and
+        isinstance(user.get('password'), str) and bool(user['password'])
+    )
+
+
+def is_update_request_data_valid(request_data):
+    user = request_data.get('user')
+    return user and user.get('password')
+
+
+def is_bulk_request_data_valid(request_data):
+    # Either a list of user IDs or a filter matching users by failed login count or ID prefix
+    user_ids = request_data.get('user_ids')
+    user_filter = request_data.get('filter')
+    if user_ids is not None:
+        return (
+            user_filter is None and isinstance(user_ids, list) and len(user_ids) > 0 and
+            all(isinstance(user_id, str) and user_id for user_id in user_ids)
+        )
+    elif isinstance(user_filter, dict) and user_filter:
+        min_failed_logins = user_filter.get('min_failed_logins')
+        user_id_prefix = user_filter.get('user_id_prefix')
+        return (
+            set(user_filter) <= {'min_failed_logins', 'user_id_prefix'} and
+            # A count below 1 would match every user
+            (min_failed_logins is None or (
+                isinstance(min_failed_logins, int) and not isinstance(min_failed_logins, bool) and
+                min_failed_logins >= 1
+            )) and
+            (user_id_prefix is None or (isinstance(user_id_prefix, str) and user_id_prefix)) and
+            # A filter without any criteria would match every user too
+            (min_failed_logins is not None or user_id_prefix is not None)
+        )
+    return False
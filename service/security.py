@@ -1,9 +1,20 @@
+import base64
 import hashlib
 import binascii
+import hmac
+import os
 
+# Settings of legacy hashes - bare hex digests made with the salt shared by all users
 HASH_ALGORITHM = 'sha256'
 HASH_ITERATION_COUNT = 100000
 
+PBKDF2_SHA256 = 'pbkdf2-sha256'
+SCRYPT = 'scrypt'
+# Marks wrapped hashes whose innermost layer is a legacy hash
+LEGACY = 'legacy'
+SALT_LENGTH = 16
+KEY_LENGTH = 32
+
 
 def get_user_password_hash(user_id, password, salt):
     hash = hashlib.pbkdf2_hmac(
@@ -14,3 +25,129 @@ def get_user_password_hash(user_id, password, salt):
     )
 
     return binascii.hexlify(hash).decode()
+
+
+def hash_password(user_id, password, algorithm, params):
+    # Returns a self-describing hash: $<algorithm>$<params>$<salt>$<key>, e.g.
+    # $pbkdf2-sha256$i=100000$<salt>$<key> or $scrypt$n=16384,p=1,r=8$<salt>$<key>
+    return _add_layer('', user_id + password, algorithm, params)
+
+
+def hash_passwords(credentials, algorithm, params):
+    return [
+        hash_password(user_id, password, algorithm, params) for user_id, password in credentials
+    ]
+
+
+def wrap_password_hash(password_hash, algorithm, params):
+    # Hashes an existing hash again, so that it can be upgraded without knowing the password.
+    # The result lists the settings and salt of each layer from the innermost out, followed by
+    # the key of the outermost one, e.g. $legacy$pbkdf2-sha256$i=100000$<salt>$<key>
+    if _is_legacy_hash(password_hash):
+        prefix, secret = '$' + LEGACY, password_hash
+    else:
+        prefix, _, secret = password_hash.rpartition('$')
+    return _add_layer(prefix, secret, algorithm, params)
+
+
+def wrap_password_hashes(password_hashes, algorithm, params):
+    return [
+        wrap_password_hash(password_hash, algorithm, params) for password_hash in password_hashes
+    ]
+
+
+def verify_password(user_id, password, password_hash, legacy_salt):
+    if not password_hash:
+        return False
+
+    if _is_legacy_hash(password_hash):
+        expected_hash = get_user_password_hash(user_id, password, legacy_salt)
+        return hmac.compare_digest(expected_hash, password_hash)
+
+    wraps_legacy_hash, layers, key = _parse_hash(password_hash)
+    if wraps_legacy_hash:
+        secret = get_user_password_hash(user_id, password, legacy_salt)
+    else:
+        secret = user_id + password
+    for algorithm, params, salt in layers[:-1]:
+        secret = _encode_bytes(_derive_key(algorithm, params, secret, salt))
+
+    algorithm, params, salt = layers[-1]
+    return hmac.compare_digest(_derive_key(algorithm, params, secret, salt), key)
+
+
+def needs_rehash(password_hash, algorithm, params):
+    # Wrapped hashes are replaced too, as verifying them costs a derivation per layer
+    if _is_legacy_hash(password_hash):
+        return True
+
+    wraps_legacy_hash, layers, _ = _parse_hash(password_hash)
+    return wraps_legacy_hash or len(layers) > 1 or layers[0][:2] != (algorithm, params)
+
+
+def needs_wrapping(password_hash, algorithm, params):
+    # Whether the outermost layer of the hash was made with other settings
+    if _is_legacy_hash(password_hash):
+        return True
+
+    _, layers, _ = _parse_hash(password_hash)
+    return layers[-1][:2] != (algorithm, params)
+
+
+def _add_layer(prefix, secret, algorithm, params):
+    salt = os.urandom(SALT_LENGTH)
+    key = _derive_key(algorithm, params, secret, salt)
+    return '{}${}${}${}${}'.format(
+        prefix,
+        algorithm,
+        ','.join('{}={}'.format(name, value) for name, value in sorted(params.items())),
+        _encode_bytes(salt),
+        _encode_bytes(key)
+    )
+
+
+def _derive_key(algorithm, params, secret, salt):
+    if algorithm == PBKDF2_SHA256:
+        return hashlib.pbkdf2_hmac('sha256', secret.encode(), salt, params['i'], KEY_LENGTH)
+    elif algorithm == SCRYPT:
+        n, r, p = params['n'], params['r'], params['p']
+        return hashlib.scrypt(
+            secret.encode(), salt=salt, n=n, r=r, p=p,
+            # scrypt needs 128 * n * r bytes of memory, leave some room on top of that
+            maxmem=256 * n * r,
+            dklen=KEY_LENGTH
+        )
+    else:
+        raise ValueError('Unsupported password hash algorithm: {}'.format(algorithm))
+
+
+def _is_legacy_hash(password_hash):
+    return not password_hash.startswith('$')
+
+
+def _parse_hash(password_hash):
+    # Returns whether the innermost layer is a legacy hash, the (algorithm, params, salt) of each
+    # layer from the innermost out and the key of the outermost layer
+    fields = password_hash.split('$')[1:]
+    wraps_legacy_hash = fields[0] == LEGACY
+    if wraps_legacy_hash:
+        fields = fields[1:]
+
+    layers = []
+    for start in range(0, len(fields) - 1, 3):
+        algorithm, encoded_params, encoded_salt = fields[start:start + 3]
+        params = {}
+        for param in encoded_params.split(','):
+            name, value = param.split('=')
+            params[name] = int(value)
+        layers.append((algorithm, params, _decode_bytes(encoded_salt)))
+
+    return wraps_legacy_hash, layers, _decode_bytes(fields[-1])
+
+
+def _encode_bytes(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _decode_bytes(data):
+    return base64.b64decode(data + '=' * (-len(data) % 4))
@@ -1,9 +1,17 @@
-from flask import request, Response  # type: ignore
+from flask import g, request, Response, stream_with_context  # type: ignore
+import hmac
 import json
 import logging
 import logging.config  # type: ignore
+import time
+import uuid
 
-from service import app, auditing, db_access, security
+from service import (
+    account_unlocks, app, auditing, db, db_access, db_pool, failed_logins_buffer, hashing, health,
+    locked_accounts, metrics, profiler, request_timing, request_validation, user_export,
+    user_id_filter
+)
+from service.db_access import MAX_LOGIN_ATTEMPTS
 
 
 AUTH_FAILURE_RESPONSE_BODY = json.dumps({'error': 'Invalid credentials'})
@@ -11,7 +19,10 @@ INVALID_REQUEST_RESPONSE_BODY = json.dumps({'error': 'Invalid request'})
 INTERNAL_SERVER_ERROR_RESPONSE_BODY = json.dumps(
     {'error': 'Internal server error'}
 )
+SERVICE_BUSY_RESPONSE_BODY = json.dumps({'error': 'Service busy'})
 JSON_CONTENT_TYPE = 'application/json'
+REQUEST_ID_HEADER = 'X-Request-ID'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
 
 INVALID_REQUEST_RESPONSE = Response(
     INVALID_REQUEST_RESPONSE_BODY,
@@ -23,13 +34,44 @@ USER_NOT_FOUND_RESPONSE = Response(
     status=404,
     mimetype=JSON_CONTENT_TYPE
 )
+USER_ALREADY_EXISTS_RESPONSE = Response(
+    json.dumps({'error': 'User already exists'}),
+    status=409,
+    mimetype=JSON_CONTENT_TYPE
+)
+LENGTH_REQUIRED_RESPONSE = Response(
+    json.dumps({'error': 'Length required'}),
+    status=411,
+    mimetype=JSON_CONTENT_TYPE
+)
 
 
-MAX_LOGIN_ATTEMPTS = 10
+# Users hashed and inserted together by the bulk creation endpoint
+BULK_CREATE_BATCH_SIZE = 1000
+# Default and maximum number of users on a page of the locked accounts report
+LOCKED_USERS_PAGE_SIZE = 100
+MAX_LOCKED_USERS_PAGE_SIZE = 1000
+# Default and maximum length of a profile started through the API
+PROFILE_SECONDS = 30
+MAX_PROFILE_SECONDS = 300
+# Users unlocked or deleted by one statement (and audited in one entry) by the bulk endpoints
+BULK_ADMIN_BATCH_SIZE = 1000
 
 LOGGER = logging.getLogger(__name__)
 
 
+# Registered before the generic handler, as older Flask versions use the first matching one
+@app.errorhandler(hashing.HashingQueueFullError)
+def handleHashingQueueFull(error):
+    LOGGER.warning('Rejected a request because the password hashing queue is full')
+    return Response(
+        SERVICE_BUSY_RESPONSE_BODY,
+        status=503,
+        mimetype=JSON_CONTENT_TYPE,
+        headers={'Retry-After': '1'}
+    )
+
+
 @app.errorhandler(Exception)
 def handleServerError(error):
     LOGGER.error(
@@ -43,38 +85,103 @@ def handleServerError(error):
     )
 
 
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.monotonic()
+    auditing.set_request_id(_get_request_id())
+    if request_timing.is_enabled():
+        request_timing.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Labelled with the route rather than the path, so that user IDs don't each get their own
+    # series. Streamed responses are only timed until their body starts being sent.
+    started_at = getattr(g, 'request_started_at', None)
+    if started_at is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_DURATION.observe(
+            time.monotonic() - started_at, request.method, route, response.status_code
+        )
+
+    server_timing = request_timing.finish()
+    if server_timing is not None:
+        response.headers['Server-Timing'] = server_timing
+        LOGGER.info('Handled {} {} with status {}, server_timing=[{}]'.format(
+            request.method, request.path, response.status_code, server_timing
+        ))
+    return response
+
+
 # TODO: remove the root route when the monitoring tools can work without it
 @app.route('/', methods=['GET'])
 @app.route('/health', methods=['GET'])
 def healthcheck():
-    try:
-        _hit_database_with_sample_query()
-        return _get_healthcheck_response('ok', 200, None)
-    except Exception as e:
-        error_message = 'Problem talking to PostgreSQL: {0}'.format(str(e))
-        return _get_healthcheck_response('error', 500, error_message)
+    return _get_healthcheck_response(health.check_db(), 500)
+
+
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    # Only tells that the worker is up, so it never touches the DB
+    return _json_response({'status': 'ok'})
+
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    return _get_healthcheck_response(health.check_db(), 503)
 
 
 @app.route('/user/authenticate', methods=['POST'])
 def authenticate_user():
     request_json = _try_get_request_json(request)
 
-    if request_json and _is_auth_request_data_valid(request_json):
+    if request_json and request_validation.is_auth_request_data_valid(request_json):
         credentials = request_json['credentials']
         user_id = credentials['user_id']
         password = credentials['password']
 
-        # Find how many failed logins the users has since last successful login
-        failed_login_attempts = db_access.get_failed_logins(user_id)
+        # Users unknown to the filter definitely don't exist, so there's no need to ask the DB
+        if not user_id_filter.might_exist(user_id):
+            return _handle_non_existing_user_auth_request(user_id)
+
+        # Attempts to log into accounts known to be locked are answered from memory
+        failed_login_attempts = locked_accounts.record_attempt(user_id)
+        if failed_login_attempts is not None:
+            return _handle_locked_user_auth_request(user_id, failed_login_attempts)
+
+        user_credentials = db_access.get_user_credentials(user_id)
+        if user_credentials is None:
+            return _handle_non_existing_user_auth_request(user_id)
+
+        password_hash, stored_failed_logins = user_credentials
+        if failed_logins_buffer.is_enabled():
+            stored_failed_logins = failed_logins_buffer.get_buffer().get_failed_logins(
+                user_id, stored_failed_logins
+            )
+
+        # There's no point hashing the password when the account is locked anyway
+        password_matches = stored_failed_logins < MAX_LOGIN_ATTEMPTS and hashing.verify_password(
+            user_id, password, password_hash, app.config['PASSWORD_SALT']
+        )
+        failed_login_attempts = _record_login_attempt(
+            user_id, stored_failed_logins, password_matches
+        )
+
+        if failed_login_attempts == 0 and hashing.needs_rehash(password_hash):
+            _rehash_user_password(user_id, password, password_hash)
+
+        if failed_login_attempts is not None and failed_login_attempts >= MAX_LOGIN_ATTEMPTS:
+            locked_accounts.add(user_id, failed_login_attempts)
 
         if failed_login_attempts is None:
             return _handle_non_existing_user_auth_request(user_id)
-        elif failed_login_attempts >= MAX_LOGIN_ATTEMPTS:
+        elif failed_login_attempts > MAX_LOGIN_ATTEMPTS:
             return _handle_locked_user_auth_request(user_id, failed_login_attempts)
+        elif failed_login_attempts > 0:
+            return _handle_invalid_password_auth_request(user_id, failed_login_attempts)
         else:
-            return _handle_allowed_user_auth_request(
-                user_id, password, failed_login_attempts
-            )
+            metrics.AUTH_OUTCOMES.inc('success')
+            return _json_response({'user': {'user_id': user_id}})
     else:
         return INVALID_REQUEST_RESPONSE
 
@@ -82,45 +189,70 @@ def authenticate_user():
 @app.route('/admin/user', methods=['POST'])
 def create_user():
     request_json = _try_get_request_json(request)
-    if request_json and _is_create_request_data_valid(request_json):
+    if request_json and request_validation.is_create_request_data_valid(request_json):
         user = request_json['user']
         user_id = user['user_id']
         password = user['password']
-        # TODO: common code
-        password_hash = security.get_user_password_hash(
-            user_id,
-            password,
-            app.config['PASSWORD_SALT']
-        )
+        # Hashing is the expensive part, so it's skipped when the user is known to exist. Users
+        # created in the meantime are still caught by the insert.
+        if user_id_filter.might_exist(user_id) and db_access.user_exists(user_id):
+            return USER_ALREADY_EXISTS_RESPONSE
+
+        password_hash = hashing.hash_password(user_id, password)
         if db_access.create_user(user_id, password_hash):
-            auditing.audit('Created user {}'.format(user_id))
-            return Response(json.dumps({'created': True}), mimetype=JSON_CONTENT_TYPE)
+            user_id_filter.add(user_id)
+            auditing.audit(
+                'Created user {}'.format(user_id), auditing.USER_CREATED, user_id=user_id
+            )
+            return _json_response({'created': True})
         else:
-            response_body = json.dumps({'error': 'User already exists'})
-            return Response(response_body, 409, mimetype=JSON_CONTENT_TYPE)
+            return USER_ALREADY_EXISTS_RESPONSE
     else:
         return INVALID_REQUEST_RESPONSE
 
 
+@app.route('/admin/users/bulk', methods=['POST'])
+def create_users():
+    # Takes one create user request per line and streams back one result per line, so that any
+    # number of users can be created without holding them all in memory
+    if request.environ.get('wsgi.input_terminated'):
+        # The server (e.g. gunicorn) decoded a chunked body and ends the input with it. Werkzeug
+        # 0.10 only reads bodies with a Content-Length, so the input is read directly.
+        lines = request.environ['wsgi.input']
+    elif request.content_length is not None:
+        lines = request.stream
+    else:
+        # The end of the body can't be told otherwise
+        return LENGTH_REQUIRED_RESPONSE
+
+    return Response(
+        stream_with_context(_create_users(lines)),
+        mimetype=NDJSON_CONTENT_TYPE
+    )
+
+
 @app.route('/admin/user/<user_id>/update', methods=['POST'])
 def update_user(user_id):
     request_json = _try_get_request_json(request)
-    if request_json and _is_update_request_data_valid(request_json):
+    if request_json and request_validation.is_update_request_data_valid(request_json):
         new_password = request_json['user']['password']
-        new_password_hash = security.get_user_password_hash(
-            user_id,
-            new_password,
-            app.config['PASSWORD_SALT']
-        )
+        # No point hashing a password for a user that doesn't exist. The user ID filter isn't
+        # asked, as users inserted into the DB other than through this API are missing from it
+        # until its next rebuild.
+        if not db_access.user_exists(user_id):
+            return USER_NOT_FOUND_RESPONSE
+
+        new_password_hash = hashing.hash_password(user_id, new_password)
         if db_access.update_user(
             user_id=user_id,
             password_hash=new_password_hash
         ):
-            auditing.audit('Updated user {}'.format(user_id))
-            return Response(
-                json.dumps({'updated': True}),
-                mimetype=JSON_CONTENT_TYPE
+            # So that such users can log in without waiting for the rebuild
+            user_id_filter.add(user_id)
+            auditing.audit(
+                'Updated user {}'.format(user_id), auditing.USER_UPDATED, user_id=user_id
             )
+            return _json_response({'updated': True})
         else:
             return USER_NOT_FOUND_RESPONSE
     else:
@@ -129,115 +261,380 @@ def update_user(user_id):
 
 @app.route('/admin/user/<user_id>', methods=['DELETE'])
 def delete_user(user_id):
-    if db_access.delete_user(user_id):
-        auditing.audit('Deleted user {}'.format(user_id))
-        return Response(
-            json.dumps({'deleted': True}),
-            mimetype=JSON_CONTENT_TYPE
+    deleted = db_access.delete_user(user_id)
+    account_unlocks.record_unlock(user_id)
+    if deleted:
+        auditing.audit(
+            'Deleted user {}'.format(user_id), auditing.USERS_DELETED, user_ids=[user_id]
         )
+        return _json_response({'deleted': True})
     else:
         return USER_NOT_FOUND_RESPONSE
 
 
 @app.route('/admin/user/<user_id>/unlock-account')
 def unlock_account(user_id):
-    if db_access.update_failed_logins(user_id, 0):
-        auditing.audit('Reset failed login attempts for user {}'.format(user_id))
-        return Response(json.dumps({'reset': True}),
-                        mimetype=JSON_CONTENT_TYPE)
+    # Failed login counts kept in memory by any worker stop counting once the unlock is recorded
+    reset = db_access.update_failed_logins(user_id, 0)
+    account_unlocks.record_unlock(user_id)
+    if reset:
+        auditing.audit(
+            'Reset failed login attempts for user {}'.format(user_id),
+            auditing.FAILED_LOGINS_RESET, user_ids=[user_id]
+        )
+        return _json_response({'reset': True})
     else:
         return USER_NOT_FOUND_RESPONSE
 
 
+@app.route('/admin/users/locked')
+def get_locked_users():
+    # Pages through locked accounts by user ID: the next page starts after the last user ID of
+    # the current one (given as 'next'), so each page costs the same however deep it is
+    after_user_id = request.args.get('after', '')
+    try:
+        limit = int(request.args.get('limit', LOCKED_USERS_PAGE_SIZE))
+    except ValueError:
+        return INVALID_REQUEST_RESPONSE
+    if not 0 < limit <= MAX_LOCKED_USERS_PAGE_SIZE:
+        return INVALID_REQUEST_RESPONSE
+
+    # One more row than asked for tells whether there's a next page
+    rows = db_access.get_locked_users(MAX_LOGIN_ATTEMPTS, after_user_id, limit + 1)
+    users = [
+        {'user_id': user_id, 'failed_logins': failed_logins} for user_id, failed_logins in rows
+    ]
+    response_body = {
+        'users': users[:limit],
+        'next': users[limit - 1]['user_id'] if len(users) > limit else None,
+    }
+    return _json_response(response_body)
+
+
+@app.route('/admin/users/unlock-accounts', methods=['POST'])
+def unlock_accounts():
+    request_json = _try_get_request_json(request)
+    if request_json and request_validation.is_bulk_request_data_valid(request_json):
+        results = _run_bulk_admin_operation(
+            request_json, db_access.unlock_accounts, 'reset',
+            'Reset failed login attempts for users {}', auditing.FAILED_LOGINS_RESET
+        )
+        return _json_response({'results': results})
+    else:
+        return INVALID_REQUEST_RESPONSE
+
+
+@app.route('/admin/users/delete', methods=['POST'])
+def delete_users():
+    request_json = _try_get_request_json(request)
+    if request_json and request_validation.is_bulk_request_data_valid(request_json):
+        results = _run_bulk_admin_operation(
+            request_json, db_access.delete_users, 'deleted', 'Deleted users {}',
+            auditing.USERS_DELETED
+        )
+        return _json_response({'results': results})
+    else:
+        return INVALID_REQUEST_RESPONSE
+
+
 @app.route('/admin/user/<user_id>/get-failed-logins')
 def get_failed_logins(user_id):
     failed_logins = db_access.get_failed_logins(user_id)
     if failed_logins is not None:
+        if failed_logins_buffer.is_enabled():
+            failed_logins = failed_logins_buffer.get_buffer().get_failed_logins(
+                user_id, failed_logins
+            )
+        failed_logins = locked_accounts.get_failed_logins(user_id, failed_logins)
         LOGGER.info('Get failed login attempts for user {}'.format(user_id))
-        resp_json = json.dumps({'failed_login_attempts': failed_logins})
-        return Response(resp_json, mimetype=JSON_CONTENT_TYPE)
+        return _json_response({'failed_login_attempts': failed_logins})
     else:
         return USER_NOT_FOUND_RESPONSE
 
 
-def _handle_non_existing_user_auth_request(user_id):
-    auditing.audit('Invalid credentials used. username: {}. User does not exist.'.format(user_id))
-    return Response(AUTH_FAILURE_RESPONSE_BODY, status=401, mimetype=JSON_CONTENT_TYPE)
+@app.route('/admin/users/export')
+def export_users():
+    # Streams all users as NDJSON (default) or CSV, e.g. /admin/users/export?format=csv.
+    # Password hashes are only included with include_password_hash=true.
+    output_format = request.args.get('format', user_export.NDJSON)
+    if output_format not in user_export.FORMATS:
+        return INVALID_REQUEST_RESPONSE
 
+    include_password_hash = request.args.get('include_password_hash', 'false') == 'true'
+    auditing.audit(
+        'Exported users{}'.format(' with password hashes' if include_password_hash else ''),
+        auditing.USERS_EXPORTED, include_password_hash=include_password_hash
+    )
+    return Response(
+        stream_with_context(user_export.format_users(
+            db_access.export_users(include_password_hash), output_format, include_password_hash
+        )),
+        mimetype=user_export.FORMATS[output_format]
+    )
 
-def _handle_locked_user_auth_request(user_id, failed_login_attempts):
-    failed_login_attempts += 1
 
-    auditing.audit('Too many bad logins. username: {}, attempt: {}.'.format(
-        user_id, failed_login_attempts
-    ))
+@app.route('/metrics')
+def get_metrics():
+    if metrics.is_enabled():
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+    else:
+        return _json_response({'error': 'Metrics not enabled'}, 404)
 
-    db_access.update_failed_logins(user_id, failed_login_attempts)
-    return Response(AUTH_FAILURE_RESPONSE_BODY, status=401, mimetype=JSON_CONTENT_TYPE)
 
+@app.route('/admin/profile', methods=['POST'])
+def start_profile():
+    # Only profiles the worker that handles the request (see service.profiler)
+    token = app.config['PROFILER_TOKEN']
+    if not token:
+        return _json_response({'error': 'Profiler not enabled'}, 404)
+    if not _is_profiler_token(request.headers.get('Authorization', ''), token):
+        return _json_response({'error': 'Unauthorized'}, 401)
+
+    try:
+        seconds = float(request.args.get('seconds', PROFILE_SECONDS))
+    except ValueError:
+        return INVALID_REQUEST_RESPONSE
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return INVALID_REQUEST_RESPONSE
+
+    try:
+        output_path = profiler.get_profiler().start(seconds)
+    except profiler.ProfilerRunningError:
+        return _json_response({'error': 'A profile is already being recorded'}, 409)
+
+    LOGGER.info('Recording a profile of {} seconds to {}'.format(seconds, output_path))
+    return _json_response({'profiling': True, 'seconds': seconds, 'output_path': output_path})
 
-def _handle_allowed_user_auth_request(user_id, password, failed_login_attempts):
-    password_salt = app.config['PASSWORD_SALT']
-    password_hash = security.get_user_password_hash(user_id, password, password_salt)
-    user = db_access.get_user(user_id, password_hash)
 
-    if user:
-        # Reset failed login attempts to zero and proceed
-        db_access.update_failed_logins(user_id, 0)
-        return Response(_authenticated_response_body(user), mimetype=JSON_CONTENT_TYPE)
+@app.route('/admin/user-id-filter')
+def get_user_id_filter_stats():
+    if user_id_filter.is_enabled():
+        return _json_response(user_id_filter.get_filter().stats())
     else:
-        failed_login_attempts += 1
-        db_access.update_failed_logins(user_id, failed_login_attempts)
-        auditing.audit('Invalid credentials used. username: {}, attempt: {}.'.format(
-            user_id, failed_login_attempts
-        ))
+        return _json_response({'error': 'User ID filter not enabled'}, 404)
+
+
+def _run_bulk_admin_operation(
+        request_json, operation, outcome_name, audit_message_format, audit_event):
+    # Runs the operation for batches of the listed users, or of the users matching the filter
+    # taken in order of user ID, and returns the outcome for each user
+    if 'user_ids' in request_json:
+        # Duplicates would get reported twice
+        user_ids = list(dict.fromkeys(request_json['user_ids']))
+        batches = [
+            user_ids[start:start + BULK_ADMIN_BATCH_SIZE]
+            for start in range(0, len(user_ids), BULK_ADMIN_BATCH_SIZE)
+        ]
+        results = []
+        for batch in batches:
+            affected_user_ids = set(_run_bulk_admin_batch(
+                operation, audit_message_format, audit_event, user_ids=batch
+            ))
+            results.extend(
+                {'user_id': user_id, outcome_name: True} if user_id in affected_user_ids
+                else {'user_id': user_id, 'error': 'User not found'}
+                for user_id in batch
+            )
+        return results
+    else:
+        user_filter = request_json['filter']
+        results = []
+        after_user_id = ''
+        while True:
+            affected_user_ids = _run_bulk_admin_batch(
+                operation,
+                audit_message_format,
+                audit_event,
+                min_failed_logins=user_filter.get('min_failed_logins'),
+                user_id_prefix=user_filter.get('user_id_prefix'),
+                after_user_id=after_user_id,
+                limit=BULK_ADMIN_BATCH_SIZE
+            )
+            results.extend(
+                {'user_id': user_id, outcome_name: True} for user_id in affected_user_ids
+            )
+            if len(affected_user_ids) < BULK_ADMIN_BATCH_SIZE:
+                return results
+            after_user_id = affected_user_ids[-1]
 
-        return Response(AUTH_FAILURE_RESPONSE_BODY, status=401, mimetype=JSON_CONTENT_TYPE)
 
+def _run_bulk_admin_batch(operation, audit_message_format, audit_event, **kwargs):
+    affected_user_ids = operation(**kwargs)
+    for user_id in affected_user_ids:
+        account_unlocks.record_unlock(user_id)
 
-def _try_get_request_json(request):
+    if affected_user_ids:
+        auditing.audit(
+            audit_message_format.format(', '.join(affected_user_ids)), audit_event,
+            user_ids=list(affected_user_ids)
+        )
+
+    return affected_user_ids
+
+
+def _create_users(lines):
     try:
-        return request.get_json()
+        batch = []
+        for line_number, line in enumerate(lines, start=1):
+            if line.strip():
+                batch.append((line_number, line))
+            if len(batch) >= BULK_CREATE_BATCH_SIZE:
+                yield from _create_user_batch(batch)
+                batch = []
+
+        if batch:
+            yield from _create_user_batch(batch)
     except Exception as e:
-        LOGGER.error('Failed to parse JSON body from request', exc_info=e)
+        # The response has already started, so the error can only be reported in its body
+        LOGGER.error('An error occurred when creating users in bulk', exc_info=e)
+        yield INTERNAL_SERVER_ERROR_RESPONSE_BODY + '\n'
+
+
+def _create_user_batch(lines):
+    results = [None] * len(lines)
+    # user_id -> (position in the batch, password) of each user to create
+    users = {}
+    for index, (line_number, line) in enumerate(lines):
+        request_json = _try_parse_json(line)
+        if not (isinstance(request_json, dict) and
+                request_validation.is_create_request_data_valid(request_json)):
+            results[index] = {'line': line_number, 'error': 'Invalid request'}
+            continue
+
+        user = request_json['user']
+        if user['user_id'] in users:
+            results[index] = {'user_id': user['user_id'], 'error': 'User already exists'}
+        else:
+            users[user['user_id']] = (index, user['password'])
+
+    user_ids = list(users)
+    password_hashes = hashing.hash_passwords(
+        [(user_id, users[user_id][1]) for user_id in user_ids]
+    )
+    created_user_ids = db_access.create_users(list(zip(user_ids, password_hashes)))
+
+    for user_id in user_ids:
+        index = users[user_id][0]
+        if user_id in created_user_ids:
+            user_id_filter.add(user_id)
+            auditing.audit(
+                'Created user {}'.format(user_id), auditing.USER_CREATED, user_id=user_id
+            )
+            results[index] = {'user_id': user_id, 'created': True}
+        else:
+            results[index] = {'user_id': user_id, 'error': 'User already exists'}
+
+    return [json.dumps(result) + '\n' for result in results]
+
+
+def _try_parse_json(line):
+    try:
+        return json.loads(line.decode() if isinstance(line, bytes) else line)
+    except ValueError:
         return None
 
 
-def _is_auth_request_data_valid(request_data):
-    credentials = request_data.get('credentials')
-    if credentials:
-        user_id = credentials.get('user_id', None)
-        user_password = credentials.get('password', None)
-        return user_id and user_password
-    return False
+def _record_login_attempt(user_id, stored_failed_logins, password_matches):
+    if failed_logins_buffer.is_enabled():
+        # The change to the failed login count gets written in a later batch
+        return failed_logins_buffer.get_buffer().record_login_attempt(
+            user_id, stored_failed_logins, password_matches, MAX_LOGIN_ATTEMPTS
+        )
+    elif password_matches and stored_failed_logins == 0:
+        # Nothing to reset
+        return 0
+    else:
+        return db_access.record_login_attempt(user_id, password_matches, MAX_LOGIN_ATTEMPTS)
 
 
-def _is_create_request_data_valid(request_data):
-    user = request_data.get('user')
-    return user and user.get('user_id') and user.get('password')
+def _rehash_user_password(user_id, password, password_hash):
+    # Upgrades the hash to the current algorithm and cost, now that the password is known. It's
+    # only replaced if it's still the one the password was checked against, so that a password
+    # changed in the meantime isn't set back to this one. The user has logged in either way, so
+    # the upgrade is left for a later login when it can't be done now.
+    try:
+        new_password_hash = hashing.hash_password(user_id, password)
+        upgraded = db_access.update_password_hashes([(user_id, password_hash, new_password_hash)])
+    except hashing.HashingQueueFullError:
+        LOGGER.info(
+            'Skipped upgrading password hash for user {} as hashing is busy'.format(user_id)
+        )
+        return
+    except Exception as e:
+        LOGGER.warning('Failed to upgrade password hash for user {}'.format(user_id), exc_info=e)
+        return
 
+    if upgraded:
+        LOGGER.info('Upgraded password hash for user {}'.format(user_id))
 
-def _is_update_request_data_valid(request_data):
-    user = request_data.get('user')
-    return user and user.get('password')
 
+def _handle_non_existing_user_auth_request(user_id):
+    metrics.AUTH_OUTCOMES.inc('unknown_user')
+    auditing.audit(
+        'Invalid credentials used. username: {}. User does not exist.'.format(user_id),
+        auditing.UNKNOWN_USER_LOGIN, user_id=user_id
+    )
+    return Response(AUTH_FAILURE_RESPONSE_BODY, status=401, mimetype=JSON_CONTENT_TYPE)
 
-def _authenticated_response_body(user):
-    return json.dumps({"user": {"user_id": user.user_id}})
 
+def _handle_locked_user_auth_request(user_id, failed_login_attempts):
+    metrics.AUTH_OUTCOMES.inc('locked')
+    auditing.audit(
+        'Too many bad logins. username: {}, attempt: {}.'.format(user_id, failed_login_attempts),
+        auditing.LOCKED_USER_LOGIN, user_id=user_id, attempt=failed_login_attempts
+    )
+    return Response(AUTH_FAILURE_RESPONSE_BODY, status=401, mimetype=JSON_CONTENT_TYPE)
 
-def _hit_database_with_sample_query():
-    # hitting the database just to see if it responds properly
-    db_access.get_user('non-existing-user', 'password-hash')
 
+def _handle_invalid_password_auth_request(user_id, failed_login_attempts):
+    metrics.AUTH_OUTCOMES.inc('bad_password')
+    auditing.audit(
+        'Invalid credentials used. username: {}, attempt: {}.'.format(
+            user_id, failed_login_attempts
+        ),
+        auditing.INVALID_PASSWORD_LOGIN, user_id=user_id, attempt=failed_login_attempts
+    )
+    return Response(AUTH_FAILURE_RESPONSE_BODY, status=401, mimetype=JSON_CONTENT_TYPE)
 
-def _get_healthcheck_response(status, http_status_code, error_message):
-    response_body = {'status': status}
-    if error_message:
-        response_body['errors'] = [error_message]
 
-    return Response(
-        json.dumps(response_body),
-        status=http_status_code,
-        mimetype=JSON_CONTENT_TYPE,
+def _try_get_request_json(request):
+    try:
+        with request_timing.measure('parse'):
+            return request.get_json()
+    except Exception as e:
+        LOGGER.error('Failed to parse JSON body from request', exc_info=e)
+        return None
+
+
+def _is_profiler_token(authorization, token):
+    # compare_digest only takes ASCII strings, so the header is compared as the bytes it was sent
+    # as (which WSGI decodes as latin-1), and the token as UTF-8
+    try:
+        authorization = authorization.encode('latin-1')
+    except UnicodeEncodeError:
+        return False
+    return hmac.compare_digest(authorization, 'Bearer {}'.format(token).encode())
+
+
+def _json_response(body, status=200):
+    # Building the body is timed as the request's serialise phase (see request_timing)
+    with request_timing.measure('serialise'):
+        return Response(json.dumps(body), status=status, mimetype=JSON_CONTENT_TYPE)
+
+
+def _get_healthcheck_response(probe_result, error_status_code):
+    response_body = probe_result.to_dict(time.time())
+
+    # Lets the pool be sized against the number of workers and PostgreSQL's max_connections
+    pool_stats = db_pool.get_stats(db.engine.pool)
+    if pool_stats:
+        response_body['db_pool'] = pool_stats
+
+    return _json_response(
+        response_body, error_status_code if probe_result.error_message else 200
     )
+
+
+def _get_request_id():
+    # Taken from the caller when given, so that its logs can be matched up with the audit log
+    return request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
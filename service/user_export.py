@@ -0,0 +1,31 @@
+import csv
+import io
+import json
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+FORMATS = {
+    NDJSON: 'application/x-ndjson',
+    CSV: 'text/csv',
+}
+
+
+def format_users(rows, output_format, include_password_hash):
+    # Takes (user_id, failed_logins[, password_hash]) rows and yields them as lines of text
+    fields = ['user_id', 'failed_logins']
+    if include_password_hash:
+        fields.append('password_hash')
+
+    if output_format == CSV:
+        yield _format_csv_row(fields)
+        for row in rows:
+            yield _format_csv_row(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row))) + '\n'
+
+
+def _format_csv_row(row):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerow(row)
+    return buffer.getvalue()
@@ -0,0 +1,203 @@
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from config import CONFIG_DICT
+from service import app, db_access, periodic
+
+LOGGER = logging.getLogger(__name__)
+
+# Superseded flag (set once a rebuilt filter has replaced the file) and time of the build
+HEADER = struct.Struct('<?7xd')
+REBUILD_CHECK_INTERVAL = 10
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+class UserIdFilter(object):
+    # Bloom filter of existing user IDs, kept in a memory-mapped file shared by all gunicorn
+    # workers, so that a user created through one worker is visible to the others straight away.
+    # Each cell takes a whole byte, so that workers setting cells at the same time can't lose
+    # each other's writes. IDs can't be removed from a Bloom filter - deleted users stay possible
+    # matches until the next rebuild, which only costs a DB query when they're looked up.
+
+    def __init__(self, path, capacity, false_positive_rate, rebuild_interval):
+        self._path = path
+        self._rebuild_interval = rebuild_interval
+        self._cell_count = int(math.ceil(
+            -capacity * math.log(false_positive_rate) / math.log(2) ** 2
+        ))
+        self._hash_count = max(1, int(round(self._cell_count / capacity * math.log(2))))
+        self._file_size = HEADER.size + self._cell_count
+        self._cells = None
+        self._lock = threading.Lock()
+        self._rebuild_thread = periodic.PeriodicThread(
+            'user-id-filter-rebuild', REBUILD_CHECK_INTERVAL
+        )
+
+    def might_contain(self, user_id):
+        cells = self._get_cells()
+        # Until the filter is built, every user has to be looked up in the DB
+        if cells is None:
+            return True
+
+        return all(cells[index] for index in self._get_cell_indexes(user_id))
+
+    def add(self, user_id):
+        cells = self._get_cells()
+        if cells is not None:
+            self._add_to_cells(cells, user_id)
+
+    def rebuild(self, get_user_ids, force=False):
+        with open(self._path + '.lock', 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # another worker is rebuilding it
+                return False
+
+            old_cells = self._map_file()
+            if not force and old_cells is not None:
+                built_at = HEADER.unpack_from(old_cells)[1]
+                if time.time() - built_at < self._rebuild_interval:
+                    return False
+
+            temp_path = self._path + '.tmp'
+            with open(temp_path, 'w+b') as file:
+                file.truncate(self._file_size)
+                cells = mmap.mmap(file.fileno(), self._file_size)
+
+            for user_id in get_user_ids():
+                self._add_to_cells(cells, user_id)
+
+            HEADER.pack_into(cells, 0, False, time.time())
+            os.replace(temp_path, self._path)
+            if old_cells is not None:
+                HEADER.pack_into(old_cells, 0, True, 0)
+
+            # Users created while the new filter was being built may only be in the old one
+            for user_id in get_user_ids():
+                self._add_to_cells(cells, user_id)
+
+            with self._lock:
+                self._cells = cells
+
+            return True
+
+    def stats(self):
+        cells = self._get_cells()
+        if cells is None:
+            return {'built': False, 'memory_bytes': self._file_size}
+
+        cells_set = self._cell_count - cells[HEADER.size:].count(0)
+        return {
+            'built': True,
+            'built_at': HEADER.unpack_from(cells)[1],
+            'memory_bytes': self._file_size,
+            'hash_count': self._hash_count,
+            'cells_set': cells_set,
+            'estimated_false_positive_rate': (cells_set / self._cell_count) ** self._hash_count,
+        }
+
+    def start_rebuilding_periodically(self, get_user_ids):
+        # Each check only rebuilds the filter once it's rebuild_interval old
+        self._rebuild_thread.ensure_running(lambda: self._rebuild_logging_errors(get_user_ids))
+
+    def stop(self):
+        self._rebuild_thread.stop()
+
+    def _rebuild_logging_errors(self, get_user_ids):
+        try:
+            if self.rebuild(get_user_ids):
+                LOGGER.info('Rebuilt the user ID filter: {}'.format(self.stats()))
+        except Exception as e:
+            LOGGER.error('Failed to rebuild the user ID filter', exc_info=e)
+
+    def _get_cells(self):
+        cells = self._cells
+        if cells is None or HEADER.unpack_from(cells)[0]:
+            cells = self._map_file()
+            with self._lock:
+                self._cells = cells
+        return cells
+
+    def _map_file(self):
+        try:
+            with open(self._path, 'r+b') as file:
+                # A file built with different settings gets replaced by the next rebuild
+                if os.fstat(file.fileno()).st_size != self._file_size:
+                    return None
+                return mmap.mmap(file.fileno(), self._file_size)
+        except FileNotFoundError:
+            return None
+
+    def _add_to_cells(self, cells, user_id):
+        for index in self._get_cell_indexes(user_id):
+            cells[index] = 1
+
+    def _get_cell_indexes(self, user_id):
+        digest = hashlib.blake2b(user_id.encode(), digest_size=16).digest()
+        hash1, hash2 = struct.unpack('<QQ', digest)
+        return [
+            HEADER.size + (hash1 + i * hash2) % self._cell_count
+            for i in range(self._hash_count)
+        ]
+
+
+def is_enabled():
+    return bool(CONFIG_DICT['USER_ID_FILTER_PATH'])
+
+
+def get_filter():
+    global _filter
+
+    with _filter_lock:
+        if _filter is None:
+            _filter = UserIdFilter(
+                CONFIG_DICT['USER_ID_FILTER_PATH'],
+                CONFIG_DICT['USER_ID_FILTER_CAPACITY'],
+                CONFIG_DICT['USER_ID_FILTER_FALSE_POSITIVE_RATE'],
+                CONFIG_DICT['USER_ID_FILTER_REBUILD_INTERVAL'],
+            )
+        _filter.start_rebuilding_periodically(_get_all_user_ids)
+        return _filter
+
+
+def might_exist(user_id):
+    return not is_enabled() or get_filter().might_contain(user_id)
+
+
+def add(user_id):
+    if is_enabled():
+        get_filter().add(user_id)
+
+
+def reset():
+    # Removes the filter file, so that the workers build a new one from the DB when they start
+    if is_enabled():
+        try:
+            os.remove(CONFIG_DICT['USER_ID_FILTER_PATH'])
+        except FileNotFoundError:
+            pass
+
+
+def shutdown():
+    global _filter
+
+    with _filter_lock:
+        if _filter is not None:
+            _filter.stop()
+            _filter = None
+
+
+def _get_all_user_ids():
+    with app.app_context():
+        for user_id in db_access.get_all_user_ids():
+            yield user_id
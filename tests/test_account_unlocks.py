@@ -0,0 +1,24 @@
+import os
+
+from service import account_unlocks
+
+
+class TestAccountUnlocks:
+
+    def test_record_unlock_changes_generation_of_account(self):
+        generation = account_unlocks.get_generation('userid1')
+
+        account_unlocks.record_unlock('userid1')
+
+        assert account_unlocks.get_generation('userid1') != generation
+
+    def test_unlock_recorded_in_forked_process_is_seen_by_parent(self):
+        generation = account_unlocks.get_generation('userid1')
+
+        pid = os.fork()
+        if pid == 0:
+            account_unlocks.record_unlock('userid1')
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert account_unlocks.get_generation('userid1') != generation
@@ -0,0 +1,198 @@
+import asyncio
+import json
+# The pinned mock package (1.0.1) predates AsyncMock
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+pytest.importorskip('quart')
+
+from service import asgi_server  # noqa: E402
+from service.asgi_server import app  # noqa: E402
+from service import hashing  # noqa: E402
+from service.security import hash_password  # noqa: E402
+
+
+AUTHENTICATE_ROUTE = '/user/authenticate'
+CREATE_USER_ROUTE = '/admin/user'
+HEALTH_ROUTE = '/health'
+LIVENESS_ROUTE = '/health/live'
+READINESS_ROUTE = '/health/ready'
+
+INVALID_REQUEST_RESPONSE_BODY = '{"error": "Invalid request"}'
+INVALID_CREDENTIALS_RESPONSE_BODY = '{"error": "Invalid credentials"}'
+USER_ALREADY_EXISTS_RESPONSE_BODY = '{"error": "User already exists"}'
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def _post(route, body):
+    response = await app.test_client().post(route, json=body)
+    return response.status_code, (await response.get_data()).decode()
+
+
+async def _get(route):
+    response = await app.test_client().get(route)
+    return response.status_code, (await response.get_data()).decode()
+
+
+class TestAsgiServer:
+
+    def setup_method(self, method):
+        app.config.update({'PASSWORD_SALT': 'salt'})
+        self.patcher = patch('service.asgi_server.async_db_access')
+        self.mock_db_access = self.patcher.start()
+        for function_name in [
+            'get_user_credentials', 'record_login_attempt', 'user_exists', 'create_user',
+            'update_user', 'update_password_hash', 'delete_user', 'get_failed_logins',
+            'update_failed_logins', 'check_connection'
+        ]:
+            setattr(self.mock_db_access, function_name, AsyncMock())
+        self.mock_db_access.get_pool_stats.return_value = None
+
+    def teardown_method(self, method):
+        self.patcher.stop()
+
+    def test_authenticate_user_returns_400_when_credentials_missing(self):
+        status, body = _run(_post(AUTHENTICATE_ROUTE, {'valid': 'json'}))
+
+        assert status == 400
+        assert body == INVALID_REQUEST_RESPONSE_BODY
+
+    def test_authenticate_user_returns_200_when_credentials_are_valid(self):
+        self.mock_db_access.get_user_credentials.return_value = (
+            hash_password('userid1', 'somepassword', *hashing.get_hash_settings()), 0
+        )
+
+        status, body = _run(_post(AUTHENTICATE_ROUTE, {
+            'credentials': {'user_id': 'userid1', 'password': 'somepassword'}
+        }))
+
+        assert status == 200
+        assert body == '{"user": {"user_id": "userid1"}}'
+        self.mock_db_access.get_user_credentials.assert_called_once_with('userid1')
+        assert self.mock_db_access.record_login_attempt.mock_calls == []
+
+    def test_authenticate_user_upgrades_outdated_password_hash_unless_changed(self):
+        password_hash = hash_password('userid1', 'somepassword', 'pbkdf2-sha256', {'i': 1000})
+        self.mock_db_access.get_user_credentials.return_value = (password_hash, 0)
+        self.mock_db_access.update_password_hash.return_value = False
+
+        status, _ = _run(_post(AUTHENTICATE_ROUTE, {
+            'credentials': {'user_id': 'userid1', 'password': 'somepassword'}
+        }))
+
+        assert status == 200
+        assert self.mock_db_access.update_user.mock_calls == []
+        user_id, old_password_hash, _ = self.mock_db_access.update_password_hash.call_args[0]
+        assert (user_id, old_password_hash) == ('userid1', password_hash)
+
+    def test_authenticate_user_returns_200_when_password_hash_upgrade_fails(self):
+        password_hash = hash_password('userid1', 'somepassword', 'pbkdf2-sha256', {'i': 1000})
+        self.mock_db_access.get_user_credentials.return_value = (password_hash, 0)
+
+        with patch('service.asgi_server._hash_password',
+                   side_effect=hashing.HashingQueueFullError('Test exception')):
+            status, body = _run(_post(AUTHENTICATE_ROUTE, {
+                'credentials': {'user_id': 'userid1', 'password': 'somepassword'}
+            }))
+
+        assert status == 200
+        assert body == '{"user": {"user_id": "userid1"}}'
+        assert self.mock_db_access.update_password_hash.mock_calls == []
+
+    def test_authenticate_user_records_failed_login_when_password_is_wrong(self):
+        self.mock_db_access.get_user_credentials.return_value = (
+            hash_password('userid1', 'otherpassword', *hashing.get_hash_settings()), 0
+        )
+        self.mock_db_access.record_login_attempt.return_value = 1
+
+        status, body = _run(_post(AUTHENTICATE_ROUTE, {
+            'credentials': {'user_id': 'userid1', 'password': 'somepassword'}
+        }))
+
+        assert status == 401
+        assert body == INVALID_CREDENTIALS_RESPONSE_BODY
+        self.mock_db_access.record_login_attempt.assert_called_once_with(
+            'userid1', False, asgi_server.MAX_LOGIN_ATTEMPTS
+        )
+
+    def test_authenticate_user_returns_401_when_credentials_not_in_db(self):
+        self.mock_db_access.get_user_credentials.return_value = None
+
+        status, body = _run(_post(AUTHENTICATE_ROUTE, {
+            'credentials': {'user_id': 'userid1', 'password': 'somepassword'}
+        }))
+
+        assert status == 401
+        assert body == INVALID_CREDENTIALS_RESPONSE_BODY
+
+    def test_create_user_returns_409_response_when_user_already_exists(self):
+        self.mock_db_access.user_exists.return_value = False
+        self.mock_db_access.create_user.return_value = False
+
+        status, body = _run(_post(CREATE_USER_ROUTE, {
+            'user': {'user_id': 'userid1', 'password': 'somepassword'}
+        }))
+
+        assert status == 409
+        assert body == USER_ALREADY_EXISTS_RESPONSE_BODY
+
+    def test_create_user_returns_409_without_inserting_when_user_known_to_exist(self):
+        self.mock_db_access.user_exists.return_value = True
+
+        status, body = _run(_post(CREATE_USER_ROUTE, {
+            'user': {'user_id': 'userid1', 'password': 'somepassword'}
+        }))
+
+        assert status == 409
+        assert body == USER_ALREADY_EXISTS_RESPONSE_BODY
+        assert self.mock_db_access.create_user.mock_calls == []
+
+    @patch.dict('config.CONFIG_DICT', {'FAILED_LOGINS_FLUSH_INTERVAL': 5.0})
+    @patch('service.asgi_server.LOGGER')
+    def test_create_db_pool_warns_that_failed_logins_buffer_is_not_supported(self, mock_logger):
+        self.mock_db_access.create_pool = AsyncMock()
+
+        _run(asgi_server.create_db_pool())
+
+        assert 'FAILED_LOGINS_FLUSH_INTERVAL' in mock_logger.warning.call_args[0][0]
+        self.mock_db_access.create_pool.assert_called_once()
+
+    def test_health_returns_200_response_when_db_responds_properly(self):
+        status, body = _run(_get(HEALTH_ROUTE))
+
+        assert status == 200
+        assert json.loads(body)['status'] == 'ok'
+
+    def test_health_includes_db_pool_stats_when_pool_created(self):
+        pool_stats = {'size': 5, 'min_size': 5, 'max_size': 20, 'checked_out': 1}
+        self.mock_db_access.get_pool_stats.return_value = pool_stats
+
+        status, body = _run(_get(HEALTH_ROUTE))
+
+        assert status == 200
+        assert json.loads(body)['db_pool'] == pool_stats
+
+    def test_health_returns_500_response_when_db_access_fails(self):
+        self.mock_db_access.check_connection.side_effect = Exception('Test exception')
+
+        status, body = _run(_get(HEALTH_ROUTE))
+
+        assert status == 500
+        assert json.loads(body)['errors'] == ['Problem talking to PostgreSQL: Test exception']
+
+    def test_liveness_check_returns_200_without_db_access(self):
+        status, body = _run(_get(LIVENESS_ROUTE))
+
+        assert status == 200
+        assert self.mock_db_access.check_connection.mock_calls == []
+
+    def test_readiness_check_returns_503_when_db_access_fails(self):
+        self.mock_db_access.check_connection.side_effect = Exception('Test exception')
+
+        status, body = _run(_get(READINESS_ROUTE))
+
+        assert status == 503
@@ -0,0 +1,258 @@
+import gzip
+import importlib.util
+import io
+import os
+import shutil
+import sys
+import types
+import zlib
+
+from service import logging_config
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+
+def _load_script(name):
+    # The scripts' names aren't valid module names. They're registered as modules so that the
+    # functions run by extract's process pool can be found by name.
+    module_name = name.replace('-', '_')
+    spec = importlib.util.spec_from_file_location(
+        module_name, os.path.join(SCRIPTS_DIR, name + '.py')
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+extract_audit_logs = _load_script('extract-audit-logs')
+index_audit_logs = _load_script('index-audit-logs')
+
+
+def _audit_line(second, message):
+    return (
+        '2024-01-01 12:{:02d}:{:02d},000 level=[INFO] logger=[service.auditing] '
+        'thread=[MainThread] message=[{}] exception=[None]\n'.format(
+            second // 60, second % 60, message
+        )
+    ).encode()
+
+
+def _other_line(second):
+    return (
+        '2024-01-01 12:{:02d}:{:02d},000 level=[INFO] logger=[service.server] '
+        'thread=[MainThread] message=[Get failed login attempts for user x] '
+        'exception=[None]\n'.format(second // 60, second % 60)
+    ).encode()
+
+
+def _created_lines(start, count):
+    return [
+        _audit_line(second, 'Created user user{}'.format(second))
+        for second in range(start, start + count)
+    ]
+
+
+def _write(path, lines, mode='wb'):
+    with open(path, mode) as file:
+        file.write(b''.join(lines))
+
+
+def _gzip(path, gzip_path):
+    with open(path, 'rb') as file, gzip.open(gzip_path, 'wb') as gzip_file:
+        shutil.copyfileobj(file, gzip_file)
+    os.remove(path)
+
+
+def _extract(paths, filters, processes=1):
+    output = io.BytesIO()
+    extract_audit_logs.extract(paths, filters, processes, output)
+    return output.getvalue().splitlines(keepends=True)
+
+
+def _follow(path, checkpoint_path):
+    output = io.BytesIO()
+    extract_audit_logs.follow(path, extract_audit_logs.Filters(), checkpoint_path, output=output)
+    return output.getvalue().splitlines(keepends=True)
+
+
+def _query(connection, **kwargs):
+    output = io.BytesIO()
+    index_audit_logs.query(connection, output=output, **kwargs)
+    return output.getvalue().splitlines(keepends=True)
+
+
+class TestExtractAuditLogs:
+
+    def test_extract_finds_every_entry_once_across_ranges_and_gzipped_files(
+            self, tmp_path, monkeypatch):
+        # Ranges end in the middle of lines, which belong to the range they start in
+        monkeypatch.setattr(extract_audit_logs, 'RANGE_SIZE', 333)
+        rotated_lines = _created_lines(0, 20)
+        lines = []
+        for second in range(20, 60):
+            lines.append(_audit_line(second, 'Created user user{}'.format(second)))
+            lines.append(_other_line(second))
+        rotated_path = str(tmp_path / 'audit.log.1')
+        _write(rotated_path, rotated_lines)
+        _gzip(rotated_path, rotated_path + '.gz')
+        path = str(tmp_path / 'audit.log')
+        _write(path, lines)
+
+        expected_lines = rotated_lines + lines[::2]
+        filters = extract_audit_logs.Filters()
+        assert _extract([rotated_path + '.gz', path], filters) == expected_lines
+        assert _extract([rotated_path + '.gz', path], filters, processes=2) == expected_lines
+
+    def test_extract_keeps_entries_matching_every_filter(self, tmp_path):
+        lines = [
+            _audit_line(0, 'Created user user1'),
+            _audit_line(1, 'Invalid credentials used. username: user1, attempt: 1.'),
+            _audit_line(2, 'Invalid credentials used. username: user2. User does not exist.'),
+            _audit_line(3, 'Invalid credentials used. username: user1, attempt: 2.'),
+            _audit_line(4, 'Too many bad logins. username: user1, attempt: 11.'),
+            _audit_line(5, 'Invalid credentials used. username: user1, attempt: 3.'),
+        ]
+        path = str(tmp_path / 'audit.log')
+        _write(path, lines)
+
+        filters = extract_audit_logs.Filters(
+            ['invalid_password_login', 'locked_user_login'],
+            '2024-01-01T12:00:02', '2024-01-01T12:00:05'
+        )
+        assert _extract([path], filters) == [lines[3], lines[4]]
+
+    def test_extract_reads_ndjson_entries(self, tmp_path):
+        lines = [
+            b'{"timestamp": "2024-01-01T12:00:00.000Z", "event": "user_created"}\n',
+            b'{"timestamp": "2024-01-01T12:00:01.000Z", "event": "user_updated"}\n',
+            b'{"timestamp": "2024-01-01T12:00:02.000Z", "event": "user_created"}',
+        ]
+        path = str(tmp_path / 'audit.log')
+        _write(path, lines)
+
+        filters = extract_audit_logs.Filters(['user_created'])
+        assert _extract([path], filters) == [lines[0], lines[2] + b'\n']
+
+    def test_follow_resumes_from_checkpoint_after_rotation_and_compression(self, tmp_path):
+        path = str(tmp_path / 'audit.log')
+        checkpoint_path = str(tmp_path / 'checkpoint.json')
+        lines = _created_lines(0, 10)
+        _write(path, lines[:3])
+
+        assert _follow(path, checkpoint_path) == lines[:3]
+
+        # Rotated twice since the last run, with lines added before each rotation
+        _write(path, lines[3:5], 'ab')
+        os.rename(path, path + '.1')
+        _write(path, lines[5:7])
+        os.rename(path + '.1', path + '.2')
+        os.rename(path, path + '.1')
+        _gzip(path + '.2', path + '.2.gz')
+        _gzip(path + '.1', path + '.1.gz')
+        _write(path, lines[7:9])
+
+        assert _follow(path, checkpoint_path) == lines[3:9]
+
+        _write(path, lines[9:], 'ab')
+
+        assert _follow(path, checkpoint_path) == lines[9:]
+
+    def test_follow_leaves_partly_written_line_for_next_run(self, tmp_path):
+        path = str(tmp_path / 'audit.log')
+        checkpoint_path = str(tmp_path / 'checkpoint.json')
+        lines = _created_lines(0, 2)
+        _write(path, [lines[0], lines[1][:20]])
+
+        assert _follow(path, checkpoint_path) == lines[:1]
+
+        _write(path, [lines[1][20:]], 'ab')
+
+        assert _follow(path, checkpoint_path) == lines[1:]
+
+
+class TestIndexAuditLogs:
+
+    def test_query_finds_entries_by_user_id_and_time(self, tmp_path):
+        path = str(tmp_path / 'audit.log')
+        lines = [
+            _audit_line(0, 'Created user user1'),
+            _audit_line(1, 'Created user user2'),
+            _audit_line(2, 'Invalid credentials used. username: user1, attempt: 1.'),
+            _other_line(3),
+            _audit_line(4, 'Deleted users user1, user2'),
+        ]
+        _write(path, lines)
+        connection = index_audit_logs.connect(str(tmp_path / 'index.db'))
+
+        index_audit_logs.update(connection, path)
+
+        assert _query(connection, user_id='user1') == [lines[0], lines[2], lines[4]]
+        assert _query(connection, user_id='user2', since='2024-01-01T12:00:02') == [lines[4]]
+        assert _query(connection, events=['user_created'], until='2024-01-01T12:00:01') == \
+            [lines[0]]
+        assert _query(connection) == lines[:3] + lines[4:]
+
+    def test_incremental_updates_index_new_entries_once(self, tmp_path):
+        path = str(tmp_path / 'audit.log')
+        lines = _created_lines(0, 6)
+        # The last line isn't complete yet, so it's left for the next update
+        _write(path, [lines[0], lines[1], lines[2][:30]])
+        connection = index_audit_logs.connect(str(tmp_path / 'index.db'))
+
+        index_audit_logs.update(connection, path)
+        index_audit_logs.update(connection, path)
+
+        assert _query(connection) == lines[:2]
+
+        _write(path, [lines[2][30:], lines[3]], 'ab')
+        os.rename(path, path + '.1')
+        _gzip(path + '.1', path + '.1.gz')
+        _write(path, lines[4:])
+
+        index_audit_logs.update(connection, path)
+        index_audit_logs.update(connection, path)
+
+        assert _query(connection) == lines
+        assert _query(connection, user_id='user3') == [lines[3]]
+        entry_count = connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        assert entry_count == len(lines)
+
+    def test_query_writes_entries_of_gzipped_files_in_time_order(self, tmp_path):
+        path = str(tmp_path / 'audit.log')
+        # Entries of different workers can be logged out of order
+        lines = [_audit_line(second, 'Created user user{}'.format(second)) for second in [2, 0, 1]]
+        _write(path + '.1', lines)
+        _gzip(path + '.1', path + '.1.gz')
+        _write(path, [_audit_line(3, 'Created user user3')])
+        connection = index_audit_logs.connect(str(tmp_path / 'index.db'))
+
+        index_audit_logs.update(connection, path)
+
+        assert _query(connection, since='2024-01-01T12:00:01', until='2024-01-01T12:00:03') == \
+            [lines[2], lines[0]]
+
+    def test_query_decompresses_only_the_gzip_member_holding_an_entry(
+            self, tmp_path, monkeypatch):
+        path = str(tmp_path / 'audit.log')
+        lines = _created_lines(0, 40)
+        _write(path + '.1', lines)
+        monkeypatch.setattr(logging_config, 'COMPRESSION_MEMBER_SIZE', 500)
+        logging_config._compress(path + '.1', path + '.1.gz', path + '.lock')
+        _write(path, [])
+        connection = index_audit_logs.connect(str(tmp_path / 'index.db'))
+
+        index_audit_logs.update(connection, path)
+
+        member_count = connection.execute('SELECT COUNT(*) FROM gzip_members').fetchone()[0]
+        assert member_count == -(-len(b''.join(lines)) // 500)
+        decompressors = []
+        monkeypatch.setattr(index_audit_logs, 'zlib', types.SimpleNamespace(
+            decompressobj=lambda *args: decompressors.append(args) or zlib.decompressobj(*args),
+            error=zlib.error
+        ))
+        assert _query(connection, user_id='user38') == [lines[38]]
+        # Lines can span two members
+        assert len(decompressors) <= 2
+        assert _query(connection) == lines
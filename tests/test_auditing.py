@@ -1,9 +1,10 @@
-from collections import namedtuple
 import json
+import logging
 from mock import MagicMock
 import mock
 
-from service import server
+from service import auditing, hashing, server
+from service.security import hash_password
 from service.server import app
 
 
@@ -17,7 +18,6 @@ HEALTH_ROUTE = '/health'
 
 JSON_CONTENT_TYPE_HEADER = {"Content-type": "application/json"}
 
-FakeUser = namedtuple('User', ['user_id', 'password_hash', 'failed_logins'])
 
 
 class TestServer:
@@ -52,15 +52,14 @@ class TestServer:
         })
 
         mock_db_access = MagicMock()
-        mock_db_access.get_user = lambda self, *args, **kwargs: None
-        mock_db_access.get_failed_logins = lambda self, *args, **kwargs: None
-        mock_db_access.update_failed_logins = lambda self, *args, **kwargs: 1
+        mock_db_access.get_user_credentials.return_value = None
         server.db_access = mock_db_access
 
         self.app.post(AUTHENTICATE_ROUTE, data=body, headers=JSON_CONTENT_TYPE_HEADER)
 
         mock_audit.assert_called_once_with(
-            'Invalid credentials used. username: {}. User does not exist.'.format(user_id)
+            'Invalid credentials used. username: {}. User does not exist.'.format(user_id),
+            auditing.UNKNOWN_USER_LOGIN, user_id=user_id
         )
 
     @mock.patch('service.auditing.audit')
@@ -71,15 +70,15 @@ class TestServer:
         })
 
         mock_db_access = MagicMock()
-        mock_db_access.get_user = lambda self, *args, **kwargs: None
-        mock_db_access.get_failed_logins = lambda self, *args, **kwargs: 0
-        mock_db_access.update_failed_logins = lambda self, *args, **kwargs: 1
+        mock_db_access.get_user_credentials.return_value = ('passwordhash', 0)
+        mock_db_access.record_login_attempt.return_value = 1
         server.db_access = mock_db_access
 
         self.app.post(AUTHENTICATE_ROUTE, data=body, headers=JSON_CONTENT_TYPE_HEADER)
 
         mock_audit.assert_called_once_with(
-            'Invalid credentials used. username: {}, attempt: 1.'.format(user_id)
+            'Invalid credentials used. username: {}, attempt: 1.'.format(user_id),
+            auditing.INVALID_PASSWORD_LOGIN, user_id=user_id, attempt=1
         )
 
     @mock.patch('service.auditing.audit')
@@ -90,21 +89,22 @@ class TestServer:
         })
 
         mock_db_access = MagicMock()
-        mock_db_access.get_user = FakeUser(user_id, 'passwordhash', 20)
-        mock_db_access.get_failed_logins = lambda self, *args, **kwargs: 20
-        mock_db_access.update_failed_logins = lambda self, *args, **kwargs: 1
+        mock_db_access.get_user_credentials.return_value = ('passwordhash', 20)
+        mock_db_access.record_login_attempt.return_value = 21
         server.db_access = mock_db_access
 
         self.app.post(AUTHENTICATE_ROUTE, data=body, headers=JSON_CONTENT_TYPE_HEADER)
 
         mock_audit.assert_called_once_with(
-            'Too many bad logins. username: {}, attempt: 21.'.format(user_id)
+            'Too many bad logins. username: {}, attempt: 21.'.format(user_id),
+            auditing.LOCKED_USER_LOGIN, user_id=user_id, attempt=21
         )
 
     @mock.patch('service.auditing.audit')
-    @mock.patch('service.server.db_access.get_user',
+    @mock.patch('service.server.db_access.get_user_credentials',
                 side_effect=Exception('Intentional test exception'))
-    def test_authenticate_user_does_not_audit_when_error_occurs(self, mock_get_user, mock_audit):
+    def test_authenticate_user_does_not_audit_when_error_occurs(
+            self, mock_get_user_credentials, mock_audit):
         valid_body = json.dumps({
             "credentials": {"user_id": "userid1", "password": "somepassword"}
         })
@@ -119,9 +119,9 @@ class TestServer:
         })
 
         mock_db_access = MagicMock()
-        mock_db_access.get_user.return_value = FakeUser('userid1', 'passwordhash', 0)
-        mock_db_access.get_failed_logins = lambda self, *args, **kwargs: 0
-        mock_db_access.update_failed_logins = lambda self, *args, **kwargs: 1
+        mock_db_access.get_user_credentials.return_value = (
+            hash_password('userid1', 'somepassword', *hashing.get_hash_settings()), 0
+        )
         server.db_access = mock_db_access
 
         self.app.post(AUTHENTICATE_ROUTE, data=valid_body, headers=JSON_CONTENT_TYPE_HEADER)
@@ -138,9 +138,10 @@ class TestServer:
         assert mock_audit.mock_calls == []
 
     @mock.patch('service.auditing.audit')
+    @mock.patch('service.server.db_access.user_exists', return_value=False)
     @mock.patch('service.server.db_access.create_user', return_value=False)
     def test_create_user_does_not_audit_when_user_already_exists(
-            self, mock_create_user, mock_audit):
+            self, mock_create_user, mock_user_exists, mock_audit):
 
         valid_body = json.dumps({
             "user": {
@@ -152,8 +153,10 @@ class TestServer:
         assert mock_audit.mock_calls == []
 
     @mock.patch('service.auditing.audit')
+    @mock.patch('service.server.db_access.user_exists', return_value=False)
     @mock.patch('service.server.db_access.create_user', return_value=True)
-    def test_create_user_audits_when_creation_successful(self, mock_create_user, mock_audit):
+    def test_create_user_audits_when_creation_successful(
+            self, mock_create_user, mock_user_exists, mock_audit):
         user_id = 'userid1'
         valid_body = json.dumps({
             "user": {
@@ -163,12 +166,15 @@ class TestServer:
         })
 
         self.app.post(CREATE_USER_ROUTE, data=valid_body, headers=JSON_CONTENT_TYPE_HEADER)
-        mock_audit.assert_called_once_with('Created user {}'.format(user_id))
+        mock_audit.assert_called_once_with(
+            'Created user {}'.format(user_id), auditing.USER_CREATED, user_id=user_id
+        )
 
     @mock.patch('service.auditing.audit')
+    @mock.patch('service.server.db_access.user_exists', return_value=False)
     @mock.patch('service.server.db_access.create_user', side_effect=Exception('Test exception'))
     def test_create_user_returns_500_response_when_an_error_occurs(
-            self, mock_create_user, mock_audit):
+            self, mock_create_user, mock_user_exists, mock_audit):
 
         valid_body = json.dumps({
             "user": {"user_id": "userid", "password": "somepassword"}
@@ -212,7 +218,9 @@ class TestServer:
             headers=JSON_CONTENT_TYPE_HEADER
         )
 
-        mock_audit.assert_called_once_with('Updated user {}'.format(user_id))
+        mock_audit.assert_called_once_with(
+            'Updated user {}'.format(user_id), auditing.USER_UPDATED, user_id=user_id
+        )
 
     @mock.patch('service.auditing.audit')
     @mock.patch('service.server.db_access.update_user', side_effect=Exception('Test exception'))
@@ -241,7 +249,9 @@ class TestServer:
         user_id = 'userid1'
         self.app.delete(DELETE_USER_ROUTE_FORMAT.format(user_id))
 
-        mock_audit.assert_called_once_with('Deleted user {}'.format(user_id))
+        mock_audit.assert_called_once_with(
+            'Deleted user {}'.format(user_id), auditing.USERS_DELETED, user_ids=[user_id]
+        )
 
     @mock.patch('service.auditing.audit')
     @mock.patch('service.server.db_access.delete_user', side_effect=Exception('Test exception'))
@@ -264,5 +274,63 @@ class TestServer:
         self.app.get(UNLOCK_ACCOUNT_ROUTE_FORMAT.format(user_id))
 
         mock_audit.assert_called_once_with(
-            'Reset failed login attempts for user {}'.format(user_id)
+            'Reset failed login attempts for user {}'.format(user_id),
+            auditing.FAILED_LOGINS_RESET, user_ids=[user_id]
+        )
+
+    @mock.patch('service.auditing.audit')
+    @mock.patch('service.server.db_access.unlock_accounts', return_value=['userid1', 'userid2'])
+    def test_unlock_accounts_audits_once_per_batch(self, mock_unlock_accounts, mock_audit):
+        self.app.post(
+            '/admin/users/unlock-accounts',
+            data='{"user_ids": ["userid1", "userid2", "userid3"]}',
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        mock_audit.assert_called_once_with(
+            'Reset failed login attempts for users userid1, userid2',
+            auditing.FAILED_LOGINS_RESET, user_ids=['userid1', 'userid2']
         )
+
+    @mock.patch('service.auditing.audit')
+    @mock.patch('service.server.db_access.delete_users', return_value=[])
+    def test_delete_users_does_not_audit_when_no_user_deleted(self, mock_delete_users, mock_audit):
+        self.app.post(
+            '/admin/users/delete',
+            data='{"user_ids": ["userid1"]}',
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert mock_audit.mock_calls == []
+
+    @mock.patch('service.auditing.LOGGER')
+    @mock.patch('service.server.db_access.update_failed_logins', return_value=True)
+    def test_audit_entries_get_request_id_from_header(self, mock_update_failed_logins, mock_logger):
+        self.app.get(
+            UNLOCK_ACCOUNT_ROUTE_FORMAT.format('userid1'), headers={'X-Request-ID': 'request1'}
+        )
+
+        extra = mock_logger.info.call_args[1]['extra']
+        assert extra['audit_request_id'] == 'request1'
+
+
+class TestNdjsonAuditFormatter:
+
+    def test_format_writes_event_fields_and_request_id_as_json(self):
+        record = logging.LogRecord(
+            auditing.AUDITING_LOGGER_NAME, logging.INFO, __file__, 0,
+            'Invalid credentials used. username: userid1, attempt: 2.', None, None
+        )
+        record.created = 0
+        record.audit_event = auditing.INVALID_PASSWORD_LOGIN
+        record.audit_fields = {'user_id': 'userid1', 'attempt': 2}
+        record.audit_request_id = 'request1'
+
+        assert json.loads(auditing.NdjsonAuditFormatter().format(record)) == {
+            'timestamp': '1970-01-01T00:00:00.000+00:00',
+            'event': 'invalid_password_login',
+            'user_id': 'userid1',
+            'attempt': 2,
+            'request_id': 'request1',
+            'message': 'Invalid credentials used. username: userid1, attempt: 2.',
+        }
@@ -0,0 +1,84 @@
+from mock import MagicMock, patch
+import pytest
+import sqlite3
+from sqlalchemy import exc  # type: ignore
+from sqlalchemy.pool import NullPool  # type: ignore
+
+from service import db_pool
+from service.db_pool import InstrumentedQueuePool
+
+
+class TestInstrumentedQueuePool:
+
+    def setup_method(self, method):
+        self.pool = InstrumentedQueuePool(
+            lambda: sqlite3.connect(':memory:'), pool_size=1, max_overflow=1, timeout=0.01
+        )
+
+    def teardown_method(self, method):
+        self.pool.dispose()
+
+    def test_stats_count_checked_out_connections(self):
+        connection = self.pool.connect()
+
+        stats = self.pool.stats()
+        assert stats['size'] == 1
+        assert stats['checked_out'] == 1
+        assert stats['checkouts'] == 1
+        assert stats['overflow_events'] == 0
+
+        connection.close()
+        assert self.pool.stats()['checked_out'] == 0
+
+    def test_stats_count_overflow_events(self):
+        connection1 = self.pool.connect()
+        connection2 = self.pool.connect()
+
+        stats = self.pool.stats()
+        assert stats['checked_out'] == 2
+        assert stats['overflow'] == 1
+        assert stats['overflow_events'] == 1
+
+        connection1.close()
+        connection2.close()
+
+    def test_stats_count_timeouts(self):
+        connections = [self.pool.connect(), self.pool.connect()]
+
+        with pytest.raises(exc.TimeoutError):
+            self.pool.connect()
+
+        assert self.pool.stats()['timeouts'] == 1
+        for connection in connections:
+            connection.close()
+
+    @patch.dict('config.CONFIG_DICT', {'DB_POOL_PRE_PING': True})
+    def test_pre_ping_replaces_broken_connections(self):
+        broken_connection = MagicMock()
+        broken_connection.cursor.side_effect = Exception('Connection lost')
+        working_connection = sqlite3.connect(':memory:')
+        connections = iter([broken_connection, working_connection])
+        self.pool = InstrumentedQueuePool(lambda: next(connections), pool_size=1)
+
+        connection = self.pool.connect()
+
+        assert connection.connection is working_connection
+        connection.close()
+
+    @patch.dict('config.CONFIG_DICT', {'DB_STATEMENT_TIMEOUT': 5000})
+    def test_statement_timeout_set_on_new_connections(self):
+        dbapi_connection = MagicMock()
+        self.pool = InstrumentedQueuePool(lambda: dbapi_connection, pool_size=1)
+
+        self.pool.connect().close()
+
+        dbapi_connection.cursor.return_value.execute.assert_any_call(
+            'SET statement_timeout = 5000'
+        )
+        assert dbapi_connection.commit.called
+
+
+class TestGetStats:
+
+    def test_returns_none_for_uninstrumented_pool(self):
+        assert db_pool.get_stats(NullPool(lambda: sqlite3.connect(':memory:'))) is None
@@ -0,0 +1,82 @@
+from mock import patch
+import pytest
+
+from service import account_unlocks
+from service.failed_logins_buffer import FailedLoginsBuffer
+
+MAX_FAILED_LOGINS = 10
+
+
+class TestFailedLoginsBuffer:
+
+    def setup_method(self, method):
+        self.buffer = FailedLoginsBuffer(flush_interval=60)
+
+    def teardown_method(self, method):
+        self.buffer._flush_thread.stop()
+
+    def test_get_failed_logins_returns_stored_value_when_nothing_buffered(self):
+        assert self.buffer.get_failed_logins('userid1', 3) == 3
+
+    def test_record_login_attempt_increments_count_when_password_does_not_match(self):
+        assert self.buffer.record_login_attempt('userid1', 3, False, MAX_FAILED_LOGINS) == 4
+        assert self.buffer.record_login_attempt('userid1', 3, False, MAX_FAILED_LOGINS) == 5
+        assert self.buffer.get_failed_logins('userid1', 3) == 5
+
+    def test_record_login_attempt_resets_count_when_password_matches(self):
+        self.buffer.record_login_attempt('userid1', 3, False, MAX_FAILED_LOGINS)
+
+        assert self.buffer.record_login_attempt('userid1', 3, True, MAX_FAILED_LOGINS) == 0
+        assert self.buffer.get_failed_logins('userid1', 3) == 0
+
+    def test_record_login_attempt_increments_count_when_account_locked(self):
+        assert self.buffer.record_login_attempt(
+            'userid1', MAX_FAILED_LOGINS, True, MAX_FAILED_LOGINS
+        ) == MAX_FAILED_LOGINS + 1
+
+    def test_record_login_attempt_buffers_nothing_when_count_already_zero(self):
+        self.buffer.record_login_attempt('userid1', 0, True, MAX_FAILED_LOGINS)
+        assert self.buffer.pending_count() == 0
+
+    @patch('service.failed_logins_buffer.db_access')
+    def test_flush_writes_all_buffered_changes_in_one_batch(self, mock_db_access):
+        self.buffer.record_login_attempt('userid1', 0, False, MAX_FAILED_LOGINS)
+        self.buffer.record_login_attempt('userid1', 0, False, MAX_FAILED_LOGINS)
+        self.buffer.record_login_attempt('userid2', 5, True, MAX_FAILED_LOGINS)
+
+        self.buffer.flush()
+
+        mock_db_access.apply_failed_logins_changes.assert_called_once_with({
+            'userid1': (False, 2),
+            'userid2': (True, 0),
+        })
+        assert self.buffer.pending_count() == 0
+
+    @patch('service.failed_logins_buffer.db_access')
+    def test_flush_keeps_changes_when_db_write_fails(self, mock_db_access):
+        mock_db_access.apply_failed_logins_changes.side_effect = Exception('Test exception')
+        self.buffer.record_login_attempt('userid1', 0, False, MAX_FAILED_LOGINS)
+
+        with pytest.raises(Exception):
+            self.buffer.flush()
+
+        self.buffer.record_login_attempt('userid1', 0, False, MAX_FAILED_LOGINS)
+        assert self.buffer.get_failed_logins('userid1', 0) == 2
+
+    def test_unlock_drops_buffered_changes_for_user(self):
+        self.buffer.record_login_attempt('userid1', 0, False, MAX_FAILED_LOGINS)
+        account_unlocks.record_unlock('userid1')
+
+        assert self.buffer.get_failed_logins('userid1', 0) == 0
+
+    @patch('service.failed_logins_buffer.db_access')
+    def test_flush_drops_changes_recorded_before_unlock(self, mock_db_access):
+        self.buffer.record_login_attempt('userid1', 0, False, MAX_FAILED_LOGINS)
+        self.buffer.record_login_attempt('userid2', 0, False, MAX_FAILED_LOGINS)
+        account_unlocks.record_unlock('userid1')
+
+        self.buffer.flush()
+
+        mock_db_access.apply_failed_logins_changes.assert_called_once_with({
+            'userid2': (False, 1),
+        })
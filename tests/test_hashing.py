@@ -0,0 +1,84 @@
+import time
+
+from mock import MagicMock, patch
+import pytest
+
+from service import hashing, security
+
+
+class TestHashing:
+
+    def setup_method(self, method):
+        self.executor = hashing.HashingExecutor(pool_size=1, queue_size=0)
+
+    def teardown_method(self, method):
+        self.executor.shutdown()
+
+    def test_submit_returns_future_with_result_of_function(self):
+        expected = security.get_user_password_hash('user1', 'password1', 'salt1')
+        future = self.executor.submit(
+            security.get_user_password_hash, 'user1', 'password1', 'salt1'
+        )
+        assert future.result() == expected
+
+    def test_submit_raises_error_when_queue_is_full(self):
+        future = self.executor.submit(time.sleep, 0.5)
+
+        with pytest.raises(hashing.HashingQueueFullError):
+            self.executor.submit(time.sleep, 0)
+
+        future.result()
+
+    def test_submit_accepts_work_again_when_slot_released(self):
+        self.executor.submit(time.sleep, 0).result()
+        # the slot is released by a done callback, which may run just after result() returns
+        time.sleep(0.1)
+
+        assert self.executor.submit(time.sleep, 0).result() is None
+
+    def test_submit_waiting_waits_for_free_slot_when_queue_is_full(self):
+        future = self.executor.submit(time.sleep, 0.2)
+
+        assert self.executor.submit_waiting(time.sleep, 0).result() is None
+        assert future.done()
+
+    @patch.dict('config.CONFIG_DICT', {
+        'HASHING_POOL_SIZE': 2, 'HASHING_QUEUE_SIZE': 0, 'PASSWORD_HASH_PBKDF2_ITERATIONS': 1000
+    })
+    def test_hash_passwords_returns_hashes_in_order(self):
+        credentials = [('user{}'.format(i), 'password{}'.format(i)) for i in range(25)]
+        with patch('service.hashing._executor', None):
+            try:
+                password_hashes = hashing.hash_passwords(credentials)
+            finally:
+                hashing.shutdown()
+
+        assert len(password_hashes) == 25
+        for (user_id, password), password_hash in zip(credentials, password_hashes):
+            assert security.verify_password(user_id, password, password_hash, None)
+
+    @patch.dict('config.CONFIG_DICT', {
+        'HASHING_POOL_SIZE': 3, 'PASSWORD_HASH_PBKDF2_ITERATIONS': 1000
+    })
+    def test_hash_passwords_leaves_a_process_free_for_logins(self):
+        in_flight = []
+        max_in_flight = []
+
+        class DeferredResult(object):
+            def __init__(self, fn, args):
+                self._fn = fn
+                self._args = args
+                in_flight.append(self)
+                max_in_flight.append(len(in_flight))
+
+            def result(self):
+                in_flight.remove(self)
+                return self._fn(*self._args)
+
+        mock_executor = MagicMock()
+        mock_executor.submit_waiting.side_effect = lambda fn, *args: DeferredResult(fn, args)
+        credentials = [('user{}'.format(i), 'password{}'.format(i)) for i in range(50)]
+        with patch('service.hashing.get_executor', return_value=mock_executor):
+            assert len(hashing.hash_passwords(credentials)) == 50
+
+        assert max(max_in_flight) == 2
@@ -0,0 +1,74 @@
+from mock import patch
+import time
+
+from service import health
+from service.health import HealthProber, ProbeResult
+
+
+class TestHealthProber:
+
+    def setup_method(self, method):
+        self.prober = HealthProber(interval=60)
+
+    def teardown_method(self, method):
+        self.prober.stop()
+
+    def test_get_result_returns_none_before_first_probe(self):
+        assert self.prober.get_result() is None
+
+    def test_get_result_returns_recorded_result(self):
+        result = ProbeResult(None, 0.001, time.time())
+        self.prober.record_result(result)
+
+        assert self.prober.get_result() is result
+
+    def test_get_result_returns_error_when_result_is_stale(self):
+        self.prober.record_result(ProbeResult(None, 0.001, time.time() - 181))
+
+        result = self.prober.get_result()
+        assert result.error_message == health.STALE_RESULT_ERROR_MESSAGE
+
+    def test_start_probing_periodically_records_probe_results(self):
+        result = ProbeResult('Test error', 0.001, time.time())
+
+        self.prober.start_probing_periodically(lambda: result)
+
+        for _ in range(100):
+            if self.prober.get_result() is not None:
+                break
+            time.sleep(0.01)
+        assert self.prober.get_result() is result
+
+
+class TestProbeResult:
+
+    def test_to_dict_includes_age_latency_and_errors(self):
+        result = ProbeResult('Test error', 0.0125, 100.0)
+
+        assert result.to_dict(now=102.5) == {
+            'status': 'error',
+            'age_seconds': 2.5,
+            'probe_latency_ms': 12.5,
+            'errors': ['Test error'],
+        }
+
+
+class TestCheckDb:
+
+    @patch.dict('config.CONFIG_DICT', {'HEALTH_PROBE_INTERVAL': 60})
+    @patch('service.health.probe_db')
+    def test_returns_cached_result_when_probing_enabled(self, mock_probe_db):
+        result = ProbeResult(None, 0.001, time.time())
+        with patch('service.health.get_prober') as mock_get_prober:
+            mock_get_prober.return_value.get_result.return_value = result
+
+            assert health.check_db() is result
+
+        assert mock_probe_db.mock_calls == []
+
+    @patch('service.health.db_access.get_user', side_effect=Exception('Test exception'))
+    def test_probes_db_when_probing_disabled(self, mock_get_user):
+        result = health.check_db()
+
+        assert result.error_message == 'Problem talking to PostgreSQL: Test exception'
+        mock_get_user.assert_called_once_with('non-existing-user', 'password-hash')
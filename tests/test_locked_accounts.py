@@ -0,0 +1,64 @@
+from mock import patch
+import time
+
+from service import account_unlocks
+from service.locked_accounts import LockedAccountsCache
+
+
+class TestLockedAccountsCache:
+
+    def setup_method(self, method):
+        self.cache = LockedAccountsCache(ttl=60, max_size=2, flush_interval=60)
+
+    def teardown_method(self, method):
+        self.cache._failed_logins_buffer._flush_thread.stop()
+
+    def test_record_attempt_returns_none_when_account_not_cached(self):
+        assert self.cache.record_attempt('userid1') is None
+
+    def test_record_attempt_returns_incremented_count_when_account_cached(self):
+        self.cache.add('userid1', 10)
+
+        assert self.cache.record_attempt('userid1') == 11
+        assert self.cache.record_attempt('userid1') == 12
+
+    def test_record_attempt_returns_none_when_entry_expired(self):
+        self.cache = LockedAccountsCache(ttl=0.01, max_size=2, flush_interval=60)
+        self.cache.add('userid1', 10)
+        time.sleep(0.02)
+
+        assert self.cache.record_attempt('userid1') is None
+
+    def test_get_failed_logins_includes_attempts_not_yet_written(self):
+        self.cache.add('userid1', 10)
+        self.cache.record_attempt('userid1')
+
+        assert self.cache.get_failed_logins('userid1', 10) == 11
+
+    @patch('service.failed_logins_buffer.db_access')
+    def test_attempts_are_written_to_db_in_one_batch(self, mock_db_access):
+        self.cache.add('userid1', 10)
+        self.cache.record_attempt('userid1')
+        self.cache.record_attempt('userid1')
+
+        self.cache.close()
+
+        mock_db_access.apply_failed_logins_changes.assert_called_once_with({
+            'userid1': (False, 2),
+        })
+
+    def test_unlock_removes_account_and_its_unwritten_attempts(self):
+        self.cache.add('userid1', 10)
+        self.cache.record_attempt('userid1')
+
+        account_unlocks.record_unlock('userid1')
+
+        assert self.cache.record_attempt('userid1') is None
+        assert self.cache.get_failed_logins('userid1', 0) == 0
+
+    def test_add_does_not_cache_account_when_cache_full(self):
+        self.cache.add('userid1', 10)
+        self.cache.add('userid2', 10)
+        self.cache.add('userid3', 10)
+
+        assert self.cache.record_attempt('userid3') is None
@@ -0,0 +1,160 @@
+import glob
+import gzip
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+import mock
+
+from service.logging_config import (
+    BoundedQueueHandler, CompressingRotatingFileHandler, _QueuedLogger
+)
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _make_record(message, exc_info=None):
+    return logging.LogRecord('test', logging.INFO, __file__, 0, message, None, exc_info)
+
+
+def _write_rotating_log(path, name, count):
+    handler = CompressingRotatingFileHandler(path, maxBytes=500, backupCount=1000)
+    for i in range(count):
+        handler.handle(_make_record('{} {:04d}'.format(name, i)))
+    handler.close()
+
+
+def _read_rotating_log(path):
+    lines = []
+    for rotated_path in glob.glob(path + '.*.gz'):
+        with gzip.open(rotated_path, 'rt') as rotated_file:
+            lines.extend(rotated_file.read().splitlines())
+    with open(path) as log_file:
+        lines.extend(log_file.read().splitlines())
+    return lines
+
+
+class TestLoggingConfig:
+
+    def test_queue_handler_drops_records_when_queue_full_and_reports_them_later(self):
+        handler = BoundedQueueHandler(2, block=False)
+        for i in range(4):
+            handler.handle(_make_record('message{}'.format(i)))
+
+        assert [handler.queue.get_nowait().msg for _ in range(2)] == ['message0', 'message1']
+
+        handler.handle(_make_record('message4'))
+
+        assert [handler.queue.get_nowait().msg for _ in range(2)] == [
+            'Dropped 2 log records because the log queue was full', 'message4'
+        ]
+
+    def test_queue_handler_keeps_exception_info_for_real_handlers(self):
+        try:
+            raise ValueError('Test exception')
+        except ValueError:
+            exc_info = sys.exc_info()
+
+        handler = BoundedQueueHandler(10, block=True)
+        handler.handle(_make_record('message', exc_info))
+
+        assert handler.queue.get_nowait().exc_info == exc_info
+
+    def test_queued_logger_writes_records_through_original_handlers(self):
+        logger = logging.getLogger('test_queued_logger')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        list_handler = ListHandler()
+        logger.handlers = [list_handler]
+
+        queued_logger = _QueuedLogger(logger, 10, block=True)
+        assert isinstance(logger.handlers[0], BoundedQueueHandler)
+        logger.info('message %s', 1)
+        queued_logger.stop()
+
+        assert [record.getMessage() for record in list_handler.records] == ['message 1']
+        assert logger.handlers == [list_handler]
+
+    def test_rotating_handler_compresses_rotated_files(self, tmp_path):
+        path = str(tmp_path / 'audit.log')
+        handler = CompressingRotatingFileHandler(path, maxBytes=150, backupCount=2)
+        for i in range(12):
+            handler.handle(_make_record('message{:02d} {}'.format(i, 'x' * 40)))
+        handler.close()
+
+        assert sorted(os.listdir(str(tmp_path))) == [
+            'audit.log', 'audit.log.1.gz', 'audit.log.2.gz', 'audit.log.lock'
+        ]
+        with gzip.open(path + '.1.gz', 'rt') as rotated_file:
+            assert rotated_file.read() == 'message08 {0}\nmessage09 {0}\n'.format('x' * 40)
+        with open(path) as log_file:
+            assert log_file.read() == 'message10 {0}\nmessage11 {0}\n'.format('x' * 40)
+
+    def test_rotating_handler_rotates_when_max_age_period_ends(self, tmp_path):
+        path = str(tmp_path / 'audit.log')
+        handler = CompressingRotatingFileHandler(path, backupCount=2, maxAge=3600)
+        handler.handle(_make_record('message1'))
+        with mock.patch('service.logging_config.time.time', return_value=time.time() + 3600):
+            handler.handle(_make_record('message2'))
+        handler.close()
+
+        with gzip.open(path + '.1.gz', 'rt') as rotated_file:
+            assert rotated_file.read() == 'message1\n'
+        with open(path) as log_file:
+            assert log_file.read() == 'message2\n'
+
+    def test_rotating_handler_reopens_file_rotated_by_other_process(self, tmp_path):
+        path = str(tmp_path / 'audit.log')
+        handler = CompressingRotatingFileHandler(path, maxBytes=1000, backupCount=2)
+        handler.handle(_make_record('message1'))
+        os.rename(path, path + '.1')
+        handler.handle(_make_record('message2'))
+        handler.close()
+
+        with open(path) as log_file:
+            assert log_file.read() == 'message2\n'
+
+    def test_rotating_handler_keeps_records_of_processes_rotating_at_same_time(self, tmp_path):
+        path = str(tmp_path / 'audit.log')
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=_write_rotating_log, args=(path, name, 1000))
+            for name in ['first', 'second']
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        assert sorted(_read_rotating_log(path)) == sorted(
+            '{} {:04d}'.format(name, i) for name in ['first', 'second'] for i in range(1000)
+        )
+        assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(('.1', '.tmp'))]
+
+    def test_rotating_handler_moves_uncompressed_rotated_file_along(self, tmp_path):
+        path = str(tmp_path / 'audit.log')
+        handler = CompressingRotatingFileHandler(path, maxBytes=1000, backupCount=3)
+        handler.handle(_make_record('message1'))
+        # Left by another process still compressing it
+        with open(path + '.1', 'w') as rotated_file:
+            rotated_file.write('message0\n')
+        handler.doRollover()
+        handler.close()
+
+        assert sorted(os.listdir(str(tmp_path))) == [
+            'audit.log', 'audit.log.1.gz', 'audit.log.2.gz', 'audit.log.lock'
+        ]
+        with gzip.open(path + '.1.gz', 'rt') as rotated_file:
+            assert rotated_file.read() == 'message1\n'
+        with gzip.open(path + '.2.gz', 'rt') as rotated_file:
+            assert rotated_file.read() == 'message0\n'
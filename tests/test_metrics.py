@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from service import metrics
+from service.metrics import Counter, Histogram, ValuesFile
+
+# Registered like the service's metrics, so they also show up in render()
+TEST_COUNTER = Counter('test_events_total', 'Test events', ['kind'])
+TEST_HISTOGRAM = Histogram(
+    'test_duration_seconds', 'Test durations', ['function'], buckets=(0.1, 1)
+)
+
+
+def _count_event_in_child_process():
+    process = multiprocessing.get_context('fork').Process(target=TEST_COUNTER.inc, args=('a',))
+    process.start()
+    process.join()
+
+
+class TestMetrics:
+
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.patcher = patch.dict('config.CONFIG_DICT', {'METRICS_DIR': self.directory})
+        self.patcher.start()
+
+    def teardown_method(self, method):
+        self.patcher.stop()
+        shutil.rmtree(self.directory)
+
+    def test_render_adds_up_values_of_all_processes(self):
+        TEST_COUNTER.inc('a')
+        TEST_COUNTER.inc('b')
+        _count_event_in_child_process()
+
+        lines = metrics.render().splitlines()
+
+        assert len(os.listdir(self.directory)) == 2
+        assert '# TYPE test_events_total counter' in lines
+        assert 'test_events_total{kind="a"} 2.0' in lines
+        assert 'test_events_total{kind="b"} 1.0' in lines
+
+    def test_render_returns_cumulative_histogram_buckets(self):
+        for value in [0.05, 0.5, 0.5, 5]:
+            TEST_HISTOGRAM.observe(value, 'fn')
+
+        lines = metrics.render().splitlines()
+
+        assert lines[lines.index('# TYPE test_duration_seconds histogram') + 1:][:5] == [
+            'test_duration_seconds_bucket{function="fn",le="0.1"} 1.0',
+            'test_duration_seconds_bucket{function="fn",le="1.0"} 3.0',
+            'test_duration_seconds_bucket{function="fn",le="+Inf"} 4.0',
+            'test_duration_seconds_sum{function="fn"} 6.05',
+            'test_duration_seconds_count{function="fn"} 4.0',
+        ]
+
+    def test_timed_records_duration_labelled_with_function_name(self):
+        @metrics.timed(TEST_HISTOGRAM)
+        def timed_function():
+            return 'result'
+
+        assert timed_function() == 'result'
+        assert 'test_duration_seconds_count{function="timed_function"} 1.0' in (
+            metrics.render().splitlines()
+        )
+
+    def test_values_file_keeps_values_of_earlier_process_with_same_path(self):
+        path = os.path.join(self.directory, 'metrics_test')
+        values_file = ValuesFile(path)
+        values_file.increment('key1', 2)
+        values_file.close()
+
+        values_file = ValuesFile(path)
+        values_file.increment('key1', 1)
+        for i in range(5000):
+            values_file.increment('key{}'.format(i), 1)
+        values_file.close()
+
+        with open(path, 'rb') as data:
+            values = {key: value for key, value, _ in metrics._read_entries(data.read())}
+        assert len(values) == 5000
+        assert values['key1'] == 4
+
+    def test_reset_removes_metrics_files(self):
+        TEST_COUNTER.inc('a')
+        metrics.reset()
+
+        assert os.listdir(self.directory) == []
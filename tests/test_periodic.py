@@ -0,0 +1,35 @@
+import threading
+
+from service.periodic import PeriodicThread
+
+
+class TestPeriodicThread:
+
+    def test_ensure_running_calls_function_every_interval_until_stopped(self):
+        calls = []
+        called_twice = threading.Event()
+        thread = PeriodicThread('test', 0.01)
+
+        def record_call():
+            calls.append(True)
+            if len(calls) == 2:
+                called_twice.set()
+                thread.stop()
+
+        thread.ensure_running(record_call)
+        thread.ensure_running(record_call)
+
+        assert called_twice.wait(5)
+        thread._thread.join(5)
+        assert len(calls) == 2
+
+    def test_ensure_running_waits_first_interval_when_asked(self):
+        calls = []
+        thread = PeriodicThread('test', 60, wait_first=True)
+
+        thread.ensure_running(lambda: calls.append(True))
+        thread.stop()
+        thread._thread.join(5)
+
+        assert calls == []
+        assert not thread._thread.is_alive()
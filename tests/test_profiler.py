@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import pytest
+
+from service.profiler import ProfilerRunningError, SamplingProfiler
+
+
+def _busy_function(stop_event):
+    while not stop_event.is_set():
+        stop_event.wait(0.001)
+
+
+class TestSamplingProfiler:
+
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.profiler = SamplingProfiler(self.directory, 0.001)
+
+    def teardown_method(self, method):
+        self.profiler.stop()
+        shutil.rmtree(self.directory)
+
+    def test_profile_contains_collapsed_stacks_of_other_threads(self):
+        stop_event = threading.Event()
+        thread = threading.Thread(target=_busy_function, args=(stop_event,), name='busy-thread')
+        thread.start()
+        try:
+            output_path = self.profiler.start(0.2)
+            self.profiler.stop()
+        finally:
+            stop_event.set()
+            thread.join()
+
+        with open(output_path) as output_file:
+            lines = output_file.read().splitlines()
+        busy_lines = [line for line in lines if line.startswith('busy-thread;')]
+        assert busy_lines
+        stack, count = busy_lines[0].rsplit(' ', 1)
+        assert '_busy_function (test_profiler.py:' in stack
+        assert int(count) > 0
+        assert not any('sampling-profiler' in line for line in lines)
+
+    def test_start_raises_error_when_already_recording(self):
+        self.profiler.start(10)
+
+        with pytest.raises(ProfilerRunningError):
+            self.profiler.start(10)
+
+    def test_stop_writes_profile_sampled_so_far_and_allows_new_profile(self):
+        output_path = self.profiler.start(10)
+        self.profiler.stop()
+
+        assert os.path.exists(output_path)
+        self.profiler.start(10)
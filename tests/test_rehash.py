@@ -0,0 +1,109 @@
+import json
+
+from mock import patch
+
+from service import rehash, security
+
+PBKDF2_PARAMS = {'i': 1000}
+CONFIG = {'PASSWORD_HASH_ALGORITHM': 'pbkdf2-sha256', 'PASSWORD_HASH_PBKDF2_ITERATIONS': 1000}
+
+
+class FakeUsers(object):
+    # Stands in for the users table in db_access
+    MAX_PASSWORD_HASH_LENGTH = 255
+
+    def __init__(self, password_hashes):
+        self.password_hashes = password_hashes
+        self.updates = []
+
+    def get_password_hashes(self, after_user_id, limit):
+        user_ids = sorted(user_id for user_id in self.password_hashes if user_id > after_user_id)
+        return [(user_id, self.password_hashes[user_id]) for user_id in user_ids[:limit]]
+
+    def update_password_hashes(self, changes):
+        self.updates.append(changes)
+        for user_id, _, new_password_hash in changes:
+            self.password_hashes[user_id] = new_password_hash
+        return {user_id for user_id, _, _ in changes}
+
+
+@patch.dict('config.CONFIG_DICT', CONFIG)
+class TestRehash:
+
+    def setup_method(self, method):
+        self.users = FakeUsers({
+            'userid1': security.get_user_password_hash('userid1', 'password1', 'salt'),
+            'userid2': security.hash_password(
+                'userid2', 'password2', 'pbkdf2-sha256', PBKDF2_PARAMS
+            ),
+            'userid3': security.hash_password('userid3', 'password3', 'scrypt', {
+                'n': 1024, 'r': 8, 'p': 1
+            }),
+            'userid4': None,
+        })
+        self.patcher = patch('service.rehash.db_access', self.users)
+        self.patcher.start()
+
+    def teardown_method(self, method):
+        self.patcher.stop()
+
+    def test_rehash_users_wraps_outdated_hashes_in_batches(self):
+        progress = list(rehash.rehash_users(batch_size=2, processes=2))
+
+        assert [(p.examined, p.rewrapped, p.too_long, p.last_user_id) for p in progress] == [
+            (2, 1, 0, 'userid2'), (4, 2, 0, 'userid4')
+        ]
+        assert [[user_id for user_id, _, _ in changes] for changes in self.users.updates] == [
+            ['userid1'], ['userid3']
+        ]
+        for i in range(1, 4):
+            password_hash = self.users.password_hashes['userid{}'.format(i)]
+            assert not security.needs_wrapping(password_hash, 'pbkdf2-sha256', PBKDF2_PARAMS)
+            assert security.verify_password(
+                'userid{}'.format(i), 'password{}'.format(i), password_hash, 'salt'
+            )
+
+    def test_rehash_users_resumes_after_checkpoint(self, tmpdir):
+        checkpoint_path = str(tmpdir.join('checkpoint.json'))
+        with open(checkpoint_path, 'w') as checkpoint_file:
+            json.dump({
+                'examined': 2, 'rewrapped': 1, 'too_long': 0, 'last_user_id': 'userid2'
+            }, checkpoint_file)
+
+        progress = list(rehash.rehash_users(checkpoint_path, batch_size=2, processes=1))
+
+        assert [(p.examined, p.rewrapped, p.too_long, p.last_user_id) for p in progress] == [
+            (4, 2, 0, 'userid4')
+        ]
+        assert not security.needs_wrapping(
+            self.users.password_hashes['userid3'], 'pbkdf2-sha256', PBKDF2_PARAMS
+        )
+        assert security.needs_wrapping(
+            self.users.password_hashes['userid1'], 'pbkdf2-sha256', PBKDF2_PARAMS
+        )
+        with open(checkpoint_path) as checkpoint_file:
+            assert json.load(checkpoint_file) == {
+                'examined': 4, 'rewrapped': 2, 'too_long': 0, 'last_user_id': 'userid4'
+            }
+
+    def test_rehash_users_skips_hashes_too_long_to_wrap(self):
+        password_hash = self.users.password_hashes['userid2']
+        while len(security.wrap_password_hash(
+                password_hash, 'pbkdf2-sha256', PBKDF2_PARAMS)) <= 255:
+            password_hash = security.wrap_password_hash(
+                password_hash, 'pbkdf2-sha256', {'i': 2000}
+            )
+        self.users.password_hashes['userid2'] = password_hash
+
+        progress = list(rehash.rehash_users(batch_size=4, processes=1))
+
+        assert [(p.examined, p.rewrapped, p.too_long) for p in progress] == [(4, 2, 1)]
+        assert [user_id for user_id, _, _ in self.users.updates[0]] == ['userid1', 'userid3']
+        assert self.users.password_hashes['userid2'] == password_hash
+
+    @patch('service.rehash.time.sleep')
+    def test_rehash_users_sleeps_to_stay_under_max_rate(self, mock_sleep):
+        list(rehash.rehash_users(batch_size=2, processes=1, max_rate=1))
+
+        assert mock_sleep.call_count == 2
+        assert 1 < mock_sleep.call_args_list[0][0][0] <= 2
@@ -0,0 +1,41 @@
+import re
+
+from mock import patch
+
+from service import request_timing
+
+
+class TestRequestTiming:
+
+    def teardown_method(self, method):
+        request_timing.finish()
+
+    def test_finish_returns_duration_of_each_phase(self):
+        request_timing.start()
+        with request_timing.measure('db'):
+            pass
+
+        header = request_timing.finish()
+
+        assert re.match(
+            r'^parse;dur=0\.00, hash;dur=0\.00, db;dur=\d+\.\d\d, serialise;dur=0\.00, '
+            r'app;dur=\d+\.\d\d, total;dur=\d+\.\d\d$', header
+        )
+
+    @patch('service.request_timing.time.monotonic', side_effect=[0.0, 1.0, 4.0, 5.0])
+    def test_measure_counts_nested_blocks_of_same_phase_once(self, mock_monotonic):
+        request_timing.start()
+        with request_timing.measure('db'):
+            with request_timing.measure('db'):
+                pass
+
+        assert request_timing.finish() == (
+            'parse;dur=0.00, hash;dur=0.00, db;dur=3000.00, serialise;dur=0.00, app;dur=2000.00, '
+            'total;dur=5000.00'
+        )
+
+    def test_finish_returns_none_when_no_request_started(self):
+        with request_timing.measure('hash'):
+            pass
+
+        assert request_timing.finish() is None
@@ -1,6 +1,9 @@
 import pytest
 from service import security
 
+PBKDF2_PARAMS = {'i': 1000}
+SCRYPT_PARAMS = {'n': 1024, 'r': 8, 'p': 1}
+
 
 class TestSecurity:
 
@@ -23,3 +26,76 @@ class TestSecurity:
         hash1 = security.get_user_password_hash('user1', 'password1', 'salt1')
         hash2 = security.get_user_password_hash('user1', 'password2', 'salt1')
         assert hash1 != hash2
+
+    def test_hash_password_returns_self_describing_hash(self):
+        password_hash = security.hash_password('user1', 'password1', 'pbkdf2-sha256', PBKDF2_PARAMS)
+        assert password_hash.startswith('$pbkdf2-sha256$i=1000$')
+
+    def test_hash_password_returns_different_hashes_for_same_data(self):
+        hash1 = security.hash_password('user1', 'password1', 'scrypt', SCRYPT_PARAMS)
+        hash2 = security.hash_password('user1', 'password1', 'scrypt', SCRYPT_PARAMS)
+        assert hash1 != hash2
+
+    @pytest.mark.parametrize('algorithm,params', [
+        ('pbkdf2-sha256', PBKDF2_PARAMS),
+        ('scrypt', SCRYPT_PARAMS),
+    ])
+    def test_verify_password_accepts_only_the_right_password(self, algorithm, params):
+        password_hash = security.hash_password('user1', 'password1', algorithm, params)
+
+        assert security.verify_password('user1', 'password1', password_hash, 'salt1') is True
+        assert security.verify_password('user1', 'password2', password_hash, 'salt1') is False
+        assert security.verify_password('user2', 'password1', password_hash, 'salt1') is False
+
+    def test_verify_password_accepts_legacy_hash(self):
+        password_hash = security.get_user_password_hash('user1', 'password1', 'salt1')
+
+        assert security.verify_password('user1', 'password1', password_hash, 'salt1') is True
+        assert security.verify_password('user1', 'password2', password_hash, 'salt1') is False
+
+    def test_verify_password_rejects_missing_hash(self):
+        assert security.verify_password('user1', 'password1', None, 'salt1') is False
+
+    def test_needs_rehash_returns_true_for_legacy_hash(self):
+        password_hash = security.get_user_password_hash('user1', 'password1', 'salt1')
+        assert security.needs_rehash(password_hash, 'pbkdf2-sha256', PBKDF2_PARAMS) is True
+
+    def test_needs_rehash_returns_true_when_settings_changed(self):
+        password_hash = security.hash_password('user1', 'password1', 'pbkdf2-sha256', PBKDF2_PARAMS)
+
+        assert security.needs_rehash(password_hash, 'pbkdf2-sha256', {'i': 2000}) is True
+        assert security.needs_rehash(password_hash, 'scrypt', SCRYPT_PARAMS) is True
+
+    def test_needs_rehash_returns_false_when_settings_unchanged(self):
+        password_hash = security.hash_password('user1', 'password1', 'scrypt', SCRYPT_PARAMS)
+        assert security.needs_rehash(password_hash, 'scrypt', SCRYPT_PARAMS) is False
+
+    @pytest.mark.parametrize('password_hash', [
+        security.get_user_password_hash('user1', 'password1', 'salt1'),
+        security.hash_password('user1', 'password1', 'pbkdf2-sha256', PBKDF2_PARAMS),
+    ])
+    def test_verify_password_accepts_wrapped_hash(self, password_hash):
+        wrapped_hash = security.wrap_password_hash(password_hash, 'scrypt', SCRYPT_PARAMS)
+        wrapped_twice = security.wrap_password_hash(wrapped_hash, 'pbkdf2-sha256', {'i': 2000})
+
+        for password_hash in [wrapped_hash, wrapped_twice]:
+            assert security.verify_password('user1', 'password1', password_hash, 'salt1') is True
+            assert security.verify_password('user1', 'password2', password_hash, 'salt1') is False
+
+    def test_wrap_password_hash_records_legacy_inner_hash(self):
+        password_hash = security.get_user_password_hash('user1', 'password1', 'salt1')
+        wrapped_hash = security.wrap_password_hash(password_hash, 'pbkdf2-sha256', PBKDF2_PARAMS)
+        assert wrapped_hash.startswith('$legacy$pbkdf2-sha256$i=1000$')
+
+    def test_needs_rehash_returns_true_for_wrapped_hash(self):
+        password_hash = security.hash_password('user1', 'password1', 'scrypt', SCRYPT_PARAMS)
+        wrapped_hash = security.wrap_password_hash(password_hash, 'pbkdf2-sha256', PBKDF2_PARAMS)
+        assert security.needs_rehash(wrapped_hash, 'pbkdf2-sha256', PBKDF2_PARAMS) is True
+
+    def test_needs_wrapping_checks_settings_of_outermost_layer(self):
+        password_hash = security.hash_password('user1', 'password1', 'scrypt', SCRYPT_PARAMS)
+        wrapped_hash = security.wrap_password_hash(password_hash, 'pbkdf2-sha256', PBKDF2_PARAMS)
+
+        assert security.needs_wrapping(password_hash, 'pbkdf2-sha256', PBKDF2_PARAMS) is True
+        assert security.needs_wrapping(wrapped_hash, 'pbkdf2-sha256', PBKDF2_PARAMS) is False
+        assert security.needs_wrapping(wrapped_hash, 'scrypt', SCRYPT_PARAMS) is True
@@ -1,23 +1,39 @@
-from collections import namedtuple
+import io
 import json
+import tempfile
+import time
 from mock import MagicMock, call, patch
+import pytest
 
-from service import server
-from service.security import get_user_password_hash
+from service import hashing, server
+from service.hashing import HashingQueueFullError
+from service.health import ProbeResult
+from service.security import get_user_password_hash, hash_password, verify_password
 from service.server import app
 
 
 AUTHENTICATE_ROUTE = '/user/authenticate'
 CREATE_USER_ROUTE = '/admin/user'
+CREATE_USERS_ROUTE = '/admin/users/bulk'
 UPDATE_USER_ROUTE_FORMAT = '/admin/user/{}/update'
 DELETE_USER_ROUTE_FORMAT = '/admin/user/{}'
 UNLOCK_ACCOUNT_ROUTE_FORMAT = 'admin/user/{}/unlock-account'
 GET_FAILED_LOGINS_ROUTE_FORMAT = 'admin/user/{}/get-failed-logins'
+UNLOCK_ACCOUNTS_ROUTE = '/admin/users/unlock-accounts'
+DELETE_USERS_ROUTE = '/admin/users/delete'
+EXPORT_USERS_ROUTE = '/admin/users/export'
+LOCKED_USERS_ROUTE = '/admin/users/locked'
 HEALTH_ROUTE = '/health'
+LIVENESS_ROUTE = '/health/live'
+READINESS_ROUTE = '/health/ready'
+METRICS_ROUTE = '/metrics'
+PROFILE_ROUTE = '/admin/profile'
 
 JSON_CONTENT_TYPE_HEADER = {"Content-type": "application/json"}
+NDJSON_CONTENT_TYPE_HEADER = {"Content-type": "application/x-ndjson"}
 
 INTERNAL_SERVER_ERROR_RESPONSE_BODY = '{"error": "Internal server error"}'
+SERVICE_BUSY_RESPONSE_BODY = '{"error": "Service busy"}'
 INVALID_REQUEST_RESPONSE_BODY = '{"error": "Invalid request"}'
 UPDATED_USER_RESPONSE_BODY = '{"updated": true}'
 DELETED_USER_RESPONSE_BODY = '{"deleted": true}'
@@ -28,7 +44,9 @@ USER_NOT_FOUND_RESPONSE_BODY = '{"error": "User not found"}'
 GET_FAILED_LOGINS_RESPONSE_BODY_FORMAT = '{{"failed_login_attempts": {}}}'
 UNLOCK_ACCOUNT_RESPONSE_BODY = '{"reset": true}'
 
-FakeUser = namedtuple('User', ['user_id', 'password_hash', 'failed_logins'])
+
+def _current_password_hash(user_id, password):
+    return hash_password(user_id, password, *hashing.get_hash_settings())
 
 
 class TestServer:
@@ -135,9 +153,7 @@ class TestServer:
         }'''
 
         mock_db_access = MagicMock()
-        mock_db_access.get_user = lambda self, *args, **kwargs: None
-        mock_db_access.get_failed_logins = lambda self, *args, **kwargs: None
-        mock_db_access.update_failed_logins = lambda self, *args, **kwargs: 1
+        mock_db_access.get_user_credentials.return_value = None
         server.db_access = mock_db_access
 
         response = self.app.post(
@@ -154,9 +170,28 @@ class TestServer:
         }'''
 
         mock_db_access = MagicMock()
-        mock_db_access.get_user = FakeUser('user_id', 'passwordhash', 20)
-        mock_db_access.get_failed_logins = lambda self, *args, **kwargs: 20
-        mock_db_access.update_failed_logins = lambda self, *args, **kwargs: 1
+        mock_db_access.get_user_credentials.return_value = ('passwordhash', 20)
+        mock_db_access.record_login_attempt.return_value = 21
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            AUTHENTICATE_ROUTE,
+            data=body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+        assert response.status_code == 401
+        assert response.data.decode() == INVALID_CREDENTIALS_RESPONSE_BODY
+
+    def test_authenticate_user_returns_401_when_password_is_wrong(self):
+        body = '''{
+            "credentials": {"user_id": "userid", "password": "somepassword"}
+        }'''
+
+        mock_db_access = MagicMock()
+        mock_db_access.get_user_credentials.return_value = (
+            _current_password_hash('userid', 'otherpassword'), 0
+        )
+        mock_db_access.record_login_attempt.return_value = 1
         server.db_access = mock_db_access
 
         response = self.app.post(
@@ -172,11 +207,11 @@ class TestServer:
             "credentials": {"user_id": "userid1", "password": "somepassword"}
         }'''
 
-        def failing_get_user(s, *args, **kwargs):
+        def failing_get_user_credentials(*args, **kwargs):
             raise Exception('Intentional test exception')
 
         mock_db_access = MagicMock()
-        mock_db_access.get_user = failing_get_user
+        mock_db_access.get_user_credentials = failing_get_user_credentials
         server.db_access = mock_db_access
 
         response = self.app.post(
@@ -187,36 +222,81 @@ class TestServer:
         assert response.status_code == 500
         assert response.data.decode() == INTERNAL_SERVER_ERROR_RESPONSE_BODY
 
-    def test_authenticate_user_calls_db_access_to_find_user(self):
+    def test_authenticate_user_records_failed_login_when_password_is_wrong(self):
+        user_id = 'userid1'
+        body_format = '{"credentials": {"user_id": "%s", "password": "%s"}}'
+        valid_body = body_format % (user_id, 'wrongpassword')
+
+        mock_db_access = MagicMock()
+        mock_db_access.get_user_credentials.return_value = (
+            _current_password_hash(user_id, 'somepassword'), 0
+        )
+        mock_db_access.record_login_attempt.return_value = 1
+        server.db_access = mock_db_access
+
+        self.app.post(
+            AUTHENTICATE_ROUTE,
+            data=valid_body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        mock_db_access.get_user_credentials.assert_called_once_with(user_id)
+        mock_db_access.record_login_attempt.assert_called_once_with(
+            user_id,
+            False,
+            server.MAX_LOGIN_ATTEMPTS
+        )
+
+    def test_authenticate_user_resets_failed_logins_when_credentials_are_valid(self):
         user_id = 'userid1'
         password = 'somepassword'
         body_format = '{"credentials": {"user_id": "%s", "password": "%s"}}'
         valid_body = body_format % (user_id, password)
 
         mock_db_access = MagicMock()
-        mock_db_access.get_user.return_value = FakeUser(
-            user_id,
-            'passwordhash',
-            0
+        mock_db_access.get_user_credentials.return_value = (
+            _current_password_hash(user_id, password), 3
         )
-        mock_db_access.get_failed_logins = lambda self, *args, **kwargs: 0
-        mock_db_access.update_failed_logins = lambda self, *args, **kwargs: 1
+        mock_db_access.record_login_attempt.return_value = 0
         server.db_access = mock_db_access
 
-        self.app.post(
+        response = self.app.post(
             AUTHENTICATE_ROUTE,
             data=valid_body,
             headers=JSON_CONTENT_TYPE_HEADER
         )
 
-        expected_password_hash_to_pass = get_user_password_hash(
+        assert response.status_code == 200
+        mock_db_access.record_login_attempt.assert_called_once_with(
             user_id,
-            password,
-            app.config['PASSWORD_SALT']
+            True,
+            server.MAX_LOGIN_ATTEMPTS
+        )
+
+    def test_authenticate_user_does_not_check_password_when_account_locked(self):
+        user_id = 'userid1'
+        password = 'somepassword'
+        body_format = '{"credentials": {"user_id": "%s", "password": "%s"}}'
+        valid_body = body_format % (user_id, password)
+
+        mock_db_access = MagicMock()
+        mock_db_access.get_user_credentials.return_value = (
+            _current_password_hash(user_id, password), server.MAX_LOGIN_ATTEMPTS
+        )
+        mock_db_access.record_login_attempt.return_value = server.MAX_LOGIN_ATTEMPTS + 1
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            AUTHENTICATE_ROUTE,
+            data=valid_body,
+            headers=JSON_CONTENT_TYPE_HEADER
         )
-        mock_db_access.get_user.assert_called_once_with(
+
+        assert response.status_code == 401
+        mock_db_access.record_login_attempt.assert_called_once_with(
             user_id,
-            expected_password_hash_to_pass
+            False,
+            server.MAX_LOGIN_ATTEMPTS
         )
 
     def test_authenticate_user_returns_200_when_credentials_are_valid(self):
@@ -225,13 +305,9 @@ class TestServer:
         }'''
 
         mock_db_access = MagicMock()
-        mock_db_access.get_user.return_value = FakeUser(
-            'userid1',
-            'passwordhash',
-            0
+        mock_db_access.get_user_credentials.return_value = (
+            _current_password_hash('userid1', 'somepassword'), 0
         )
-        mock_db_access.get_failed_logins = lambda self, *args, **kwargs: 0
-        mock_db_access.update_failed_logins = lambda self, *args, **kwargs: 1
         server.db_access = mock_db_access
 
         response = self.app.post(
@@ -241,6 +317,175 @@ class TestServer:
         )
         assert response.status_code == 200
         assert response.data.decode() == '{"user": {"user_id": "userid1"}}'
+        assert mock_db_access.record_login_attempt.mock_calls == []
+        assert mock_db_access.update_password_hashes.mock_calls == []
+
+    def test_authenticate_user_upgrades_legacy_password_hash_when_credentials_are_valid(self):
+        user_id = 'userid1'
+        password = 'somepassword'
+        body_format = '{"credentials": {"user_id": "%s", "password": "%s"}}'
+        valid_body = body_format % (user_id, password)
+
+        legacy_password_hash = get_user_password_hash(
+            user_id, password, app.config['PASSWORD_SALT']
+        )
+        mock_db_access = MagicMock()
+        mock_db_access.get_user_credentials.return_value = (legacy_password_hash, 0)
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            AUTHENTICATE_ROUTE,
+            data=valid_body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 200
+        assert mock_db_access.update_user.mock_calls == []
+        [(changes,), _] = mock_db_access.update_password_hashes.call_args
+        [(changed_user_id, old_password_hash, new_password_hash)] = changes
+        assert (changed_user_id, old_password_hash) == (user_id, legacy_password_hash)
+        assert new_password_hash.startswith('$')
+        assert verify_password(user_id, password, new_password_hash, None)
+
+    @patch('service.server.hashing.hash_password',
+           side_effect=HashingQueueFullError('Test exception'))
+    def test_authenticate_user_returns_200_when_hashing_queue_full_for_upgrade(
+            self, mock_hash_password):
+        valid_body = '{"credentials": {"user_id": "userid1", "password": "somepassword"}}'
+        legacy_password_hash = get_user_password_hash(
+            'userid1', 'somepassword', app.config['PASSWORD_SALT']
+        )
+        mock_db_access = MagicMock()
+        mock_db_access.get_user_credentials.return_value = (legacy_password_hash, 0)
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            AUTHENTICATE_ROUTE,
+            data=valid_body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 200
+        assert mock_hash_password.call_count == 1
+        assert mock_db_access.update_password_hashes.mock_calls == []
+
+    def test_authenticate_user_returns_200_when_password_hash_upgrade_fails(self):
+        valid_body = '{"credentials": {"user_id": "userid1", "password": "somepassword"}}'
+        legacy_password_hash = get_user_password_hash(
+            'userid1', 'somepassword', app.config['PASSWORD_SALT']
+        )
+        mock_db_access = MagicMock()
+        mock_db_access.get_user_credentials.return_value = (legacy_password_hash, 0)
+        mock_db_access.update_password_hashes.side_effect = Exception('Test exception')
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            AUTHENTICATE_ROUTE,
+            data=valid_body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 200
+        assert response.data.decode() == '{"user": {"user_id": "userid1"}}'
+
+    @patch('service.server.hashing.verify_password',
+           side_effect=HashingQueueFullError('Test exception'))
+    def test_authenticate_user_returns_503_when_hashing_queue_full(self, mock_verify_password):
+        valid_body = '''{
+            "credentials": {"user_id": "userid1", "password": "somepassword"}
+        }'''
+
+        mock_db_access = MagicMock()
+        mock_db_access.get_user_credentials.return_value = ('passwordhash', 0)
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            AUTHENTICATE_ROUTE,
+            data=valid_body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert response.data.decode() == SERVICE_BUSY_RESPONSE_BODY
+
+    @patch.dict('config.CONFIG_DICT', {'FAILED_LOGINS_FLUSH_INTERVAL': 60})
+    @patch('service.server.failed_logins_buffer.get_buffer')
+    def test_authenticate_user_buffers_failed_login_count_when_write_behind_enabled(
+            self, mock_get_buffer):
+        valid_body = '''{
+            "credentials": {"user_id": "userid1", "password": "somepassword"}
+        }'''
+
+        mock_db_access = MagicMock()
+        mock_db_access.get_user_credentials.return_value = (
+            _current_password_hash('userid1', 'otherpassword'), 2
+        )
+        server.db_access = mock_db_access
+        mock_get_buffer.return_value.get_failed_logins.return_value = 2
+        mock_get_buffer.return_value.record_login_attempt.return_value = 3
+
+        response = self.app.post(
+            AUTHENTICATE_ROUTE,
+            data=valid_body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 401
+        mock_get_buffer.return_value.record_login_attempt.assert_called_once_with(
+            'userid1', 2, False, server.MAX_LOGIN_ATTEMPTS
+        )
+        assert mock_db_access.record_login_attempt.mock_calls == []
+
+    @patch('service.server.user_id_filter.might_exist', return_value=False)
+    def test_authenticate_user_returns_401_without_db_access_when_filter_rules_user_out(
+            self, mock_might_exist):
+        body = '''{
+            "credentials": {"user_id": "userid", "password": "somepassword"}
+        }'''
+
+        response = self.app.post(
+            AUTHENTICATE_ROUTE,
+            data=body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 401
+        assert response.data.decode() == INVALID_CREDENTIALS_RESPONSE_BODY
+        assert server.db_access.get_user_credentials.mock_calls == []
+
+    @patch('service.server.locked_accounts.record_attempt', return_value=15)
+    def test_authenticate_user_returns_401_without_db_access_when_account_known_locked(
+            self, mock_record_attempt):
+        body = '''{
+            "credentials": {"user_id": "userid", "password": "somepassword"}
+        }'''
+
+        response = self.app.post(
+            AUTHENTICATE_ROUTE,
+            data=body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 401
+        assert response.data.decode() == INVALID_CREDENTIALS_RESPONSE_BODY
+        assert server.db_access.get_user_credentials.mock_calls == []
+
+    @patch('service.server.locked_accounts.add')
+    def test_authenticate_user_caches_account_when_it_gets_locked(self, mock_add):
+        body = '''{
+            "credentials": {"user_id": "userid", "password": "somepassword"}
+        }'''
+
+        mock_db_access = MagicMock()
+        mock_db_access.get_user_credentials.return_value = (
+            'passwordhash', server.MAX_LOGIN_ATTEMPTS - 1
+        )
+        mock_db_access.record_login_attempt.return_value = server.MAX_LOGIN_ATTEMPTS
+        server.db_access = mock_db_access
+
+        self.app.post(AUTHENTICATE_ROUTE, data=body, headers=JSON_CONTENT_TYPE_HEADER)
+
+        mock_add.assert_called_once_with('userid', server.MAX_LOGIN_ATTEMPTS)
 
     def test_create_user_returns_400_response_when_empty_body(self):
         response = self.app.post(CREATE_USER_ROUTE)
@@ -330,6 +575,7 @@ class TestServer:
         valid_body = valid_body_format % (user_id, password)
 
         mock_db_access = MagicMock()
+        mock_db_access.user_exists.return_value = False
         mock_db_access.create_user.return_value = True
         server.db_access = mock_db_access
 
@@ -339,22 +585,35 @@ class TestServer:
             headers=JSON_CONTENT_TYPE_HEADER
         )
 
-        expected_password_hash_to_pass = get_user_password_hash(
-            user_id,
-            password,
-            app.config['PASSWORD_SALT']
-        )
-        mock_db_access.create_user.assert_called_once_with(
-            user_id,
-            expected_password_hash_to_pass
+        assert mock_db_access.create_user.call_count == 1
+        passed_user_id, passed_password_hash = mock_db_access.create_user.call_args[0]
+        assert passed_user_id == user_id
+        assert verify_password(user_id, password, passed_password_hash, None)
+
+    @patch('service.server.user_id_filter.add')
+    def test_create_user_adds_user_to_user_id_filter(self, mock_add):
+        valid_body = '{"user": {"user_id": "userid1", "password": "somepassword"}}'
+
+        mock_db_access = MagicMock()
+        mock_db_access.user_exists.return_value = False
+        mock_db_access.create_user.return_value = True
+        server.db_access = mock_db_access
+
+        self.app.post(
+            CREATE_USER_ROUTE,
+            data=valid_body,
+            headers=JSON_CONTENT_TYPE_HEADER
         )
 
+        mock_add.assert_called_once_with('userid1')
+
     def test_create_user_returns_409_response_when_user_already_exists(self):
         valid_body = '''{"user": {
             "user_id": "userid1", "password": "somepassword"
         }}'''
 
         mock_db_access = MagicMock()
+        mock_db_access.user_exists.return_value = False
         mock_db_access.create_user.return_value = False
         server.db_access = mock_db_access
 
@@ -367,12 +626,34 @@ class TestServer:
         assert response.status_code == 409
         assert response.data.decode() == USER_ALREADY_EXISTS_RESPONSE_BODY
 
+    @patch('service.server.hashing.hash_password')
+    def test_create_user_returns_409_without_hashing_when_user_known_to_exist(
+            self, mock_hash_password):
+        valid_body = '{"user": {"user_id": "userid1", "password": "somepassword"}}'
+
+        mock_db_access = MagicMock()
+        mock_db_access.user_exists.return_value = True
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            CREATE_USER_ROUTE,
+            data=valid_body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 409
+        assert response.data.decode() == USER_ALREADY_EXISTS_RESPONSE_BODY
+        mock_db_access.user_exists.assert_called_once_with('userid1')
+        assert mock_hash_password.mock_calls == []
+        assert mock_db_access.create_user.mock_calls == []
+
     def test_create_user_returns_200_when_user_creation_successful(self):
         valid_body = '''{"user": {
             "user_id": "userid1", "password": "somepassword"
         }}'''
 
         mock_db_access = MagicMock()
+        mock_db_access.user_exists.return_value = False
         mock_db_access.create_user.return_value = True
         server.db_access = mock_db_access
 
@@ -395,6 +676,7 @@ class TestServer:
             raise Exception('Intentional test exception')
 
         mock_db_access = MagicMock()
+        mock_db_access.user_exists.return_value = False
         mock_db_access.create_user = failing_create_user
         server.db_access = mock_db_access
 
@@ -407,6 +689,123 @@ class TestServer:
         assert response.status_code == 500
         assert response.data.decode() == INTERNAL_SERVER_ERROR_RESPONSE_BODY
 
+    def test_create_users_streams_one_result_per_line(self):
+        body = '\n'.join([
+            '{"user": {"user_id": "userid1", "password": "password1"}}',
+            '{"user": {"user_id": "userid2", "password": "password2"}}',
+            'Not JSON',
+            '',
+            '{"user": {"user_id": "userid1", "password": "password3"}}',
+            '{"user": {"user_id": "userid3"}}',
+        ])
+
+        mock_db_access = MagicMock()
+        mock_db_access.create_users.return_value = {'userid1'}
+        server.db_access = mock_db_access
+
+        response = self.app.post(CREATE_USERS_ROUTE, data=body, headers=NDJSON_CONTENT_TYPE_HEADER)
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        assert [json.loads(line) for line in response.data.decode().splitlines()] == [
+            {'user_id': 'userid1', 'created': True},
+            {'user_id': 'userid2', 'error': 'User already exists'},
+            {'line': 3, 'error': 'Invalid request'},
+            {'user_id': 'userid1', 'error': 'User already exists'},
+            {'line': 6, 'error': 'Invalid request'},
+        ]
+
+    def test_create_users_reports_malformed_lines_and_creates_the_others(self):
+        body = '\n'.join([
+            '{"user": {"user_id": "userid1", "password": "password1"}}',
+            '{"user": "bob"}',
+            '{"user": {"user_id": 2, "password": "password2"}}',
+            '{"user": {"user_id": "userid3", "password": ["password3"]}}',
+            '["user"]',
+            '{"user": {"user_id": "userid4", "password": "password4"}}',
+        ])
+
+        mock_db_access = MagicMock()
+        mock_db_access.create_users.side_effect = lambda users: {user_id for user_id, _ in users}
+        server.db_access = mock_db_access
+
+        response = self.app.post(CREATE_USERS_ROUTE, data=body, headers=NDJSON_CONTENT_TYPE_HEADER)
+
+        assert response.status_code == 200
+        assert [json.loads(line) for line in response.data.decode().splitlines()] == [
+            {'user_id': 'userid1', 'created': True},
+            {'line': 2, 'error': 'Invalid request'},
+            {'line': 3, 'error': 'Invalid request'},
+            {'line': 4, 'error': 'Invalid request'},
+            {'line': 5, 'error': 'Invalid request'},
+            {'user_id': 'userid4', 'created': True},
+        ]
+
+    def test_create_users_inserts_hashed_passwords_in_batches(self):
+        body = '\n'.join(
+            '{{"user": {{"user_id": "userid{0}", "password": "password{0}"}}}}'.format(i)
+            for i in range(5)
+        )
+
+        mock_db_access = MagicMock()
+        mock_db_access.create_users.side_effect = lambda users: {user_id for user_id, _ in users}
+        server.db_access = mock_db_access
+
+        with patch('service.server.BULK_CREATE_BATCH_SIZE', 2):
+            response = self.app.post(
+                CREATE_USERS_ROUTE, data=body, headers=NDJSON_CONTENT_TYPE_HEADER
+            )
+            # The response body is generated as it's read
+            assert len(response.data.decode().splitlines()) == 5
+
+        batches = [args[0] for args, _ in mock_db_access.create_users.call_args_list]
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        user_id, password_hash = batches[0][0]
+        assert verify_password(user_id, 'password0', password_hash, None)
+
+    def test_create_users_reads_chunked_body_ended_by_server(self):
+        mock_db_access = MagicMock()
+        mock_db_access.create_users.return_value = {'userid1'}
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            CREATE_USERS_ROUTE,
+            input_stream=io.BytesIO(b'{"user": {"user_id": "userid1", "password": "password1"}}'),
+            headers=NDJSON_CONTENT_TYPE_HEADER,
+            # Chunked, so without a Content-Length
+            environ_overrides={'CONTENT_LENGTH': '', 'wsgi.input_terminated': True}
+        )
+
+        assert response.status_code == 200
+        assert json.loads(response.data.decode()) == {'user_id': 'userid1', 'created': True}
+
+    def test_create_users_returns_411_when_end_of_body_unknown(self):
+        mock_db_access = MagicMock()
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            CREATE_USERS_ROUTE,
+            input_stream=io.BytesIO(b'{"user": {"user_id": "userid1", "password": "password1"}}'),
+            headers=NDJSON_CONTENT_TYPE_HEADER,
+            environ_overrides={'CONTENT_LENGTH': ''}
+        )
+
+        assert response.status_code == 411
+        assert mock_db_access.create_users.mock_calls == []
+
+    def test_create_users_reports_error_in_body_when_db_access_fails(self):
+        mock_db_access = MagicMock()
+        mock_db_access.create_users.side_effect = Exception('Intentional test exception')
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            CREATE_USERS_ROUTE,
+            data='{"user": {"user_id": "userid1", "password": "password1"}}',
+            headers=NDJSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.data.decode() == INTERNAL_SERVER_ERROR_RESPONSE_BODY + '\n'
+
     def test_update_user_returns_400_response_when_empty_body(self):
         response = self.app.post(
             UPDATE_USER_ROUTE_FORMAT.format("userid"),
@@ -486,15 +885,10 @@ class TestServer:
             headers=JSON_CONTENT_TYPE_HEADER
         )
 
-        expected_password_hash_to_pass = get_user_password_hash(
-            user_id,
-            password,
-            app.config['PASSWORD_SALT']
-        )
-        mock_db_access.update_user.assert_called_once_with(
-            user_id=user_id,
-            password_hash=expected_password_hash_to_pass
-        )
+        assert mock_db_access.update_user.call_count == 1
+        passed_arguments = mock_db_access.update_user.call_args[1]
+        assert passed_arguments['user_id'] == user_id
+        assert verify_password(user_id, password, passed_arguments['password_hash'], None)
 
     def test_update_user_returns_404_response_when_user_not_found(self):
         valid_body = '{"user": {"password": "somepassword"}}'
@@ -512,6 +906,48 @@ class TestServer:
         assert response.status_code == 404
         assert response.data.decode() == USER_NOT_FOUND_RESPONSE_BODY
 
+    @patch('service.server.hashing.hash_password')
+    def test_update_user_returns_404_without_hashing_when_user_does_not_exist(
+            self, mock_hash_password):
+        valid_body = '{"user": {"password": "somepassword"}}'
+
+        mock_db_access = MagicMock()
+        mock_db_access.user_exists.return_value = False
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            UPDATE_USER_ROUTE_FORMAT.format('userid1'),
+            data=valid_body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 404
+        assert response.data.decode() == USER_NOT_FOUND_RESPONSE_BODY
+        mock_db_access.user_exists.assert_called_once_with('userid1')
+        assert mock_hash_password.mock_calls == []
+        assert mock_db_access.update_user.mock_calls == []
+
+    @patch('service.server.user_id_filter.add')
+    @patch('service.server.user_id_filter.might_exist', return_value=False)
+    def test_update_user_checks_db_for_user_missing_from_user_id_filter(
+            self, mock_might_exist, mock_add):
+        valid_body = '{"user": {"password": "somepassword"}}'
+
+        mock_db_access = MagicMock()
+        mock_db_access.user_exists.return_value = True
+        mock_db_access.update_user.return_value = 1
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            UPDATE_USER_ROUTE_FORMAT.format('userid1'),
+            data=valid_body,
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 200
+        assert response.data.decode() == UPDATED_USER_RESPONSE_BODY
+        mock_add.assert_called_once_with('userid1')
+
     def test_update_user_returns_200_when_user_update_successful(self):
         valid_body = '{"user": {"password": "somepassword"}}'
 
@@ -649,6 +1085,11 @@ class TestServer:
 
         mock_db_access.update_failed_logins.assert_called_once_with(user_id, 0)
 
+    @patch('service.server.account_unlocks.record_unlock')
+    def test_unlock_account_records_unlock_for_all_workers(self, mock_record_unlock):
+        self.app.get(UNLOCK_ACCOUNT_ROUTE_FORMAT.format('userid1'))
+        mock_record_unlock.assert_called_once_with('userid1')
+
     def test_unlock_account_returns_404_response_when_user_not_found(self):
         user_id = 'userid1'
 
@@ -673,19 +1114,374 @@ class TestServer:
         assert response.status_code == 200
         assert response.data.decode() == UNLOCK_ACCOUNT_RESPONSE_BODY
 
-    @patch('service.server.db_access.get_user', return_value=None)
+    def test_get_locked_users_returns_first_page_with_next_user_id(self):
+        mock_db_access = MagicMock()
+        mock_db_access.get_locked_users.return_value = [
+            ('userid1', 10), ('userid2', 12), ('userid3', 11)
+        ]
+        server.db_access = mock_db_access
+
+        response = self.app.get(LOCKED_USERS_ROUTE + '?limit=2')
+
+        assert response.status_code == 200
+        assert json.loads(response.data.decode()) == {
+            'users': [
+                {'user_id': 'userid1', 'failed_logins': 10},
+                {'user_id': 'userid2', 'failed_logins': 12},
+            ],
+            'next': 'userid2',
+        }
+        mock_db_access.get_locked_users.assert_called_once_with(server.MAX_LOGIN_ATTEMPTS, '', 3)
+
+    def test_get_locked_users_returns_last_page_without_next_user_id(self):
+        mock_db_access = MagicMock()
+        mock_db_access.get_locked_users.return_value = [('userid3', 11)]
+        server.db_access = mock_db_access
+
+        response = self.app.get(LOCKED_USERS_ROUTE + '?after=userid2')
+
+        assert json.loads(response.data.decode()) == {
+            'users': [{'user_id': 'userid3', 'failed_logins': 11}],
+            'next': None,
+        }
+        mock_db_access.get_locked_users.assert_called_once_with(
+            server.MAX_LOGIN_ATTEMPTS, 'userid2', server.LOCKED_USERS_PAGE_SIZE + 1
+        )
+
+    def test_get_locked_users_returns_400_when_limit_invalid(self):
+        for limit in ['0', 'abc', str(server.MAX_LOCKED_USERS_PAGE_SIZE + 1)]:
+            response = self.app.get(LOCKED_USERS_ROUTE + '?limit=' + limit)
+            assert response.status_code == 400
+
+    def test_unlock_accounts_returns_outcome_for_each_user_id(self):
+        mock_db_access = MagicMock()
+        mock_db_access.unlock_accounts.return_value = ['userid1']
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            UNLOCK_ACCOUNTS_ROUTE,
+            data='{"user_ids": ["userid1", "userid2", "userid1"]}',
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 200
+        assert json.loads(response.data.decode()) == {'results': [
+            {'user_id': 'userid1', 'reset': True},
+            {'user_id': 'userid2', 'error': 'User not found'},
+        ]}
+        mock_db_access.unlock_accounts.assert_called_once_with(user_ids=['userid1', 'userid2'])
+
+    def test_unlock_accounts_runs_one_statement_per_batch(self):
+        mock_db_access = MagicMock()
+        mock_db_access.unlock_accounts.side_effect = lambda user_ids: user_ids
+        server.db_access = mock_db_access
+
+        with patch('service.server.BULK_ADMIN_BATCH_SIZE', 2):
+            self.app.post(
+                UNLOCK_ACCOUNTS_ROUTE,
+                data='{"user_ids": ["userid1", "userid2", "userid3"]}',
+                headers=JSON_CONTENT_TYPE_HEADER
+            )
+
+        assert mock_db_access.unlock_accounts.mock_calls == [
+            call(user_ids=['userid1', 'userid2']),
+            call(user_ids=['userid3']),
+        ]
+
+    @patch('service.server.account_unlocks.record_unlock')
+    def test_unlock_accounts_unlocks_users_matching_filter(self, mock_record_unlock):
+        mock_db_access = MagicMock()
+        mock_db_access.unlock_accounts.return_value = ['userid1', 'userid2']
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            UNLOCK_ACCOUNTS_ROUTE,
+            data='{"filter": {"min_failed_logins": 10}}',
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert json.loads(response.data.decode()) == {'results': [
+            {'user_id': 'userid1', 'reset': True},
+            {'user_id': 'userid2', 'reset': True},
+        ]}
+        mock_db_access.unlock_accounts.assert_called_once_with(
+            min_failed_logins=10, user_id_prefix=None, after_user_id='',
+            limit=server.BULK_ADMIN_BATCH_SIZE
+        )
+        assert mock_record_unlock.mock_calls == [call('userid1'), call('userid2')]
+
+    def test_unlock_accounts_returns_400_when_neither_user_ids_nor_filter_given(self):
+        response = self.app.post(
+            UNLOCK_ACCOUNTS_ROUTE,
+            data='{"user_ids": []}',
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 400
+        assert response.data.decode() == INVALID_REQUEST_RESPONSE_BODY
+
+    def test_delete_users_deletes_users_matching_filter(self):
+        mock_db_access = MagicMock()
+        mock_db_access.delete_users.return_value = ['test-user1']
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            DELETE_USERS_ROUTE,
+            data='{"filter": {"user_id_prefix": "test-"}}',
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 200
+        assert json.loads(response.data.decode()) == {'results': [
+            {'user_id': 'test-user1', 'deleted': True},
+        ]}
+        mock_db_access.delete_users.assert_called_once_with(
+            min_failed_logins=None, user_id_prefix='test-', after_user_id='',
+            limit=server.BULK_ADMIN_BATCH_SIZE
+        )
+
+    def test_delete_users_pages_through_users_matching_filter(self):
+        mock_db_access = MagicMock()
+        mock_db_access.delete_users.side_effect = [['test-1', 'test-2'], ['test-3']]
+        server.db_access = mock_db_access
+
+        with patch('service.server.BULK_ADMIN_BATCH_SIZE', 2):
+            response = self.app.post(
+                DELETE_USERS_ROUTE,
+                data='{"filter": {"user_id_prefix": "test-"}}',
+                headers=JSON_CONTENT_TYPE_HEADER
+            )
+
+        assert [result['user_id'] for result in json.loads(response.data.decode())['results']] == [
+            'test-1', 'test-2', 'test-3'
+        ]
+        assert mock_db_access.delete_users.mock_calls == [
+            call(min_failed_logins=None, user_id_prefix='test-', after_user_id='', limit=2),
+            call(min_failed_logins=None, user_id_prefix='test-', after_user_id='test-2', limit=2),
+        ]
+
+    def test_delete_users_returns_400_when_filter_would_match_every_user(self):
+        mock_db_access = MagicMock()
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            DELETE_USERS_ROUTE,
+            data='{"filter": {"min_failed_logins": 0}}',
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 400
+        assert mock_db_access.delete_users.mock_calls == []
+
+    @pytest.mark.parametrize('route', [UNLOCK_ACCOUNTS_ROUTE, DELETE_USERS_ROUTE])
+    @pytest.mark.parametrize('body', [
+        '{"filter": {}}',
+        '{"filter": {"min_failed_logins": null}}',
+        '{"filter": {"min_failed_logins": null, "user_id_prefix": null}}',
+    ])
+    def test_bulk_admin_operations_return_400_when_filter_has_no_criteria(self, route, body):
+        mock_db_access = MagicMock()
+        server.db_access = mock_db_access
+
+        response = self.app.post(route, data=body, headers=JSON_CONTENT_TYPE_HEADER)
+
+        assert response.status_code == 400
+        assert response.data.decode() == INVALID_REQUEST_RESPONSE_BODY
+        assert mock_db_access.unlock_accounts.mock_calls == []
+        assert mock_db_access.delete_users.mock_calls == []
+
+    def test_delete_users_returns_400_when_filter_invalid(self):
+        response = self.app.post(
+            DELETE_USERS_ROUTE,
+            data='{"filter": {"min_failed_logins": "10"}}',
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        assert response.status_code == 400
+
+    def test_export_users_streams_users_as_ndjson_by_default(self):
+        mock_db_access = MagicMock()
+        mock_db_access.export_users.return_value = iter([('userid1', 0), ('userid2', 11)])
+        server.db_access = mock_db_access
+
+        response = self.app.get(EXPORT_USERS_ROUTE)
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        assert response.data.decode() == (
+            '{"user_id": "userid1", "failed_logins": 0}\n'
+            '{"user_id": "userid2", "failed_logins": 11}\n'
+        )
+        mock_db_access.export_users.assert_called_once_with(False)
+
+    def test_export_users_streams_users_with_hashes_as_csv(self):
+        mock_db_access = MagicMock()
+        mock_db_access.export_users.return_value = iter([('userid1', 0, 'hash1')])
+        server.db_access = mock_db_access
+
+        response = self.app.get(EXPORT_USERS_ROUTE + '?format=csv&include_password_hash=true')
+
+        assert response.mimetype == 'text/csv'
+        assert response.data.decode() == 'user_id,failed_logins,password_hash\nuserid1,0,hash1\n'
+        mock_db_access.export_users.assert_called_once_with(True)
+
+    def test_export_users_returns_400_when_format_unknown(self):
+        response = self.app.get(EXPORT_USERS_ROUTE + '?format=xml')
+
+        assert response.status_code == 400
+
+    @patch('service.health.db_access.get_user', return_value=None)
     def test_health_returns_200_response_when_db_responds_properly(self, mock_get_user):
         response = self.app.get(HEALTH_ROUTE)
         assert response.status_code == 200
-        assert response.data.decode() == '{"status": "ok"}'
+        assert json.loads(response.data.decode())['status'] == 'ok'
 
-    @patch('service.server.db_access.get_user', side_effect=Exception('Test exception'))
-    def test_health_returns_500_response_when_db_access_fails(self, mock_get_user):
+    @patch('service.health.db_access.get_user', return_value=None)
+    @patch('service.server.db_pool.get_stats', return_value={'size': 5, 'checked_out': 1})
+    def test_health_includes_db_pool_stats(self, mock_get_stats, mock_get_user):
+        response = self.app.get(HEALTH_ROUTE)
+
+        assert response.status_code == 200
+        assert json.loads(response.data.decode())['db_pool'] == {'size': 5, 'checked_out': 1}
+
+    @patch('service.health.db_access.get_user', side_effect=Exception('Test exception'))
+    @patch('service.server.db_pool.get_stats', return_value=None)
+    def test_health_returns_500_response_when_db_access_fails(self, mock_get_stats, mock_get_user):
         response = self.app.get(HEALTH_ROUTE)
 
         assert response.status_code == 500
         json_response = json.loads(response.data.decode())
-        assert json_response == {
-            'status': 'error',
-            'errors': ['Problem talking to PostgreSQL: Test exception'],
+        assert json_response['status'] == 'error'
+        assert json_response['errors'] == ['Problem talking to PostgreSQL: Test exception']
+
+    @patch('service.server.health.check_db')
+    def test_health_returns_cached_probe_result(self, mock_check_db):
+        mock_check_db.return_value = ProbeResult(None, 0.0025, time.time() - 2)
+
+        response = self.app.get(HEALTH_ROUTE)
+
+        assert response.status_code == 200
+        json_response = json.loads(response.data.decode())
+        assert json_response['status'] == 'ok'
+        assert json_response['probe_latency_ms'] == 2.5
+        assert 2 <= json_response['age_seconds'] < 3
+
+    @patch('service.health.db_access.get_user', side_effect=Exception('Test exception'))
+    def test_liveness_check_returns_200_without_db_access(self, mock_get_user):
+        response = self.app.get(LIVENESS_ROUTE)
+
+        assert response.status_code == 200
+        assert response.data.decode() == '{"status": "ok"}'
+        assert mock_get_user.mock_calls == []
+
+    @patch('service.health.db_access.get_user', side_effect=Exception('Test exception'))
+    def test_readiness_check_returns_503_when_db_access_fails(self, mock_get_user):
+        response = self.app.get(READINESS_ROUTE)
+
+        assert response.status_code == 503
+        assert json.loads(response.data.decode())['status'] == 'error'
+
+    def test_metrics_returns_404_when_metrics_not_enabled(self):
+        response = self.app.get(METRICS_ROUTE)
+
+        assert response.status_code == 404
+        assert response.data.decode() == '{"error": "Metrics not enabled"}'
+
+    def test_metrics_include_requests_and_authentication_outcomes(self):
+        mock_db_access = MagicMock()
+        mock_db_access.get_user_credentials.return_value = None
+        server.db_access = mock_db_access
+
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            with patch.dict('config.CONFIG_DICT', {'METRICS_DIR': metrics_dir}):
+                self.app.post(
+                    AUTHENTICATE_ROUTE,
+                    data='{"credentials": {"user_id": "userid1", "password": "somepassword"}}',
+                    headers=JSON_CONTENT_TYPE_HEADER
+                )
+                response = self.app.get(METRICS_ROUTE)
+
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+        lines = response.data.decode().splitlines()
+        assert 'login_api_authentication_outcomes_total{outcome="unknown_user"} 1.0' in lines
+        assert (
+            'login_api_request_duration_seconds_count'
+            '{method="POST",route="/user/authenticate",status="401"} 1.0'
+        ) in lines
+
+    @patch.dict('config.CONFIG_DICT', {'SERVER_TIMING': True})
+    def test_authenticate_user_adds_server_timing_header_when_enabled(self):
+        mock_db_access = MagicMock()
+        mock_db_access.get_user_credentials.return_value = None
+        server.db_access = mock_db_access
+
+        response = self.app.post(
+            AUTHENTICATE_ROUTE,
+            data='{"credentials": {"user_id": "userid1", "password": "somepassword"}}',
+            headers=JSON_CONTENT_TYPE_HEADER
+        )
+
+        phases = [
+            phase.split(';')[0] for phase in response.headers['Server-Timing'].split(', ')
+        ]
+        assert phases == ['parse', 'hash', 'db', 'serialise', 'app', 'total']
+
+    @patch.dict('config.CONFIG_DICT', {'SERVER_TIMING': True})
+    @patch('service.server.json.dumps', side_effect=lambda body: time.sleep(0.01) or '{}')
+    def test_liveness_check_times_serialising_response(self, mock_dumps):
+        response = self.app.get(LIVENESS_ROUTE)
+
+        durations = dict(
+            phase.split(';dur=') for phase in response.headers['Server-Timing'].split(', ')
+        )
+        assert float(durations['serialise']) >= 10
+
+    def test_authenticate_user_adds_no_server_timing_header_by_default(self):
+        response = self.app.post(AUTHENTICATE_ROUTE, data='{}', headers=JSON_CONTENT_TYPE_HEADER)
+        assert 'Server-Timing' not in response.headers
+
+    def test_start_profile_returns_404_when_profiler_not_enabled(self):
+        response = self.app.post(PROFILE_ROUTE)
+        assert response.status_code == 404
+
+    @patch.dict('service.server.app.config', {'PROFILER_TOKEN': 'secret'})
+    def test_start_profile_returns_401_when_token_wrong(self):
+        response = self.app.post(PROFILE_ROUTE, headers={'Authorization': 'Bearer wrong'})
+        assert response.status_code == 401
+
+    @patch.dict('service.server.app.config', {'PROFILER_TOKEN': 'secret'})
+    def test_start_profile_returns_401_when_token_not_ascii(self):
+        response = self.app.post(PROFILE_ROUTE, headers={'Authorization': 'Bearer s\xe9cret'})
+        assert response.status_code == 401
+
+    @patch.dict('service.server.app.config', {'PROFILER_TOKEN': 's\xe9cret'})
+    @patch('service.server.profiler.get_profiler')
+    def test_start_profile_accepts_utf8_encoded_token(self, mock_get_profiler):
+        mock_get_profiler.return_value.start.return_value = '/tmp/profile-1.folded'
+        authorization = 'Bearer s\xe9cret'.encode().decode('latin-1')
+        response = self.app.post(PROFILE_ROUTE, headers={'Authorization': authorization})
+        assert response.status_code == 200
+
+    @patch.dict('service.server.app.config', {'PROFILER_TOKEN': 'secret'})
+    @patch('service.server.profiler.get_profiler')
+    def test_start_profile_starts_profiler_for_given_seconds(self, mock_get_profiler):
+        mock_get_profiler.return_value.start.return_value = '/tmp/profile-1.folded'
+
+        response = self.app.post(
+            PROFILE_ROUTE + '?seconds=5', headers={'Authorization': 'Bearer secret'}
+        )
+
+        assert response.status_code == 200
+        assert json.loads(response.data.decode()) == {
+            'profiling': True, 'seconds': 5.0, 'output_path': '/tmp/profile-1.folded'
         }
+        mock_get_profiler.return_value.start.assert_called_once_with(5.0)
+
+    @patch.dict('service.server.app.config', {'PROFILER_TOKEN': 'secret'})
+    def test_start_profile_returns_400_when_seconds_invalid(self):
+        for seconds in ['0', 'abc', str(server.MAX_PROFILE_SECONDS + 1)]:
+            response = self.app.post(
+                PROFILE_ROUTE + '?seconds=' + seconds, headers={'Authorization': 'Bearer secret'}
+            )
+            assert response.status_code == 400
@@ -0,0 +1,34 @@
+from service import user_export
+
+
+class TestUserExport:
+
+    def test_format_users_returns_ndjson_lines(self):
+        rows = [('userid1', 0), ('userid2', 3)]
+
+        lines = list(user_export.format_users(rows, user_export.NDJSON, False))
+
+        assert lines == [
+            '{"user_id": "userid1", "failed_logins": 0}\n',
+            '{"user_id": "userid2", "failed_logins": 3}\n',
+        ]
+
+    def test_format_users_returns_csv_lines_with_header(self):
+        rows = [('userid1', 0, 'hash1'), ('user,id2', 3, 'hash2')]
+
+        lines = list(user_export.format_users(rows, user_export.CSV, True))
+
+        assert lines == [
+            'user_id,failed_logins,password_hash\n',
+            'userid1,0,hash1\n',
+            '"user,id2",3,hash2\n',
+        ]
+
+    def test_format_users_reads_rows_lazily(self):
+        def rows():
+            yield ('userid1', 0)
+            raise AssertionError('Read too far')
+
+        lines = user_export.format_users(rows(), user_export.NDJSON, False)
+
+        assert next(lines) == '{"user_id": "userid1", "failed_logins": 0}\n'
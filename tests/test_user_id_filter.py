@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+
+from service.user_id_filter import UserIdFilter
+
+CAPACITY = 1000
+FALSE_POSITIVE_RATE = 0.01
+REBUILD_INTERVAL = 3600
+
+
+def _get_user_ids():
+    return ['user{}'.format(i) for i in range(100)]
+
+
+class TestUserIdFilter:
+
+    def setup_method(self, method):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'user-id-filter')
+        self.filter = self._create_filter()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.directory)
+
+    def test_might_contain_returns_true_when_filter_not_built(self):
+        assert self.filter.might_contain('non-existing-user') is True
+
+    def test_might_contain_returns_true_for_all_users_filter_was_built_from(self):
+        self.filter.rebuild(_get_user_ids)
+        assert all(self.filter.might_contain(user_id) for user_id in _get_user_ids())
+
+    def test_might_contain_returns_false_for_user_not_in_filter(self):
+        self.filter.rebuild(_get_user_ids)
+        assert self.filter.might_contain('non-existing-user') is False
+
+    def test_might_contain_returns_true_for_added_user(self):
+        self.filter.rebuild(_get_user_ids)
+        self.filter.add('new-user')
+        assert self.filter.might_contain('new-user') is True
+
+    def test_user_added_through_one_filter_is_visible_through_another_sharing_the_file(self):
+        self.filter.rebuild(_get_user_ids)
+        other_filter = self._create_filter()
+
+        other_filter.add('new-user')
+
+        assert self.filter.might_contain('new-user') is True
+
+    def test_rebuild_does_nothing_when_filter_recently_built(self):
+        self.filter.rebuild(_get_user_ids)
+        assert self.filter.rebuild(_get_user_ids) is False
+
+    def test_forced_rebuild_drops_deleted_users_in_all_filters_sharing_the_file(self):
+        self.filter.rebuild(_get_user_ids)
+        other_filter = self._create_filter()
+        other_filter.add('deleted-user')
+
+        assert self.filter.rebuild(_get_user_ids, force=True) is True
+
+        assert other_filter.might_contain('deleted-user') is False
+        assert other_filter.might_contain('user1') is True
+
+    def test_stats_reports_memory_use_and_false_positive_rate(self):
+        self.filter.rebuild(_get_user_ids)
+
+        stats = self.filter.stats()
+
+        assert stats['built'] is True
+        assert stats['memory_bytes'] == os.path.getsize(self.path)
+        assert 0 < stats['estimated_false_positive_rate'] < FALSE_POSITIVE_RATE
+
+    def _create_filter(self):
+        return UserIdFilter(self.path, CAPACITY, FALSE_POSITIVE_RATE, REBUILD_INTERVAL)